@@ -6,12 +6,19 @@ config = {
     'impact_model_file': '../data_en/impact_model.pcl',
     # impact scales
     'spreadsheet_file': '../data_en/reading_impact_questionnaire_data.xlsx',
+    # export format of the human and model ratings: xlsx (spreadsheet_file), tsv or csv (files in rating_tables_dir)
+    'rating_export_format': 'xlsx',
+    'rating_tables_dir': '../data_en/rating_tables/',
     # directory for data files
     'data_dir': '../data_en/',
     # directory for generated images
     'image_dir': '../images_en/',
     # aggregated impact per review for a selection of novels
     'aggr_impact_file': '../data_en/top_268-review_sentences_100000-impact-per-review.csv',
+    # histograms of the number of matching rules per review, made from aggr_impact_file for the coverage plot,
+    # with values above coverage_max_value counted as coverage_max_value
+    'coverage_histogram_file': '../data_en/top_268-review_sentences_100000-impact-coverage-histograms.json',
+    'coverage_max_value': 50,
     'impact_scales': [
         'emotional_scale', 'style_scale', 'reflection_scale', 'narrative_scale',
         'surprise_scale', 'attention_scale', 'negative_scale', 'humor_scale'
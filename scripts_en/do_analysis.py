@@ -8,16 +8,21 @@ import plot
 from config import config
 
 
-def do_model_agreement_analysis(sentence_ratings: list, ira_threshold: float, config: dict):
+def do_model_agreement_analysis(sentence_ratings: list, ira_threshold: float, config: dict,
+                                rating_tensor: human_rater_analysis.RatingTensor = None):
+    if not rating_tensor:
+        rating_tensor = human_rater_analysis.RatingTensor(sentence_ratings, config['impact_scales'])
     model_agreement_high = {}
     model_agreement_low = {}
     print(f'\n\tImpact scale    \tTotal sentences\tIRA >= {ira_threshold}\tIRA < {ira_threshold}'
           + '\tIgnored (1 or 0 non-NA ratings)')
     for impact_scale in config['impact_scales']:
         sentences_high_ira = human_rater_analysis.get_sentences_high_ira(sentence_ratings, impact_scale,
-                                                                         ira_threshold, config['null_dist'])
+                                                                         ira_threshold, config,
+                                                                         rating_tensor=rating_tensor)
         sentences_low_ira = human_rater_analysis.get_sentences_low_ira(sentence_ratings, impact_scale,
-                                                                       ira_threshold, config['null_dist'])
+                                                                       ira_threshold, config,
+                                                                       rating_tensor=rating_tensor)
         model_agreement_high[impact_scale] = impact_model_analysis.get_model_agreement(sentences_high_ira, impact_scale)
         model_agreement_low[impact_scale] = impact_model_analysis.get_model_agreement(sentences_low_ira, impact_scale)
         ignored = len(sentence_ratings) - len(sentences_high_ira) - len(sentences_low_ira)
@@ -52,17 +57,17 @@ def show_rating_distribution(sentence_ratings: list, config):
 
 def do_analysis():
     print("Reading human ratings")
-    sentence_ratings = human_rater_analysis.get_sentence_ratings(config['ratings_file'])
     print("Plotting rating distribution")
-    plot.plot_num_annotations_distribution(sentence_ratings)
+    plot.plot_num_annotations_distribution(human_rater_analysis.iter_sentence_ratings(config['ratings_file']))
     print("\nRemoving sentences with fewer than 3 raters")
-    sentences_done = [sentence for sentence in sentence_ratings if sentence["excluded"] is False]
+    sentences_done = human_rater_analysis.get_sentence_ratings(config['ratings_file'], skip_excluded=True)
     print('\nAnalyzing null distributions')
     show_rating_distribution(sentences_done, config)
     print('\nCalculating interrater agreement using the inverse triangular null-distribution')
     config['null_dist'] = 'inverse_triangular'
     # config['null_dist'] = 'uniform'
-    ira_dist = human_rater_analysis.get_ira_dist(sentences_done, config)
+    rating_tensor = human_rater_analysis.RatingTensor(sentences_done, config['impact_scales'])
+    ira_dist = human_rater_analysis.get_ira_dist(sentences_done, config, rating_tensor=rating_tensor)
     plot.plot_per_sentence_ira_dist(ira_dist)
     ira_threshold = 0.5
     print("\nReading alpino parses of sentences")
@@ -70,13 +75,13 @@ def do_analysis():
     print("Scoring sentences on reading impact")
     impact_model_analysis.score_impact_sentences(sentences_done, sentence_alpino_data, config)
     print("Writing human and model ratings to spreadsheet")
-    human_rater_analysis.write_rating_spreadsheet(sentences_done, config)
+    human_rater_analysis.export_ratings(sentences_done, config)
     print(f"\nPlotting human model rating agreement for IRA >= {ira_threshold}")
-    do_model_agreement_analysis(sentences_done, ira_threshold, config)
+    do_model_agreement_analysis(sentences_done, ira_threshold, config, rating_tensor=rating_tensor)
     print(f"\nPerforming Mann-Whitney U test for IRA >= {ira_threshold}")
-    mann_whitney_u_test.do_mann_whitney_u_test(sentences_done, ira_threshold, config)
+    mann_whitney_u_test.do_mann_whitney_u_test(sentences_done, ira_threshold, config, rating_tensor=rating_tensor)
     print(f"\nMaking model boxplots for IRA>= {ira_threshold}")
-    plot.do_model_box_plot(sentences_done, ira_threshold, config)
+    plot.do_model_box_plot(sentences_done, ira_threshold, config, rating_tensor=rating_tensor)
     print()
     print(f"\nPlotting rule matching coverage over reviews")
     plot.plot_rule_coverage()
@@ -1,7 +1,10 @@
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 from collections import Counter, defaultdict
 from openpyxl import Workbook
+import numpy as np
+import csv
 import json
+import os
 import statistics
 
 
@@ -45,7 +48,7 @@ def calculate_avg_rater_score(impact_scale: str, sentence: dict, avg_type: str =
 # - normal: raters avoid extremes, so there is a central tendency -> expected variance = 1.04
 # - maximum dissensus: raters always choose extremes -> expected variance = 4
 # We use a five point Likert scale
-def calculate_sentence_interrater_agreement(rater_scores: List[int], null_dist: str) -> float:
+def get_expected_variance(null_dist: str) -> float:
     if null_dist == 'uniform':
         expected_var = 2
     elif null_dist == 'normal':     # See LeBreton and Senter (2008)
@@ -84,6 +87,11 @@ def calculate_sentence_interrater_agreement(rater_scores: List[int], null_dist:
         expected_var = 4
     else:
         raise ValueError('"null_dist" must be "normal", "uniform" or "max_dissensus"')
+    return expected_var
+
+
+def calculate_sentence_interrater_agreement(rater_scores: List[int], null_dist: str) -> float:
+    expected_var = get_expected_variance(null_dist)
     # The raters are the population, not a sample, so use population variance
     var = statistics.pvariance(rater_scores)
     # r^∗_{wg} = 1 − ( S_x^2 / σ^2 )
@@ -92,15 +100,21 @@ def calculate_sentence_interrater_agreement(rater_scores: List[int], null_dist:
 
 
 def get_sentences_high_ira(sentences: List[dict], impact_scale: str, ira_threshold: float,
-                           config: dict) -> List[dict]:
-    filtered = [sentence for sentence in sentences if len(get_rater_scores(sentence, impact_scale, config)) > 1]
-    return [sentence for sentence in filtered if get_sentence_ira(sentence, impact_scale, config) >= ira_threshold]
+                           config: dict, rating_tensor: "RatingTensor" = None) -> List[dict]:
+    if not rating_tensor:
+        rating_tensor = RatingTensor(sentences, config['impact_scales'])
+    selected = rating_tensor.has_agreement(impact_scale) \
+        & (rating_tensor.ira(impact_scale, config['null_dist']) >= ira_threshold)
+    return [sentences[index] for index in np.flatnonzero(selected)]
 
 
 def get_sentences_low_ira(sentences: List[dict], impact_scale: str, ira_threshold: float,
-                          config: dict) -> List[dict]:
-    filtered = [sentence for sentence in sentences if len(get_rater_scores(sentence, impact_scale, config)) > 1]
-    return [sentence for sentence in filtered if get_sentence_ira(sentence, impact_scale, config) < ira_threshold]
+                          config: dict, rating_tensor: "RatingTensor" = None) -> List[dict]:
+    if not rating_tensor:
+        rating_tensor = RatingTensor(sentences, config['impact_scales'])
+    selected = rating_tensor.has_agreement(impact_scale) \
+        & (rating_tensor.ira(impact_scale, config['null_dist']) < ira_threshold)
+    return [sentences[index] for index in np.flatnonzero(selected)]
 
 
 def get_sentence_ira(sentence: dict, impact_scale: str, config: dict) -> float:
@@ -112,11 +126,13 @@ def get_ira_scores(sentence_ratings: List[dict], impact_scale: str, config: dict
     return [get_sentence_ira(sentence, impact_scale, config) for sentence in sentence_ratings]
 
 
-def get_ira_dist(sentence_ratings: List[dict], config):
+def get_ira_dist(sentence_ratings: List[dict], config, rating_tensor: "RatingTensor" = None):
+    if not rating_tensor:
+        rating_tensor = RatingTensor(sentence_ratings, config['impact_scales'])
     ira_dist = defaultdict(Counter)
     for impact_scale in config['impact_scales']:
-        sentences_rated = [sent for sent in sentence_ratings if len(get_rater_scores(sent, impact_scale, config)) > 1]
-        ira_scores = get_ira_scores(sentences_rated, impact_scale, config)
+        sentences_rated = rating_tensor.has_agreement(impact_scale)
+        ira_scores = rating_tensor.ira(impact_scale, config['null_dist'])[sentences_rated].tolist()
         print(f'\t{impact_scale: <20}\tmean IRA:', statistics.mean(ira_scores), '\tstdev IRA:', statistics.stdev(ira_scores))
         for ira_score in ira_scores:
             ira_dist[impact_scale].update([get_ira_range(ira_score)])
@@ -156,38 +172,87 @@ def get_rater_scores(sentence: dict, impact_scale: str, config: dict) -> List[in
     return [anno[impact_scale] for anno in sentence["annotations"] if isinstance(anno[impact_scale], int)]
 
 
-def parse_annotations(sentence: dict, headers: List[str], sheet, annotation_row_num: int) -> None:
-    for annotation in sentence["annotations"]:
-        set_base_cells(sentence, sheet, annotation_row_num)
-        sheet.cell(column=3, row=annotation_row_num, value=annotation["annotator"])
-        column_num = 4
-        for header in headers[3:]:
-            sheet.cell(column=column_num, row=annotation_row_num, value=annotation[header])
-            column_num += 1
-        annotation_row_num += 1
-
-
-def set_base_cells(sentence: dict, sheet, row_num: int) -> None:
-    sheet.cell(column=1, row=row_num, value=sentence["sentence_id"])
-    sheet.cell(column=2, row=row_num, value=sentence["text"])
-
-
-def parse_impact_scale(impact_scale: str, sentence: dict, sheet, row_num: int) -> None:
-    set_base_cells(sentence, sheet, row_num)
+def parse_rating(rating) -> Union[int, None]:
+    """returns a rating as int, or None for NA and missing ratings"""
+    if isinstance(rating, int) and not isinstance(rating, bool):
+        return rating
+    if isinstance(rating, str) and rating.isdigit():
+        return int(rating)
+    return None
+
+
+class RatingTensor(object):
+
+    def __init__(self, sentences: List[dict], impact_scales: List[str]):
+        """
+        Ratings of sentences as a sentences x annotator slots x impact scales array, with NaN for NA ratings
+        and unused annotator slots. Rows follow the order of the sentences list. Counts, means, medians,
+        variances and IRA scores are computed for all sentences and scales at once.
+        """
+        self.impact_scales = list(impact_scales)
+        num_slots = max([len(sentence["annotations"]) for sentence in sentences] + [1])
+        self.ratings = np.full((len(sentences), num_slots, len(self.impact_scales)), np.nan)
+        for sentence_index, sentence in enumerate(sentences):
+            for anno_index, annotation in enumerate(sentence["annotations"]):
+                for scale_index, impact_scale in enumerate(self.impact_scales):
+                    rating = parse_rating(annotation.get(impact_scale))
+                    if rating is not None:
+                        self.ratings[sentence_index, anno_index, scale_index] = rating
+        self.na_mask = np.isnan(self.ratings)
+        self.counts = (~self.na_mask).sum(axis=1)
+        ratings = np.where(self.na_mask, 0.0, self.ratings)
+        sums = ratings.sum(axis=1)
+        sums_of_squares = (ratings ** 2).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.means = sums / self.counts
+            # The sums of integer ratings are exact, so the population variance is rounded only once,
+            # giving the same values as statistics.pvariance
+            self.variances = (self.counts * sums_of_squares - sums ** 2) / self.counts ** 2
+        # NaNs are sorted to the end, so the median lies within the first count ratings
+        sorted_ratings = np.sort(self.ratings, axis=1)
+        lower = np.take_along_axis(sorted_ratings, np.maximum((self.counts - 1) // 2, 0)[:, None, :], axis=1)[:, 0, :]
+        upper = np.take_along_axis(sorted_ratings, (self.counts // 2)[:, None, :], axis=1)[:, 0, :]
+        self.medians = np.where(self.counts > 0, (lower + upper) / 2, np.nan)
+
+    def scale_index(self, impact_scale: str) -> int:
+        return self.impact_scales.index(impact_scale)
+
+    def has_agreement(self, impact_scale: str) -> np.ndarray:
+        """sentences with at least two non-NA ratings, for which agreement can be measured"""
+        return self.counts[:, self.scale_index(impact_scale)] > 1
+
+    def ira(self, impact_scale: str, null_dist: str) -> np.ndarray:
+        """r*wg interrater agreement per sentence, only meaningful for sentences with agreement"""
+        return 1 - (self.variances[:, self.scale_index(impact_scale)] / get_expected_variance(null_dist))
+
+    def median(self, impact_scale: str) -> np.ndarray:
+        return self.medians[:, self.scale_index(impact_scale)]
+
+    def mean(self, impact_scale: str) -> np.ndarray:
+        return self.means[:, self.scale_index(impact_scale)]
+
+    def count(self, impact_scale: str) -> np.ndarray:
+        return self.counts[:, self.scale_index(impact_scale)]
+
+
+def make_annotation_rows(sentence: dict, headers: List[str]) -> List[list]:
+    return [[sentence["sentence_id"], sentence["text"], annotation["annotator"]]
+            + [annotation[header] for header in headers[3:]] for annotation in sentence["annotations"]]
+
+
+def make_impact_scale_row(impact_scale: str, sentence: dict) -> list:
     num_annotators = len(sentence["annotations"])
     total_score = sum([anno[impact_scale] for anno in sentence["annotations"] if isinstance(anno[impact_scale], int)])
     avg_score = total_score / num_annotators
     has_na = len([anno[impact_scale] for anno in sentence["annotations"] if anno[impact_scale] == "NA"]) > 0
-    for anno_index, anno in enumerate(sentence["annotations"]):
-        col = anno_index + 3
-        sheet.cell(column=col, row=row_num, value=anno[impact_scale])
     rule_based_score = 0
     if impact_scale in sentence["model_impact_score"]:
         rule_based_score = sentence["model_impact_score"][impact_scale]
-    sheet.cell(column=8, row=row_num, value=num_annotators)
-    sheet.cell(column=9, row=row_num, value=avg_score)
-    sheet.cell(column=10, row=row_num, value=has_na)
-    sheet.cell(column=11, row=row_num, value=rule_based_score)
+    # annotator scores fill the columns from the third onwards, the summary columns start at the eighth
+    row = [sentence["sentence_id"], sentence["text"]] + [anno[impact_scale] for anno in sentence["annotations"]]
+    row += [None] * (11 - len(row))
+    row[7:11] = [num_annotators, avg_score, has_na, rule_based_score]
+    return row
 
 
 def clear_unanswerable_scales(sentence: dict) -> None:
@@ -200,63 +265,203 @@ def clear_unanswerable_scales(sentence: dict) -> None:
                 del annotation[impact_scale]
 
 
-def get_sentence_ratings(data_file: str) -> List[dict]:
+def iter_json_documents(data_file: str, chunk_size: int = 65536) -> Iterator[dict]:
+    """
+    Read the documents of a JSON array or a newline-delimited JSON file one at a time,
+    decoding the file in chunks instead of loading it as a whole.
+    """
+    decoder = json.JSONDecoder()
     with open(data_file, 'rt') as fh:
-        data = json.load(fh)
-    sentence_ratings = [sentence_doc["_source"] if "_source" in sentence_doc else sentence_doc
-                        for sentence_doc in data]
-    for sentence in sentence_ratings:
+        buffer = ""
+        position = 0
+        in_array = None
+        read_size = chunk_size
+        at_end = False
+        while True:
+            while position < len(buffer) and (buffer[position].isspace() or (in_array and buffer[position] == ",")):
+                position += 1
+            if position == len(buffer):
+                if at_end:
+                    break
+                buffer, position = fh.read(read_size), 0
+                at_end = len(buffer) < read_size
+                continue
+            if in_array is None:
+                in_array = buffer[position] == "["
+                if in_array:
+                    position += 1
+                continue
+            if in_array and buffer[position] == "]":
+                break
+            try:
+                document, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+                # the document continues beyond the buffer, read more (and more each time for large documents)
+                more = fh.read(read_size)
+                at_end = len(more) < read_size
+                buffer, position = buffer[position:] + more, 0
+                read_size *= 2
+                continue
+            read_size = chunk_size
+            position = end
+            yield document
+
+
+def iter_sentence_ratings(data_file: str, annotation_status: str = None,
+                          skip_excluded: bool = False) -> Iterator[dict]:
+    """
+    Yield the sentences of a judgements file (JSON array or newline-delimited JSON) one at a time,
+    unwrapping Elasticsearch _source documents and clearing the scales of unanswerable annotations.
+    Optionally only sentences with the given annotation status and/or that are not excluded are yielded.
+    """
+    for sentence_doc in iter_json_documents(data_file):
+        sentence = sentence_doc["_source"] if "_source" in sentence_doc else sentence_doc
+        if annotation_status and sentence["annotation_status"] != annotation_status:
+            continue
+        if skip_excluded and sentence.get("excluded") is not False:
+            continue
         clear_unanswerable_scales(sentence)
-    return sentence_ratings
+        yield sentence
 
 
-def write_rating_spreadsheet(sentence_ratings: List[dict], config: dict) -> None:
-    wb = Workbook()
-    sheets = {
-        "annotations": wb.active,
-    }
+def iter_sentence_rating_batches(data_file: str, batch_size: int = 1000, annotation_status: str = None,
+                                 skip_excluded: bool = False) -> Iterator[List[dict]]:
+    """yield the sentences of a judgements file in lists of at most batch_size sentences"""
+    batch = []
+    for sentence in iter_sentence_ratings(data_file, annotation_status=annotation_status,
+                                          skip_excluded=skip_excluded):
+        batch.append(sentence)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    impact_scales = ["emotional_scale", "style_scale", "reflection_scale", "narrative_scale", "emotional_valence"]
-    for impact_scale in impact_scales:
-        sheets[impact_scale] = wb.create_sheet(title=impact_scale)
-        sheets[impact_scale].append(
-            ["sentence_id", "text", "annotator1", "annotator2", "annotator3", "annotator4", "annotator5",
-             "num_annotators", "avg_score", "has_NA", "impact_model_score"])
-
-    headers = [
-        'sentence_id',
-        'text',
-        'annotator',
-        'emotional_scale',
-        'emotional_valence',
-        'style_scale',
-        'reflection_scale',
-        'narrative_scale',
-        'unanswerable',
-        'num_modifications',
-        'created',
-        'modified',
-    ]
-
-    wb.active.append(headers)
-
-    header_row = ["sentence_id"]
-    for header in headers:
-        if header == "sentence_id":
-            continue
-        for i in range(1, 4):
-            header_row += ["{}_{}".format(header, i)]
 
-    impact_row_num = 2
-    annotation_row_num = 2
-    for sentence in sentence_ratings:
-        complete_columns(sentence, headers)
-        for impact_scale in impact_scales:
-            sheet = sheets[impact_scale]
-            parse_impact_scale(impact_scale, sentence, sheet, impact_row_num)
-        parse_annotations(sentence, headers, sheets["annotations"], annotation_row_num)
-        annotation_row_num += len(sentence["annotations"])
-        impact_row_num += 1
+def get_sentence_ratings(data_file: str, annotation_status: str = None, skip_excluded: bool = False) -> List[dict]:
+    return list(iter_sentence_ratings(data_file, annotation_status=annotation_status, skip_excluded=skip_excluded))
+
+
+# rows per sheet in Excel, including the header row
+SHEET_MAX_ROWS = 1048576
+
+EXPORT_SCALES = ["emotional_scale", "style_scale", "reflection_scale", "narrative_scale", "emotional_valence"]
+
+RATING_HEADERS = [
+    'sentence_id',
+    'text',
+    'annotator',
+    'emotional_scale',
+    'emotional_valence',
+    'style_scale',
+    'reflection_scale',
+    'narrative_scale',
+    'unanswerable',
+    'num_modifications',
+    'created',
+    'modified',
+]
+
+IMPACT_SCALE_HEADERS = ["sentence_id", "text", "annotator1", "annotator2", "annotator3", "annotator4", "annotator5",
+                        "num_annotators", "avg_score", "has_NA", "impact_model_score"]
 
+
+def get_rating_table_headers() -> Dict[str, List[str]]:
+    """returns the header row of each rating table, in the order of the spreadsheet sheets"""
+    table_headers = {"annotations": RATING_HEADERS}
+    for impact_scale in EXPORT_SCALES:
+        table_headers[impact_scale] = IMPACT_SCALE_HEADERS
+    return table_headers
+
+
+def iter_rating_table_rows(sentence_ratings: Iterable[dict]) -> Iterator[Tuple[str, list]]:
+    """yields (table name, row) pairs for the ratings of each sentence, completing its columns once"""
+    for sentence in sentence_ratings:
+        complete_columns(sentence, RATING_HEADERS)
+        for impact_scale in EXPORT_SCALES:
+            yield impact_scale, make_impact_scale_row(impact_scale, sentence)
+        for row in make_annotation_rows(sentence, RATING_HEADERS):
+            yield "annotations", row
+
+
+class RolloverSheet(object):
+
+    def __init__(self, workbook: Workbook, title: str, header_row: List[str], max_rows: int = SHEET_MAX_ROWS):
+        """
+        Appends rows to a sheet of a write-only workbook, continuing in a new sheet (title_2, title_3, ...)
+        with the same header row when a sheet reaches max_rows.
+        """
+        self.workbook = workbook
+        self.title = title
+        self.header_row = header_row
+        self.max_rows = max_rows
+        self.num_sheets = 0
+        self.sheet = None
+        self.num_rows = 0
+        self.add_sheet()
+
+    def add_sheet(self) -> None:
+        self.num_sheets += 1
+        title = self.title if self.num_sheets == 1 else f"{self.title}_{self.num_sheets}"
+        self.sheet = self.workbook.create_sheet(title=title)
+        self.sheet.append(self.header_row)
+        self.num_rows = 1
+
+    def append(self, row: list) -> None:
+        if self.num_rows >= self.max_rows:
+            self.add_sheet()
+        self.sheet.append(row)
+        self.num_rows += 1
+
+
+def write_rating_spreadsheet(sentence_ratings: Iterable[dict], config: dict, max_rows: int = SHEET_MAX_ROWS) -> None:
+    """
+    Write the ratings to an xlsx file with an annotations sheet and a sheet per impact scale. The workbook
+    is written in openpyxl's write-only mode, so rows are streamed to the file instead of kept in memory.
+    """
+    wb = Workbook(write_only=True)
+    sheets = {title: RolloverSheet(wb, title, header_row, max_rows=max_rows)
+              for title, header_row in get_rating_table_headers().items()}
+    for title, row in iter_rating_table_rows(sentence_ratings):
+        sheets[title].append(row)
     print(f'\twriting ratings to spreadsheet file {config["spreadsheet_file"]}')
     wb.save(filename=config['spreadsheet_file'])
+
+
+def write_rating_tables(sentence_ratings: Iterable[dict], output_dir: str, delimiter: str = "\t") -> List[str]:
+    """
+    Write the ratings as a bundle of flat files, one per spreadsheet sheet with the same columns.
+    Files are tab separated (.tsv) by default or comma separated (.csv). Returns the file names.
+    """
+    extension = "tsv" if delimiter == "\t" else "csv"
+    os.makedirs(output_dir, exist_ok=True)
+    output_files = {}
+    file_handles = {}
+    writers = {}
+    try:
+        for title, header_row in get_rating_table_headers().items():
+            output_files[title] = os.path.join(output_dir, f"{title}.{extension}")
+            file_handles[title] = open(output_files[title], 'wt', newline='')
+            writers[title] = csv.writer(file_handles[title], delimiter=delimiter)
+            writers[title].writerow(header_row)
+        for title, row in iter_rating_table_rows(sentence_ratings):
+            writers[title].writerow(row)
+    finally:
+        for fh in file_handles.values():
+            fh.close()
+    print(f'\twriting ratings to {extension} files in {output_dir}')
+    return list(output_files.values())
+
+
+def export_ratings(sentence_ratings: Iterable[dict], config: dict) -> None:
+    """export the ratings in the format set in the config: xlsx (default), tsv or csv"""
+    export_format = config.get('rating_export_format', 'xlsx')
+    if export_format == 'xlsx':
+        write_rating_spreadsheet(sentence_ratings, config)
+    elif export_format in ['tsv', 'csv']:
+        write_rating_tables(sentence_ratings, config['rating_tables_dir'],
+                            delimiter="\t" if export_format == 'tsv' else ",")
+    else:
+        raise ValueError('"rating_export_format" must be "xlsx", "tsv" or "csv"')
@@ -7,6 +7,8 @@ import pickle
 from collections import Counter
 import csv
 
+import numpy as np
+
 from alpino_matcher import AlpinoMatcher
 import human_rater_analysis
 
@@ -79,25 +81,23 @@ def score_impact_sentences(sentence_ratings: List[dict], sentence_alpino_data: d
         # break
 
 
-def sample_model_scores(sentence_ratings: list, impact_scale: str,
-                        ira_threshold: float, config: dict) -> Tuple[List[float], List[float]]:
+def sample_model_scores(sentence_ratings: list, impact_scale: str, ira_threshold: float, config: dict,
+                        rating_tensor: human_rater_analysis.RatingTensor = None) -> Tuple[List[float], List[float]]:
+    if not rating_tensor:
+        rating_tensor = human_rater_analysis.RatingTensor(sentence_ratings, [impact_scale])
+    # skip sentences with only a single rating (and the rest NAs) or with only NAs,
+    # and sentences where the IRA is below a given threshold
+    selected = rating_tensor.has_agreement(impact_scale) \
+        & (rating_tensor.ira(impact_scale, config['null_dist']) >= ira_threshold)
+    rater_scores = rating_tensor.median(impact_scale)
     sample_0 = []
     sample_1 = []
-    for sentence in sentence_ratings:
-        scores = human_rater_analysis.get_rater_scores(sentence, impact_scale)
-        # skip sentences with only a single rating (and the rest NAs) or with only NAs
-        if len(scores) < 2:
-            continue
-        ira_score = human_rater_analysis.calculate_sentence_interrater_agreement(scores, config['null_dist'])
-        # skip sentences where the IRA is below a given threshold
-        if ira_score < ira_threshold:
-            continue
-        model_score = sentence["model_impact_score"][impact_scale]
-        rater_score = human_rater_analysis.calculate_avg_rater_score(impact_scale, sentence, avg_type="median")
+    for index in np.flatnonzero(selected):
+        model_score = sentence_ratings[index]["model_impact_score"][impact_scale]
         if model_score >= 1:
-            sample_1 += [float(rater_score)]
+            sample_1 += [float(rater_scores[index])]
         else:
-            sample_0 += [float(rater_score)]
+            sample_0 += [float(rater_scores[index])]
     return sample_0, sample_1
 
 
@@ -0,0 +1,137 @@
+from typing import Dict, Iterable, Iterator, List, Tuple
+import gzip
+import json
+import os
+import tarfile
+
+INDEX_VERSION = 1
+
+
+def get_member_sentence_id(member_name: str) -> str:
+    """returns the sentence id from an archive member name like <archive>.sentence-<id>.alpino_parsed.json"""
+    sent_info = member_name.split(".")[1]
+    return sent_info.replace("sentence-", "")
+
+
+def make_archive_index(archive_file: str) -> dict:
+    """
+    Index the parsed sentence files in a (gzipped) tar archive by their sentence id.
+    Offsets are positions of the file content in the uncompressed tar stream.
+    """
+    sentences = []
+    with tarfile.open(archive_file, 'r:*') as tar:
+        for member in tar:
+            if not member.isfile() or ".json" not in member.name:
+                continue
+            sentences.append([get_member_sentence_id(member.name), member.offset_data, member.size])
+    archive_stat = os.stat(archive_file)
+    return {
+        "index_version": INDEX_VERSION,
+        "archive_size": archive_stat.st_size,
+        "archive_mtime": archive_stat.st_mtime,
+        "sentences": sentences
+    }
+
+
+def is_valid_index(archive_index: dict, archive_file: str) -> bool:
+    """check that an index was made with the current index version for the archive as it is now"""
+    archive_stat = os.stat(archive_file)
+    return archive_index.get("index_version") == INDEX_VERSION \
+        and archive_index.get("archive_size") == archive_stat.st_size \
+        and archive_index.get("archive_mtime") == archive_stat.st_mtime
+
+
+def read_archive_index(archive_file: str, index_file: str = None) -> dict:
+    """read the sidecar index of an archive, making and writing it if it is missing or out of date"""
+    if not index_file:
+        index_file = archive_file + ".index.json"
+    if os.path.isfile(index_file):
+        try:
+            with open(index_file, 'rt') as fh:
+                archive_index = json.load(fh)
+        except ValueError:
+            # e.g. an index that was cut off by an interrupted write, which is made again
+            archive_index = None
+        if isinstance(archive_index, dict) and is_valid_index(archive_index, archive_file):
+            return archive_index
+    archive_index = make_archive_index(archive_file)
+    with open(index_file + ".tmp", 'wt') as fh:
+        json.dump(archive_index, fh)
+    os.replace(index_file + ".tmp", index_file)
+    return archive_index
+
+
+class AlpinoArchiveReader(object):
+
+    def __init__(self, archive_file: str, index_file: str = None):
+        """
+        Random access reader for a tar archive of Alpino parsed sentences. Sentences are only read
+        and decoded when asked for. A sidecar index of sentence offsets is made once and reused.
+        For gzipped archives seeking backwards restarts decompression, so reading many sentences is
+        fastest in archive order, which read_sentences and iteration use.
+        A reader keeps an open file handle and should not be shared between threads.
+        """
+        self.archive_file = archive_file
+        archive_index = read_archive_index(archive_file, index_file=index_file)
+        self.sentence_ids = [sentence_id for sentence_id, _offset, _size in archive_index["sentences"]]
+        self.offsets = {sentence_id: (offset, size) for sentence_id, offset, size in archive_index["sentences"]}
+        self.fh = None
+
+    def __len__(self) -> int:
+        return len(self.sentence_ids)
+
+    def __contains__(self, sentence_id: str) -> bool:
+        return sentence_id in self.offsets
+
+    def __getitem__(self, sentence_id: str) -> dict:
+        return self.get(sentence_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.sentence_ids)
+
+    def keys(self) -> List[str]:
+        return list(self.sentence_ids)
+
+    def open(self):
+        if not self.fh:
+            with open(self.archive_file, 'rb') as fh:
+                is_gzip = fh.read(2) == b"\x1f\x8b"
+            self.fh = gzip.open(self.archive_file, 'rb') if is_gzip else open(self.archive_file, 'rb')
+        return self.fh
+
+    def close(self) -> None:
+        if self.fh:
+            self.fh.close()
+            self.fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_content(self, sentence_id: str) -> bytes:
+        """returns the raw content of the sentence file in the archive"""
+        if sentence_id not in self.offsets:
+            raise KeyError(sentence_id)
+        offset, size = self.offsets[sentence_id]
+        fh = self.open()
+        fh.seek(offset)
+        return fh.read(size)
+
+    def get(self, sentence_id: str) -> dict:
+        """returns the sentence record with the sentence_id and the JSON encoded Alpino parse (alpino_ds)"""
+        return json.loads(self.read_content(sentence_id))
+
+    def iter_sentences(self, sentence_ids: Iterable[str] = None) -> Iterator[Tuple[str, dict]]:
+        """yields (sentence_id, sentence record) pairs in archive order, for all or the given sentences"""
+        if sentence_ids is None:
+            sentence_ids = self.sentence_ids
+        else:
+            sentence_ids = sorted(set(sentence_ids), key=lambda sentence_id: self.offsets[sentence_id][0])
+        for sentence_id in sentence_ids:
+            yield sentence_id, self.get(sentence_id)
+
+    def read_sentences(self, sentence_ids: Iterable[str] = None) -> Dict[str, dict]:
+        """returns a dictionary of sentence records for all or the given sentences, read in a single pass"""
+        return {sentence_id: sentence for sentence_id, sentence in self.iter_sentences(sentence_ids)}
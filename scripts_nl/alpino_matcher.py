@@ -1,31 +1,15 @@
 #!/usr/local/bin/python
 import re
 import json
-from impact_model import ImpactModel
-from typing import Union, List, Dict
-
-
-def is_wildcard_term(term: str) -> bool:
-    """
-    Determine if term is a wildcard term, e.g. starts or ends with an asterix ("*").
-    Wildcards on both sides are not allowed, since this is reserved for special terms.
-    E.g. the asterixes in "*zucht*" (*sigh* in Dutch) carry meaning on how to interpret "zucht".
-    """
-    if term[0] == "*" and term[-1] == "*":
-        return False
-    elif term[0] == "*" or term[-1] == "*":
-        return True
-    else:
-        return False
+from collections import defaultdict
+from functools import cached_property
+from impact_model import ImpactModel, is_wildcard_term, make_wildcard_pattern, make_phrase_pattern
+from typing import Union, List, Dict, Set
 
 
 def wildcard_term_match(sentence_term: str, match_term: str) -> bool:
     """this function interprets wildcards in match terms and uses regex to match term against a sentence term"""
-    if match_term[0] == "*":
-        match_string = match_term[1:] + r"$"
-    elif match_term[-1] == "*":
-        match_string = match_term[1:] + r"$"
-    if re.search(match_string, sentence_term):
+    if make_wildcard_pattern(match_term).search(sentence_term):
         return True
     else:
         return False
@@ -45,6 +29,13 @@ def term_match(sentence_term: str, match_term: str) -> bool:
         return False
 
 
+def term_pattern_match(sentence_term: str, match_term: str, term_pattern=None) -> bool:
+    """matches a term against a sentence term, using the pre-compiled pattern of a wildcard term if given"""
+    if term_pattern:
+        return term_pattern.search(sentence_term) is not None
+    return sentence_term == match_term
+
+
 def lemma_term_match(lemma: str, term: str) -> bool:
     if is_wildcard_term(term):
         try:
@@ -102,6 +93,60 @@ class AlpinoSentence(object):
         self.sentence_string = alpino_ds["sentence"]["#text"]
         self.alpino_ds = alpino_ds
 
+    # Views on the sentence that are computed once, when first used, and shared by all rules and conditions.
+
+    @cached_property
+    def words(self) -> List[str]:
+        return [word_node["@word"] for word_node in self.word_nodes]
+
+    @cached_property
+    def lemmas(self) -> List[str]:
+        return [word_node["@lemma"] for word_node in self.word_nodes]
+
+    @cached_property
+    def pos_tags(self) -> List[str]:
+        return [word_node["@pos"] for word_node in self.word_nodes]
+
+    @cached_property
+    def lower_sentence_string(self) -> str:
+        return self.sentence_string.lower()
+
+    @cached_property
+    def lower_words(self) -> List[str]:
+        return [word.lower() for word in self.words]
+
+    @cached_property
+    def lower_lemmas(self) -> List[str]:
+        return [lemma.lower() for lemma in self.lemmas]
+
+    @cached_property
+    def word_set(self) -> Set[str]:
+        return set(self.words)
+
+    @cached_property
+    def lemma_set(self) -> Set[str]:
+        return set(self.lemmas)
+
+    @cached_property
+    def lower_word_set(self) -> Set[str]:
+        return set(self.lower_words)
+
+    @cached_property
+    def lower_lemma_set(self) -> Set[str]:
+        return set(self.lower_lemmas)
+
+    def get_words(self, ignorecase: bool = True) -> List[str]:
+        return self.lower_words if ignorecase else self.words
+
+    def get_lemmas(self, ignorecase: bool = True) -> List[str]:
+        return self.lower_lemmas if ignorecase else self.lemmas
+
+    def get_word_set(self, ignorecase: bool = True) -> Set[str]:
+        return self.lower_word_set if ignorecase else self.word_set
+
+    def get_lemma_set(self, ignorecase: bool = True) -> Set[str]:
+        return self.lower_lemma_set if ignorecase else self.lemma_set
+
     def validate_alpino_ds(self, alpino_ds: dict):
         """check that the given alpino parse is a valid alpino parse."""
         if not isinstance(alpino_ds, object):
@@ -115,17 +160,23 @@ class AlpinoSentence(object):
 
 class AlpinoMatcher(object):
 
-    def __init__(self, impact_model: dict, alpino_sentence=None, debug=False):
+    def __init__(self, impact_model: dict, alpino_sentence=None, debug=False, use_rule_index=True):
         if not impact_model or not isinstance(impact_model, ImpactModel):
             raise AlpinoError("AlpinoMatcher must be instantiated with an ImpactModel object")
         self.impact_model = impact_model
+        if not getattr(impact_model, "compiled", False):
+            # models unpickled without load_model have no compiled patterns and indexes yet
+            impact_model.compile()
         self.debug = debug
+        self.use_rule_index = use_rule_index
+        self.aspect_group_matches = {}
         if alpino_sentence:
             self.set_alpino_sentence(alpino_sentence)
         else:
             self.alpino_sentence = None
 
     def set_alpino_sentence(self, alpino_sentence: Union[AlpinoSentence, dict]):
+        self.aspect_group_matches = {}
         if isinstance(alpino_sentence, AlpinoSentence):
             self.alpino_sentence = alpino_sentence
         elif isinstance(alpino_sentence, dict):
@@ -140,56 +191,61 @@ class AlpinoMatcher(object):
         Use word_boundaries=False for pure string match
         """
         if word_boundaries:
-            return re.search(r"\b" + term + r"\b", self.alpino_sentence.sentence_string) is not None
+            pattern = make_phrase_pattern(term, ignorecase=False)
+            return pattern.search(self.alpino_sentence.sentence_string) is not None
         else:
             return term in self.alpino_sentence.sentence_string
 
+    def get_term_pattern(self, match_term: str):
+        """returns the pre-compiled pattern for a wildcard term or None for a term that requires an exact match"""
+        if is_wildcard_term(match_term):
+            return self.impact_model.wildcard_pattern(match_term)
+        return None
+
     def get_sentence_words_matching_term(self, match_term: str, ignorecase: bool = True) -> iter:
-        for word_index, word_node in enumerate(self.alpino_sentence.word_nodes):
-            word = word_node["@word"]
-            if ignorecase:
-                word = word.lower()
-                match_term = match_term.lower()
-            if term_match(word, match_term):
-                yield word_index, word_node
+        if ignorecase:
+            match_term = match_term.lower()
+        term_pattern = self.get_term_pattern(match_term)
+        if not term_pattern and match_term not in self.alpino_sentence.get_word_set(ignorecase):
+            return
+        for word_index, word in enumerate(self.alpino_sentence.get_words(ignorecase)):
+            if term_pattern_match(word, match_term, term_pattern):
+                yield word_index, self.alpino_sentence.word_nodes[word_index]
 
     def get_sentence_lemmas_matching_term(self, match_term, match_pos, ignorecase=True):
         if self.debug:
             print("looking for lemmas matching term:", match_term, match_pos)
-        for word_index, word_node in enumerate(self.alpino_sentence.word_nodes):
+        if ignorecase:
+            match_term = match_term.lower()
+        term_pattern = self.get_term_pattern(match_term)
+        if not self.debug and not term_pattern and match_term not in self.alpino_sentence.get_lemma_set(ignorecase):
+            return
+        pos_tags = self.alpino_sentence.pos_tags
+        for word_index, lemma in enumerate(self.alpino_sentence.get_lemmas(ignorecase)):
             if self.debug:
-                print("lemma:", word_node["@lemma"], "pos:", word_node["@pos"])
-            lemma = word_node["@lemma"]
-            if ignorecase:
-                lemma = lemma.lower()
-                match_term = match_term.lower()
-            if not term_match(lemma, match_term):
+                print("lemma:", self.alpino_sentence.lemmas[word_index], "pos:", pos_tags[word_index])
+            if not term_pattern_match(lemma, match_term, term_pattern):
                 continue
-            if not match_pos or word_node["@pos"] == match_pos or word_node["@pos"] == "name":
+            if not match_pos or pos_tags[word_index] == match_pos or pos_tags[word_index] == "name":
                 if self.debug:
                     print("MATCH OF LEMMA AND POS!")
-                yield word_index, word_node
+                yield word_index, self.alpino_sentence.word_nodes[word_index]
             elif self.debug:
                 print("MATCH OF LEMMA BUT NOT OF POS!")
-                print(word_node["@pos"])
+                print(pos_tags[word_index])
 
     def get_sentence_string_matching_term(self, match_term, location="neighbourhood", ignorecase=True):
         if self.debug:
             print("looking for sentence string matching phrase:", match_term, "and location", location)
-        sentence = self.alpino_sentence.sentence_string
-        if ignorecase:
-            sentence = sentence.lower()
-            match_term = match_term.lower()
+        pattern = make_phrase_pattern(match_term, location=location, ignorecase=ignorecase)
+        return self.get_sentence_string_matching_pattern(pattern)
+
+    def get_sentence_string_matching_pattern(self, pattern):
+        """yields all matches of a pre-compiled phrase pattern in the lowercased sentence string"""
         if self.debug:
-            print("sentence:", sentence)
-        match_string = r"\b" + match_term + r"\b"
-        if location == "sentence_start":
-            match_string = r"^" + match_string
-            if self.debug:
-                print("match_string", match_string)
-        elif location == "sentence_end":
-            match_string = match_string + r"$"
-        for match in re.finditer(match_string, self.alpino_sentence.sentence_string.lower()):
+            print("sentence:", self.alpino_sentence.lower_sentence_string)
+            print("match_string", pattern.pattern)
+        for match in pattern.finditer(self.alpino_sentence.lower_sentence_string):
             yield match
 
     def check_alpino_sentence(self, alpino_sentence):
@@ -202,8 +258,90 @@ class AlpinoMatcher(object):
     def match_rules(self, alpino_sentence=None):
         """Match alpino_sentence against all impact rules of the impact model."""
         self.check_alpino_sentence(alpino_sentence)
+        if self.use_rule_index:
+            return self.match_indexed_rules()
         return [match for impact_rule in self.impact_model.impact_rules for match in self.match_rule(impact_rule)]
 
+    def match_indexed_rules(self):
+        """
+        Match the sentence against all impact rules, using the lemma of each word to look up the
+        term rules it can match and a single scan for literals to select the phrase rules that can match.
+        Matches are returned in the same order as matching rule by rule.
+        """
+        rule_matches = defaultdict(list)
+        # only run the phrase patterns of which a required literal occurs in the sentence
+        phrase_rule_hits = self.impact_model.phrase_prefilter.scan(self.alpino_sentence.lower_sentence_string)
+        for rule_index, impact_rule in self.impact_model.phrase_rules:
+            if rule_index in phrase_rule_hits:
+                rule_matches[rule_index] = self.match_impact_phrase(impact_rule)
+        for rule_index, impact_index, impact_rule in self.get_term_rule_candidates():
+            match = self.match_impact_term_node(impact_rule, impact_index, self.alpino_sentence.word_nodes[impact_index])
+            if match:
+                rule_matches[rule_index].append(match)
+        return [match for rule_index in sorted(rule_matches) for match in rule_matches[rule_index]]
+
+    def get_term_rule_candidates(self) -> List[tuple]:
+        """returns sorted (rule index, word index, rule) triples of term rules matching the lemma and pos of a word"""
+        candidates = []
+        pos_tags = self.alpino_sentence.pos_tags
+        for term_rule_index in self.impact_model.term_rule_index.values():
+            lemmas = self.alpino_sentence.get_lemmas(term_rule_index.ignorecase)
+            for word_index, lemma in enumerate(lemmas):
+                for rule_index, impact_rule in term_rule_index.lookup(lemma):
+                    match_pos = impact_rule.impact_term.pos
+                    if not match_pos or pos_tags[word_index] == match_pos or pos_tags[word_index] == "name":
+                        candidates.append((rule_index, word_index, impact_rule))
+        candidates.sort(key=lambda candidate: candidate[:2])
+        return candidates
+
+    def count_rule_matches(self, alpino_sentence=None, max_count: int = 1) -> Dict[str, int]:
+        """
+        Count the matches of the sentence per impact type, up to max_count. Once an impact type reaches
+        max_count its remaining rules are skipped, and no match payloads are made. Rules without an impact
+        type are not evaluated. With max_count=1 the counts signal only whether any rule of a type matched.
+        """
+        self.check_alpino_sentence(alpino_sentence)
+        impact_counts = {}
+        term_rule_counts = defaultdict(int)
+        for rule_index, impact_index, impact_rule in self.get_term_rule_candidates():
+            term_rule_counts[rule_index] += 1
+        phrase_rule_hits = self.impact_model.phrase_prefilter.scan(self.alpino_sentence.lower_sentence_string)
+        for rule_index in sorted(set(term_rule_counts) | set(phrase_rule_hits)):
+            impact_rule = self.impact_model.impact_rules[rule_index]
+            impact_type = impact_rule.impact_type
+            if not impact_type or impact_counts.get(impact_type, 0) >= max_count:
+                continue
+            if impact_rule.impact_term.type == "phrase":
+                remaining = max_count - impact_counts.get(impact_type, 0)
+                num_matches = 0
+                for _match in self.get_sentence_string_matching_pattern(impact_rule.pattern):
+                    num_matches += 1
+                    if num_matches >= remaining:
+                        break
+            else:
+                num_matches = term_rule_counts[rule_index]
+            if num_matches and self.check_condition(impact_rule):
+                impact_counts[impact_type] = min(impact_counts.get(impact_type, 0) + num_matches, max_count)
+        return impact_counts
+
+    def check_condition(self, impact_rule) -> bool:
+        """check the condition of an impact rule without making match payloads. Conditions hold for the whole sentence."""
+        if not impact_rule.condition:
+            return True
+        if impact_rule.condition["condition_type"] == "aspect_term":
+            aspect_group = impact_rule.condition["aspect_group"]
+            if not self.impact_model.aspect_group(aspect_group):
+                match = False
+            else:
+                match = len(self.match_aspect_group(aspect_group, impact_rule.ignorecase)) > 0
+        elif impact_rule.condition["condition_type"] == "context_term":
+            match = impact_rule.condition_pattern.search(self.alpino_sentence.lower_sentence_string) is not None
+        else:
+            return False
+        if impact_rule.filter:
+            match = not match
+        return match
+
     def match_rule(self, impact_rule, alpino_sentence=None):
         """Match alpino_sentence against a specific impact rule."""
         self.check_alpino_sentence(alpino_sentence)
@@ -218,7 +356,7 @@ class AlpinoMatcher(object):
             print("match_phrase:", impact_rule.impact_term.string)
             print("impact_term:", impact_rule.impact_term)
             print("sentence:", self.alpino_sentence.sentence_string)
-        for match in self.get_sentence_string_matching_term(impact_rule.impact_term.string, ignorecase=impact_rule.ignorecase):
+        for match in self.get_sentence_string_matching_pattern(impact_rule.pattern):
             match = {
                 "match_term_offset": match.start(),
                 "match_term": match.group(0),
@@ -240,22 +378,29 @@ class AlpinoMatcher(object):
             print("match_term:", match_term, "match_pos:", match_pos)
             print("sentence:", self.alpino_sentence.sentence_string)
         for impact_index, impact_node in self.get_sentence_lemmas_matching_term(match_term, match_pos, ignorecase=impact_rule.ignorecase):
-            match = {
-                "match_term": impact_node["@word"],
-                "match_lemma": impact_node["@lemma"],
-                "impact_term_index": impact_index,
-                "impact_term": impact_rule.impact_term.string,
-                "impact_term_type": impact_rule.impact_term.type,
-                "impact_type": impact_rule.impact_type
-            }
-            if self.debug:
-                print("match term:", impact_node["@word"])
-            if self.match_condition(impact_rule, match):
+            match = self.match_impact_term_node(impact_rule, impact_index, impact_node)
+            if match:
                 matches.append(match)
-            elif self.debug:
-                print("PHRASE CONDITION NOT MET:", impact_rule.condition)
         return matches
 
+    def match_impact_term_node(self, impact_rule, impact_index, impact_node):
+        """returns the match of an impact rule for a word node of which the lemma matches the term, if the condition is met"""
+        match = {
+            "match_term": impact_node["@word"],
+            "match_lemma": impact_node["@lemma"],
+            "impact_term_index": impact_index,
+            "impact_term": impact_rule.impact_term.string,
+            "impact_term_type": impact_rule.impact_term.type,
+            "impact_type": impact_rule.impact_type
+        }
+        if self.debug:
+            print("match term:", impact_node["@word"])
+        if self.match_condition(impact_rule, match):
+            return match
+        elif self.debug:
+            print("PHRASE CONDITION NOT MET:", impact_rule.condition)
+        return None
+
     def match_condition(self, impact_rule, impact_match):
         match = False
         if not impact_rule.condition:
@@ -292,6 +437,12 @@ class AlpinoMatcher(object):
         if not aspect_info:
             print("Error - no aspect group info for aspect group:", aspect_group)
             return False
+        if self.use_rule_index:
+            aspect_matches = self.match_aspect_group(aspect_group, impact_rule.ignorecase)
+            if aspect_matches:
+                impact_match["aspect_match"] = [dict(aspect_match) for aspect_match in aspect_matches]
+                return True
+            return False
         for aspect_term in aspect_info["aspect_term"]:
             aspect_matches = []
             for aspect_index, aspect_node in self.get_sentence_words_matching_term(aspect_term, ignorecase=impact_rule.ignorecase):
@@ -320,13 +471,49 @@ class AlpinoMatcher(object):
                 return True
         return False
 
+    def match_aspect_group(self, aspect_group, ignorecase):
+        """returns the aspect matches of an aspect group in the sentence, which are computed once per sentence"""
+        key = (aspect_group, bool(ignorecase))
+        if key not in self.aspect_group_matches:
+            self.aspect_group_matches[key] = self.find_aspect_group_matches(aspect_group, bool(ignorecase))
+        return self.aspect_group_matches[key]
+
+    def find_aspect_group_matches(self, aspect_group, ignorecase):
+        """
+        Look up all words and lemmas of the sentence in the aspect group index in a single pass.
+        The first aspect term of the group that matches is used, preferring its word matches over lemma matches.
+        """
+        group_index = self.impact_model.aspect_group_term_index[ignorecase][aspect_group]
+        word_hits = defaultdict(list)
+        lemma_hits = defaultdict(list)
+        for word_index, word in enumerate(self.alpino_sentence.get_words(ignorecase)):
+            for term_order, aspect_term in group_index.lookup(word):
+                word_hits[(term_order, aspect_term)].append(word_index)
+        for word_index, lemma in enumerate(self.alpino_sentence.get_lemmas(ignorecase)):
+            for term_order, aspect_term in group_index.lookup(lemma):
+                lemma_hits[(term_order, aspect_term)].append(word_index)
+        if not word_hits and not lemma_hits:
+            return []
+        term_order, aspect_term = min(list(word_hits) + list(lemma_hits))
+        if (term_order, aspect_term) in word_hits:
+            index_field, hits = "aspect_term_index", word_hits[(term_order, aspect_term)]
+        else:
+            index_field, hits = "context_term_index", lemma_hits[(term_order, aspect_term)]
+        return [{
+            index_field: word_index,
+            "match_term": self.alpino_sentence.word_nodes[word_index]["@word"],
+            "match_lemma": self.alpino_sentence.word_nodes[word_index]["@lemma"],
+            "context_term": aspect_term,
+            "context_type": aspect_group
+        } for word_index in hits]
+
     def match_context_condition(self, impact_rule, impact_match):
         context_term = impact_rule.condition["context_term"]
         context_matches = []
         if impact_rule.condition["location"] == "sentence_start":
             if self.debug:
                 print("looking for term", context_term, " with condition", impact_rule.condition)
-        for match in self.get_sentence_string_matching_term(context_term, impact_rule.condition["location"], ignorecase=impact_rule.ignorecase):
+        for match in self.get_sentence_string_matching_pattern(impact_rule.condition_pattern):
             context_match = {
                 "condition_match_offset": match.start(),
                 "condition_match_string": match.group(0),
@@ -0,0 +1,10 @@
+"""
+Benchmarks of the matcher, the loaders and the statistics, on the shipped Dutch data and on synthetic
+data sets resampled from it at 1x, 10x and 100x its size. Run from the scripts_nl directory:
+
+    python -m benchmarks run [--scales 1 10 100] [--cases CASE ...] [--repeat N] [--output FILE]
+    python -m benchmarks compare BASELINE CURRENT [--threshold 0.1]
+
+Results are saved as JSON with metadata on the environment. compare exits with an error if any
+benchmark of the current run is slower than the baseline by more than the threshold.
+"""
@@ -0,0 +1,62 @@
+import argparse
+import datetime
+import os
+import sys
+
+from config import config
+
+from benchmarks.cases import CASES, BenchmarkCases, run_benchmarks
+from benchmarks.datasets import get_datasets
+from benchmarks.results import compare_results, get_environment_differences, print_comparisons
+from benchmarks.results import print_scaling_curves, read_results, write_results
+
+
+def run(args) -> None:
+    print("Making data sets")
+    datasets = get_datasets(config, args.scales, os.path.join(config['benchmark_dir'], "data"))
+    print("Running benchmarks")
+    results = run_benchmarks(BenchmarkCases(config, repeat=args.repeat), datasets, args.cases)
+    print("Scaling curves")
+    print_scaling_curves(results)
+    output_file = args.output
+    if not output_file:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output_file = os.path.join(config['benchmark_dir'], f"benchmark-{timestamp}.json")
+    write_results(results, output_file, {"scales": args.scales, "cases": args.cases, "repeat": args.repeat})
+    print(f"\twrote benchmark results to {output_file}")
+
+
+def compare(args) -> None:
+    baseline, current = read_results(args.baseline), read_results(args.current)
+    comparisons = compare_results(baseline, current, threshold=args.threshold, min_seconds=args.min_seconds)
+    print_comparisons(comparisons, get_environment_differences(baseline, current))
+    regressions = [comparison for comparison in comparisons if comparison["regression"]]
+    if regressions:
+        print(f"\t{len(regressions)} benchmarks are more than {args.threshold:.0%} slower than the baseline")
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the analysis")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run benchmarks and save the results as JSON")
+    run_parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                            help="sizes of the synthetic data sets, as multiples of the shipped data")
+    run_parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    run_parser.add_argument("--repeat", type=int, default=3, help="number of timed runs of each benchmark")
+    run_parser.add_argument("--output", help="results file, default is a timestamped file in benchmark_dir")
+    run_parser.set_defaults(func=run)
+    compare_parser = subparsers.add_parser("compare", help="flag benchmarks that are slower than a baseline run")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="fraction a benchmark may be slower than the baseline")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.005,
+                                help="smallest slowdown in seconds that counts as a regression")
+    compare_parser.set_defaults(func=compare)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+from typing import Callable, Dict, Iterator, List
+from contextlib import redirect_stdout
+import itertools
+import io
+import os
+import statistics
+import tempfile
+import time
+
+import human_rater_analysis
+import impact_model_analysis
+import mann_whitney_u_test
+from alpino_archive import AlpinoArchiveReader
+from alpino_matcher import AlpinoMatcher
+from impact_scorer import make_alpino_sentence
+
+from benchmarks.datasets import Dataset
+
+CASES = ["match_rules", "match_rules_per_rule_type", "read_tarred_sentences", "get_sentence_ratings",
+         "get_ira_dist", "test_samples", "write_rating_spreadsheet"]
+
+# matching rule by rule is slow, so the per rule type benchmarks use at most this many sentences
+RULE_TYPE_SENTENCES = 1000
+
+
+def time_call(func: Callable, repeat: int) -> List[float]:
+    """returns the wall clock seconds of repeat calls of func, with its printed output discarded"""
+    run_seconds = []
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            run_seconds.append(time.perf_counter() - start)
+    return run_seconds
+
+
+def make_result(case: str, dataset: Dataset, num_items: int, run_seconds: List[float], **details) -> dict:
+    seconds = min(run_seconds)
+    return dict({
+        "case": case,
+        "dataset": dataset.name,
+        "scale": dataset.scale,
+        "num_items": num_items,
+        "runs": run_seconds,
+        "seconds": seconds,
+        "median_seconds": statistics.median(run_seconds),
+        "seconds_per_item": seconds / num_items if num_items else None,
+    }, **details)
+
+
+class BenchmarkCases(object):
+
+    def __init__(self, config: dict, repeat: int = 3):
+        """
+        The benchmark cases, with the input they share: the impact model. The matcher cases read the
+        sentences of the parse archive of each data set, so the sentences of the synthetic data sets are
+        separate sentence objects, as they are when scoring a corpus.
+        """
+        self.config = config
+        self.repeat = repeat
+        self.impact_model = impact_model_analysis.load_impact_model(config['impact_model_file'])
+
+    def run(self, case: str, dataset: Dataset) -> List[dict]:
+        """runs a benchmark case, one of CASES, on a data set and returns its results"""
+        return getattr(self, case)(dataset)
+
+    def match_rules(self, dataset: Dataset) -> List[dict]:
+        """
+        Times matching the sentences of the parse archive of the data set. Sentences are read and parsed
+        outside of the timing, one at a time, so that 100x does not need 100x the sentences in memory.
+        Each run parses the sentences anew, so the lazily computed word and lemma lists of the sentences
+        are part of the matching time of every run, as they are when scoring.
+        """
+        alpino_matcher = AlpinoMatcher(self.impact_model)
+        run_seconds = []
+        for _ in range(self.repeat):
+            seconds = 0.0
+            num_sentences = 0
+            with redirect_stdout(io.StringIO()):
+                for alpino_sentence in iter_dataset_sentences(dataset):
+                    start = time.perf_counter()
+                    alpino_matcher.match_rules(alpino_sentence)
+                    seconds += time.perf_counter() - start
+                    num_sentences += 1
+            run_seconds.append(seconds)
+        return [make_result("match_rules", dataset, num_sentences, run_seconds)]
+
+    def match_rules_per_rule_type(self, dataset: Dataset) -> List[dict]:
+        sentences = list(iter_dataset_sentences(dataset, limit=RULE_TYPE_SENTENCES))
+        alpino_matcher = AlpinoMatcher(self.impact_model, use_rule_index=False)
+        # a first pass fills the lazily computed word and lemma lists of the sentences, so that all
+        # timed runs match sentences in the same state
+        for alpino_sentence in sentences:
+            alpino_matcher.match_rules(alpino_sentence)
+        results = []
+        for rule_type in sorted(set(impact_rule.impact_term.type for impact_rule in self.impact_model.impact_rules)):
+            impact_rules = [impact_rule for impact_rule in self.impact_model.impact_rules
+                            if impact_rule.impact_term.type == rule_type]
+
+            def match_sentences():
+                for alpino_sentence in sentences:
+                    for impact_rule in impact_rules:
+                        alpino_matcher.match_rule(impact_rule, alpino_sentence)
+
+            results.append(make_result(f"match_rules.{rule_type}", dataset, len(sentences),
+                                       time_call(match_sentences, self.repeat), num_rules=len(impact_rules)))
+        return results
+
+    def read_tarred_sentences(self, dataset: Dataset) -> List[dict]:
+        run_seconds = time_call(lambda: impact_model_analysis.read_tarred_sentences(dataset.sentences_file),
+                                self.repeat)
+        return [make_result("read_tarred_sentences", dataset, len(dataset), run_seconds)]
+
+    def get_sentence_ratings(self, dataset: Dataset) -> List[dict]:
+        run_seconds = time_call(lambda: human_rater_analysis.get_sentence_ratings(dataset.ratings_file), self.repeat)
+        return [make_result("get_sentence_ratings", dataset, len(dataset), run_seconds)]
+
+    def get_done_sentences(self, dataset: Dataset) -> List[dict]:
+        sentences_done = human_rater_analysis.get_sentence_ratings(dataset.ratings_file, annotation_status="done")
+        for sentence in sentences_done:
+            human_rater_analysis.complete_columns(sentence, human_rater_analysis.RATING_HEADERS)
+        return sentences_done
+
+    def get_ira_dist(self, dataset: Dataset) -> List[dict]:
+        sentences_done = self.get_done_sentences(dataset)
+        # the rating tensor is made inside get_ira_dist, so it is part of the timing
+        run_seconds = time_call(lambda: human_rater_analysis.get_ira_dist(sentences_done, 'inverse_triangular'),
+                                self.repeat)
+        return [make_result("get_ira_dist", dataset, len(sentences_done), run_seconds)]
+
+    def test_samples(self, dataset: Dataset) -> List[dict]:
+        sentences_done = self.get_done_sentences(dataset)
+        rating_tensor = human_rater_analysis.RatingTensor(sentences_done, self.config['impact_scales'])
+        medians = rating_tensor.median("emotional_scale")[rating_tensor.has_agreement("emotional_scale")].tolist()
+        # the samples have the ties of the median human ratings, as the samples split by model rating do
+        sample_model_0, sample_model_1 = medians[0::2], medians[1::2]
+        run_seconds = time_call(lambda: mann_whitney_u_test.test_samples(sample_model_0, sample_model_1), self.repeat)
+        return [make_result("test_samples", dataset, len(medians), run_seconds)]
+
+    def write_rating_spreadsheet(self, dataset: Dataset) -> List[dict]:
+        sentences_done = self.get_done_sentences(dataset)
+        for sentence in sentences_done:
+            sentence["model_impact_score"] = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = {"spreadsheet_file": os.path.join(temp_dir, "ratings.xlsx")}
+            run_seconds = time_call(lambda: human_rater_analysis.write_rating_spreadsheet(sentences_done, config),
+                                    self.repeat)
+        return [make_result("write_rating_spreadsheet", dataset, len(sentences_done), run_seconds)]
+
+
+def iter_dataset_sentences(dataset: Dataset, limit: int = None) -> Iterator:
+    """yields the sentences of the parse archive of a data set as parsed sentences, in archive order"""
+    with AlpinoArchiveReader(dataset.sentences_file) as archive_reader:
+        for _sentence_id, sentence in itertools.islice(archive_reader.iter_sentences(), limit):
+            yield make_alpino_sentence(sentence)
+
+
+def run_benchmarks(benchmark_cases: BenchmarkCases, datasets: Dict[str, Dataset], cases: List[str]) -> List[dict]:
+    results = []
+    for dataset in datasets.values():
+        for case in cases:
+            for result in benchmark_cases.run(case, dataset):
+                print(f"\t{result['case']: <28}\t{result['dataset']: <16}\t{result['num_items']: >8} items"
+                      f"\t{result['seconds']:.4f}s")
+                results.append(result)
+    return results
@@ -0,0 +1,114 @@
+from typing import Dict, List
+import io
+import json
+import os
+import tarfile
+import numpy as np
+
+from human_rater_analysis import iter_json_documents
+from impact_model_analysis import get_sentence_id
+
+SYNTHETIC_SEED = 20190627
+
+
+class Dataset(object):
+
+    def __init__(self, name: str, scale: int, ratings_file: str, sentences_file: str, source_indexes: np.ndarray):
+        """
+        A judgements file and a parse archive to benchmark on. source_indexes are the indexes of the
+        shipped sentences the sentences of the data set are copies of, in order.
+        """
+        self.name = name
+        self.scale = scale
+        self.ratings_file = ratings_file
+        self.sentences_file = sentences_file
+        self.source_indexes = source_indexes
+
+    def __len__(self):
+        return len(self.source_indexes)
+
+
+def get_shipped_dataset(config: dict) -> Dataset:
+    with tarfile.open(config['alpino_sentences_file'], 'r:gz') as tar:
+        num_sentences = len([member for member in tar.getmembers() if ".json" in member.name])
+    return Dataset("shipped", 1, config['ratings_file'], config['alpino_sentences_file'], np.arange(num_sentences))
+
+
+def make_source_indexes(num_sentences: int, scale: int, seed: int) -> np.ndarray:
+    """draws scale times the number of shipped sentences with replacement, the same for the same seed"""
+    return np.random.default_rng([seed, scale]).integers(0, num_sentences, size=num_sentences * scale)
+
+
+def make_synthetic_id(sentence_id: str, position: int) -> str:
+    """gives each copy its own review id, keeping the <review id>-<sentence index> form"""
+    review_id, sentence_index = sentence_id.rsplit("-", 1)
+    return f"{review_id}s{position}-{sentence_index}"
+
+
+def read_shipped_sentences(sentences_file: str) -> List[tuple]:
+    """returns (sentence id, member name, raw JSON) of the sentences in the shipped parse archive"""
+    shipped_sentences = []
+    with tarfile.open(sentences_file, 'r:gz') as tar:
+        for member in tar.getmembers():
+            if ".json" in member.name:
+                shipped_sentences.append((get_sentence_id(member), member.name, tar.extractfile(member).read()))
+    return shipped_sentences
+
+
+def write_synthetic_archive(shipped_sentences: List[tuple], source_indexes: np.ndarray, archive_file: str) -> None:
+    with tarfile.open(archive_file + ".tmp", 'w:gz', compresslevel=6) as tar:
+        for position, source_index in enumerate(source_indexes):
+            sentence_id, member_name, content = shipped_sentences[source_index]
+            member_dir, file_name = os.path.split(member_name)
+            synthetic_name = file_name.replace(f"sentence-{sentence_id}.",
+                                               f"sentence-{make_synthetic_id(sentence_id, position)}.")
+            member = tarfile.TarInfo(os.path.join(member_dir, synthetic_name))
+            member.size = len(content)
+            tar.addfile(member, fileobj=io.BytesIO(content))
+    os.replace(archive_file + ".tmp", archive_file)
+
+
+def write_synthetic_ratings(ratings_file: str, shipped_ids: List[str], source_indexes: np.ndarray,
+                            synthetic_file: str) -> None:
+    """writes copies of the judgements of the drawn sentences, as a JSON array in the shipped layout"""
+    judgements = {}
+    for judgement in iter_json_documents(ratings_file):
+        judgements[judgement["_source"]["sentence_id"]] = judgement
+    with open(synthetic_file + ".tmp", 'wt') as fh:
+        fh.write("[")
+        for position, source_index in enumerate(source_indexes):
+            judgement = judgements[shipped_ids[source_index]]
+            synthetic_id = make_synthetic_id(shipped_ids[source_index], position)
+            synthetic_judgement = dict(judgement, _id=synthetic_id,
+                                       _source=dict(judgement["_source"], sentence_id=synthetic_id))
+            fh.write(("," if position else "") + json.dumps(synthetic_judgement))
+        fh.write("]")
+    os.replace(synthetic_file + ".tmp", synthetic_file)
+
+
+def get_synthetic_dataset(config: dict, scale: int, data_dir: str, seed: int = SYNTHETIC_SEED) -> Dataset:
+    """
+    Makes a synthetic data set of scale times the size of the shipped data, by drawing sentences and
+    their judgements with replacement. The files are made once per scale and seed and reused after.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    name = f"synthetic-x{scale}"
+    ratings_file = os.path.join(data_dir, f"{name}-seed{seed}.judgements.json")
+    sentences_file = os.path.join(data_dir, f"{name}-seed{seed}.sentences.tar.gz")
+    shipped_sentences = read_shipped_sentences(config['alpino_sentences_file'])
+    source_indexes = make_source_indexes(len(shipped_sentences), scale, seed)
+    if not os.path.isfile(sentences_file):
+        write_synthetic_archive(shipped_sentences, source_indexes, sentences_file)
+    if not os.path.isfile(ratings_file):
+        shipped_ids = [sentence_id for sentence_id, _member_name, _content in shipped_sentences]
+        write_synthetic_ratings(config['ratings_file'], shipped_ids, source_indexes, ratings_file)
+    return Dataset(name, scale, ratings_file, sentences_file, source_indexes)
+
+
+def get_datasets(config: dict, scales: List[int], data_dir: str) -> Dict[str, Dataset]:
+    datasets = {"shipped": get_shipped_dataset(config)}
+    for scale in scales:
+        dataset = get_synthetic_dataset(config, scale, data_dir)
+        datasets[dataset.name] = dataset
+    return datasets
+
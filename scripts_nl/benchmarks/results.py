@@ -0,0 +1,83 @@
+from typing import Dict, List, Tuple
+from collections import defaultdict
+import json
+import os
+
+from run_environment import get_environment
+
+RESULTS_VERSION = 1
+
+
+def write_results(results: List[dict], results_file: str, settings: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+    with open(results_file, 'wt') as fh:
+        json.dump({
+            "results_version": RESULTS_VERSION,
+            "environment": get_environment(),
+            "settings": settings,
+            "results": results
+        }, fh, indent=2)
+
+
+def read_results(results_file: str) -> dict:
+    with open(results_file, 'rt') as fh:
+        run = json.load(fh)
+    if run.get("results_version") != RESULTS_VERSION:
+        raise ValueError(f"unsupported results version {run.get('results_version')} in {results_file}")
+    return run
+
+
+def index_results(run: dict) -> Dict[Tuple[str, str], dict]:
+    return {(result["case"], result["dataset"]): result for result in run["results"]}
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1, min_seconds: float = 0.005) -> List[dict]:
+    """
+    Compares the fastest time of each benchmark in both runs. A benchmark regresses if the current
+    time exceeds the baseline time by more than the threshold fraction, and by more than min_seconds,
+    so that timer noise in very short benchmarks is not flagged. Returns the comparisons.
+    """
+    baseline_results = index_results(baseline)
+    comparisons = []
+    for key, result in index_results(current).items():
+        if key not in baseline_results:
+            continue
+        baseline_seconds = baseline_results[key]["seconds"]
+        ratio = result["seconds"] / baseline_seconds if baseline_seconds else float("inf")
+        comparisons.append({
+            "case": result["case"],
+            "dataset": result["dataset"],
+            "baseline_seconds": baseline_seconds,
+            "current_seconds": result["seconds"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold and result["seconds"] - baseline_seconds > min_seconds
+        })
+    return comparisons
+
+
+def print_scaling_curves(results: List[dict]) -> None:
+    """prints the seconds per item of each benchmark over the scales of the synthetic data sets"""
+    curves = defaultdict(dict)
+    for result in results:
+        if result["dataset"] != "shipped":
+            curves[result["case"]][result["scale"]] = result["seconds_per_item"]
+    for case, curve in curves.items():
+        points = [f"x{scale}: {seconds_per_item * 1e6:.1f}us" for scale, seconds_per_item in sorted(curve.items())]
+        print(f"\t{case: <28}\tper item\t" + "\t".join(points))
+
+
+def get_environment_differences(baseline: dict, current: dict) -> List[str]:
+    differences = []
+    for field in ["python", "platform", "machine", "cpu_count", "packages"]:
+        if baseline["environment"].get(field) != current["environment"].get(field):
+            differences.append(field)
+    return differences
+
+
+def print_comparisons(comparisons: List[dict], environment_differences: List[str]) -> None:
+    if environment_differences:
+        print(f"\tthe runs differ in environment: {', '.join(environment_differences)}")
+    for comparison in comparisons:
+        flag = "REGRESSION" if comparison["regression"] else ""
+        print(f"\t{comparison['case']: <28}\t{comparison['dataset']: <16}\t{comparison['baseline_seconds']:.4f}s"
+              f"\t{comparison['current_seconds']:.4f}s\t{comparison['ratio']:.2f}x\t{flag}")
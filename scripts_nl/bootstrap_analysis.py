@@ -0,0 +1,158 @@
+from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import human_rater_analysis
+
+# human ratings are medians of ratings on a 0-4 scale, so they run from 0 to 4 in steps of 0.5
+HUMAN_RATINGS = [human_rating / 2 for human_rating in range(0, 9)]
+
+
+def make_scale_features(sentence_ratings: List[dict], impact_scale: str, ira_threshold: float, config: dict,
+                        rating_tensor: human_rater_analysis.RatingTensor) -> Dict[str, np.ndarray]:
+    """
+    Per sentence columns from which the bootstrap statistics of an impact scale are sums.
+    Summing a column with resample weights (the number of times each sentence is drawn) gives the
+    value of that sum for the resampled set of sentences.
+    """
+    rated = rating_tensor.has_agreement(impact_scale)
+    ira = np.where(rated, rating_tensor.ira(impact_scale, config['null_dist']), 0.0)
+    high = rated & (ira >= ira_threshold)
+    low = rated & (ira < ira_threshold)
+    model_scores = np.array([sentence["model_impact_score"][impact_scale] for sentence in sentence_ratings])
+    model = (model_scores >= 1).astype(int)
+    medians = rating_tensor.median(impact_scale)
+    rating_index = np.searchsorted(HUMAN_RATINGS, np.where(rated, medians, 0.0))
+    # one column per (human rating, model rating) cell of the agreement table
+    cells = np.zeros((len(sentence_ratings), len(HUMAN_RATINGS) * 2))
+    cells[np.arange(len(sentence_ratings)), rating_index * 2 + model] = 1.0
+    return {
+        "rated": rated.astype(float),
+        "ira": ira,
+        "cells_high": cells * high[:, None],
+        "cells_low": cells * low[:, None],
+        # the Mann-Whitney test uses the high IRA sentences, split by model rating
+        "ratings_model_0": cells[:, 0::2] * high[:, None],
+        "ratings_model_1": cells[:, 1::2] * high[:, None],
+    }
+
+
+def make_resample_weights(rng: np.random.Generator, num_sentences: int, num_replicates: int) -> np.ndarray:
+    """returns a replicates x sentences matrix with the number of times each sentence is drawn per replicate"""
+    draws = rng.integers(0, num_sentences, size=(num_replicates, num_sentences))
+    draws += np.arange(num_replicates)[:, None] * num_sentences
+    return np.bincount(draws.ravel(), minlength=num_replicates * num_sentences) \
+        .reshape(num_replicates, num_sentences).astype(float)
+
+
+def get_row_proportions(cells: np.ndarray) -> np.ndarray:
+    """turns replicates x cells counts into proportions per model rating, like the agreement table"""
+    counts = cells.reshape(cells.shape[0], len(HUMAN_RATINGS), 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (counts / counts.sum(axis=1, keepdims=True)).reshape(cells.shape)
+
+
+def get_rank_biserial(ratings_model_0: np.ndarray, ratings_model_1: np.ndarray) -> np.ndarray:
+    """
+    Rank-biserial effect size from replicates x rating counts of both samples. The number of
+    pairs in which model 1 has the higher rating (ties count half) follows from the cumulative
+    counts of model 0, so no ranking per replicate is needed.
+    """
+    below_0 = np.cumsum(ratings_model_0, axis=1) - ratings_model_0
+    u_model_1 = (ratings_model_1 * (below_0 + ratings_model_0 / 2)).sum(axis=1)
+    num_pairs = ratings_model_0.sum(axis=1) * ratings_model_1.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return 2 * u_model_1 / num_pairs - 1
+
+
+def get_statistics(features: Dict[str, Dict[str, np.ndarray]], weights: np.ndarray) -> Dict[str, Dict[str, np.ndarray]]:
+    """returns the statistics of each scale for each row of resample weights"""
+    statistics = {}
+    for impact_scale, scale_features in features.items():
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_ira = (weights @ scale_features["ira"]) / (weights @ scale_features["rated"])
+        statistics[impact_scale] = {
+            "mean_ira": mean_ira,
+            "agreement_high": get_row_proportions(weights @ scale_features["cells_high"]),
+            "agreement_low": get_row_proportions(weights @ scale_features["cells_low"]),
+            "effect_size": get_rank_biserial(weights @ scale_features["ratings_model_0"],
+                                             weights @ scale_features["ratings_model_1"]),
+        }
+    return statistics
+
+
+def bootstrap_batch(features: Dict[str, Dict[str, np.ndarray]], seed_sequence: np.random.SeedSequence,
+                    num_replicates: int) -> Dict[str, Dict[str, np.ndarray]]:
+    num_sentences = len(next(iter(features.values()))["rated"])
+    weights = make_resample_weights(np.random.default_rng(seed_sequence), num_sentences, num_replicates)
+    return get_statistics(features, weights)
+
+
+def get_batches(seed: int, num_replicates: int, batch_size: int) -> List[Tuple[np.random.SeedSequence, int]]:
+    """
+    Split the replicates in batches, each with its own seed spawned from the main seed. The batches
+    do not depend on the number of processes, so results are the same with and without a pool.
+    """
+    batch_sizes = [min(batch_size, num_replicates - start) for start in range(0, num_replicates, batch_size)]
+    return list(zip(np.random.SeedSequence(seed).spawn(len(batch_sizes)), batch_sizes))
+
+
+def bootstrap_confidence_intervals(sentence_ratings: List[dict], ira_threshold: float, config: dict,
+                                   rating_tensor: human_rater_analysis.RatingTensor = None,
+                                   num_replicates: int = 10000, seed: int = 0, confidence: float = 0.95,
+                                   batch_size: int = 1000, num_processes: int = None) -> Dict[str, dict]:
+    """
+    Percentile bootstrap confidence intervals for the mean IRA, the agreement table proportions and the
+    Mann-Whitney rank-biserial effect size per impact scale, resampling sentences with replacement.
+    Returns per scale and statistic the point estimate and the lower and upper bound of the interval.
+    """
+    if not rating_tensor:
+        rating_tensor = human_rater_analysis.RatingTensor(sentence_ratings, config['impact_scales'])
+    features = {impact_scale: make_scale_features(sentence_ratings, impact_scale, ira_threshold,
+                                                  config, rating_tensor)
+                for impact_scale in config['impact_scales']}
+    batches = get_batches(seed, num_replicates, batch_size)
+    if num_processes and num_processes > 1:
+        with ProcessPoolExecutor(max_workers=num_processes) as executor:
+            batch_statistics = list(executor.map(bootstrap_batch, [features] * len(batches),
+                                                 *zip(*batches)))
+    else:
+        batch_statistics = [bootstrap_batch(features, seed_sequence, size) for seed_sequence, size in batches]
+    point_estimates = get_statistics(features, np.ones((1, len(sentence_ratings))))
+    tail = (1 - confidence) / 2 * 100
+    intervals = {}
+    for impact_scale in config['impact_scales']:
+        intervals[impact_scale] = {}
+        for statistic, point_estimate in point_estimates[impact_scale].items():
+            replicates = np.concatenate([batch[impact_scale][statistic] for batch in batch_statistics])
+            with np.errstate(invalid="ignore"):
+                lower, upper = np.nanpercentile(replicates, [tail, 100 - tail], axis=0)
+            intervals[impact_scale][statistic] = {"point": point_estimate[0], "lower": lower, "upper": upper}
+    return intervals
+
+
+def print_confidence_intervals(intervals: Dict[str, dict], ira_threshold: float, confidence: float) -> None:
+    for impact_scale, scale_intervals in intervals.items():
+        print(f'\n\t{impact_scale}\t({round(confidence * 100)}% confidence intervals)')
+        for statistic in ["mean_ira", "effect_size"]:
+            interval = scale_intervals[statistic]
+            print(f'\t\t{statistic: <12}\t{interval["point"]:.3f}\t[{interval["lower"]:.3f}, {interval["upper"]:.3f}]')
+        for statistic, label in [("agreement_high", f"IRA >= {ira_threshold}"), ("agreement_low", f"IRA < {ira_threshold}")]:
+            interval = scale_intervals[statistic]
+            for model_rating in [0, 1]:
+                cells = [f'{interval["point"][cell]:.2f} [{interval["lower"][cell]:.2f}, {interval["upper"][cell]:.2f}]'
+                         for cell in range(model_rating, len(HUMAN_RATINGS) * 2, 2)]
+                print(f'\t\t{label}\tmodel {model_rating}\t' + '\t'.join(cells))
+
+
+def do_bootstrap_analysis(sentence_ratings: List[dict], ira_threshold: float, config: dict,
+                          rating_tensor: human_rater_analysis.RatingTensor = None) -> Dict[str, dict]:
+    confidence = config.get('bootstrap_confidence', 0.95)
+    intervals = bootstrap_confidence_intervals(sentence_ratings, ira_threshold, config,
+                                               rating_tensor=rating_tensor,
+                                               num_replicates=config['bootstrap_replicates'],
+                                               seed=config.get('bootstrap_seed', 0),
+                                               confidence=confidence,
+                                               num_processes=config.get('bootstrap_processes'))
+    print_confidence_intervals(intervals, ira_threshold, confidence)
+    return intervals
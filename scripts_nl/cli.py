@@ -0,0 +1,283 @@
+"""
+Command line interface for scoring sentences and running the parts of the analysis separately.
+Modules are imported inside the subcommands that need them, so that scoring does not load numpy,
+scipy, pandas, matplotlib or openpyxl.
+
+    python cli.py score [--presence] [--token-store] [--max-gap N] [--output FILE]
+    python cli.py score-corpus SOURCE [SOURCE ...] --output-dir DIR [--shard-size N] [--processes N] [--max-gap N]
+                               [--profile]
+    python cli.py profile-report PROFILE [--sort-by FIELD] [--top N] [--output FILE]
+    python cli.py aggregate SCORES [SCORES ...] --output FILE [--book-output FILE]
+    python cli.py coverage TABLE [TABLE ...] --output FILE [--max-value N]
+    python cli.py generate NUM_SENTENCES --archive FILE [--judgements FILE] [--hit-density D]
+    python cli.py ira | mwu | agreement | plot | export
+    python cli.py startup-check [--budget SECONDS]
+"""
+from typing import List
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from config import config
+
+HEAVY_MODULES = ["numpy", "scipy", "pandas", "matplotlib", "openpyxl"]
+
+
+def get_done_sentences() -> List[dict]:
+    import human_rater_analysis
+    sentences_done = human_rater_analysis.get_sentence_ratings(config['ratings_file'], annotation_status="done")
+    # ratings are used as integers, as after completing the columns for the spreadsheet export
+    for sentence in sentences_done:
+        human_rater_analysis.complete_columns(sentence, human_rater_analysis.RATING_HEADERS)
+    return sentences_done
+
+
+def get_scored_sentences() -> List[dict]:
+    import impact_model_analysis
+    from alpino_archive import AlpinoArchiveReader
+    sentences_done = get_done_sentences()
+    with AlpinoArchiveReader(config['alpino_sentences_file']) as sentence_reader:
+        sentence_alpino_data = sentence_reader.read_sentences([sentence["sentence_id"] for sentence in sentences_done])
+    impact_model_analysis.score_impact_sentences(sentences_done, sentence_alpino_data, config)
+    return sentences_done
+
+
+def run_score(args) -> None:
+    from impact_scorer import ImpactScorer
+    from model_artifact import load_model_file
+    impact_model = load_model_file(args.model)
+    if args.max_gap is not None:
+        impact_model.make_sequence_patterns(args.max_gap)
+    impact_scorer = ImpactScorer(impact_model, max_count=1 if args.presence else None)
+    if args.token_store:
+        from token_store import TokenStore
+        store = TokenStore(args.sentences or config['alpino_token_store_file'])
+        sentences = ((sentence.sentence_id, sentence) for sentence in store)
+    else:
+        from alpino_archive import AlpinoArchiveReader
+        store = AlpinoArchiveReader(args.sentences or config['alpino_sentences_file'])
+        sentences = store.iter_sentences()
+    fh = open(args.output, 'wt') if args.output else sys.stdout
+    try:
+        for sentence_index, (sentence_id, sentence) in enumerate(sentences):
+            if args.limit is not None and sentence_index >= args.limit:
+                break
+            impact_score = impact_scorer.score(sentence)
+            fh.write(json.dumps({"sentence_id": sentence_id, "impact_score": impact_score}) + "\n")
+    finally:
+        store.close()
+        if args.output:
+            fh.close()
+
+
+def run_score_corpus(args) -> None:
+    import corpus_scoring
+    manifest = corpus_scoring.score_corpus(args.sources, args.output_dir, args.model, shard_size=args.shard_size,
+                                           num_processes=args.processes, max_count=1 if args.presence else None,
+                                           max_gap=args.max_gap, profile=args.profile)
+    if manifest["failed_shards"]:
+        sys.exit(1)
+
+
+def run_profile_report(args) -> None:
+    import rule_profiler
+    from model_artifact import load_model_file
+    profile = rule_profiler.read_profile(args.profile)
+    impact_model = load_model_file(args.model)
+    if args.output:
+        rule_profiler.write_profile_report(profile, impact_model, args.output, sort_by=args.sort_by)
+    rule_profiler.print_profile_report(profile, impact_model, sort_by=args.sort_by, top=args.top)
+
+
+def run_aggregate(args) -> None:
+    import impact_aggregation
+    review_books = impact_aggregation.read_review_books(args.review_books) if args.review_books else None
+    impact_aggregation.aggregate_impact(args.scores, args.output, book_file=args.book_output,
+                                        review_books=review_books)
+
+
+def run_coverage(args) -> None:
+    from coverage_histogram import make_histogram_file
+    histograms = make_histogram_file(args.tables, args.output, args.max_value)
+    print(f"\tcoverage histograms of {histograms.num_reviews} reviews written to {args.output}")
+
+
+def run_generate(args) -> None:
+    import synthetic_corpus
+    from model_artifact import load_model_file
+    vocabulary = synthetic_corpus.Vocabulary.from_archive(args.vocabulary)
+    annotator_counts = {int(num_annotators): 1.0 for num_annotators in args.annotators} if args.annotators else None
+    generator = synthetic_corpus.SyntheticCorpusGenerator(vocabulary, load_model_file(args.model),
+                                                          hit_density=args.hit_density,
+                                                          annotator_counts=annotator_counts, na_rate=args.na_rate,
+                                                          done_fraction=args.done_fraction, seed=args.seed)
+    impact_type_freq = synthetic_corpus.write_synthetic_corpus(generator, args.num_sentences, args.archive,
+                                                               judgements_file=args.judgements,
+                                                               corpus_name=args.corpus_name)
+    print(f"\tgenerated {args.num_sentences} sentences with inserted impact rules:",
+          ", ".join(f"{impact_type}: {freq}" for impact_type, freq in sorted(impact_type_freq.items())))
+
+
+def run_ira(args) -> None:
+    import human_rater_analysis
+    sentences_done = get_done_sentences()
+    rating_tensor = human_rater_analysis.RatingTensor(sentences_done, config['impact_scales'])
+    print(f'\nCalculating interrater agreement using the {args.null_dist} null-distribution')
+    human_rater_analysis.get_ira_dist(sentences_done, args.null_dist, rating_tensor=rating_tensor)
+
+
+def run_mwu(args) -> None:
+    import mann_whitney_u_test
+    sentences_done = get_scored_sentences()
+    print(f"\nPerforming Mann-Whitney U test for IRA >= {args.ira_threshold}")
+    mann_whitney_u_test.do_mann_whitney_u_test(sentences_done, args.ira_threshold, config)
+
+
+def run_agreement(args) -> None:
+    import impact_model_analysis
+    sentences_done = get_scored_sentences()
+    print(f"\nHuman model rating agreement for IRA >= {args.ira_threshold}")
+    impact_model_analysis.do_model_agreement_analysis(sentences_done, args.ira_threshold, config)
+
+
+def run_plot(args) -> None:
+    import human_rater_analysis
+    import plot
+    print("Plotting rating distribution")
+    plot.plot_num_annotations_distribution(human_rater_analysis.iter_sentence_ratings(config['ratings_file']))
+    sentences_done = get_scored_sentences()
+    rating_tensor = human_rater_analysis.RatingTensor(sentences_done, config['impact_scales'])
+    ira_dist = human_rater_analysis.get_ira_dist(sentences_done, args.null_dist, rating_tensor=rating_tensor)
+    plot.plot_per_sentence_ira_dist(ira_dist)
+    print(f"\nMaking model boxplots for IRA>= {args.ira_threshold}")
+    plot.do_model_box_plot(sentences_done, args.ira_threshold, config, rating_tensor=rating_tensor)
+    print(f"\nPlotting rule matching coverage over reviews")
+    plot.plot_rule_coverage()
+
+
+def run_export(args) -> None:
+    import human_rater_analysis
+    if args.format:
+        config['rating_export_format'] = args.format
+    human_rater_analysis.export_ratings(get_scored_sentences(), config)
+
+
+def run_startup_check(args) -> None:
+    """
+    Time the startup of the score subcommand (imports and loading the model) in a fresh interpreter
+    and exit with an error if it exceeds the budget or loads any of the heavy modules.
+    """
+    code = "; ".join([
+        "import time, sys, json",
+        "start = time.perf_counter()",
+        "import cli",
+        f"cli.main(['score', '--limit', '0', '--model', {args.model!r}])",
+        "heavy = [module for module in cli.HEAVY_MODULES if module in sys.modules]",
+        "print(json.dumps({'seconds': time.perf_counter() - start, 'heavy_modules': heavy}))"
+    ])
+    timings = []
+    for _ in range(args.repeat):
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        timings.append(json.loads(result.stdout.strip().split("\n")[-1]))
+    # the fastest run is the least disturbed by other processes
+    seconds = min(timing["seconds"] for timing in timings)
+    heavy_modules = sorted(set(module for timing in timings for module in timing["heavy_modules"]))
+    print(f"\tscore startup: {seconds:.3f}s (budget {args.budget:.3f}s)")
+    if heavy_modules:
+        print(f"\tscore startup loads heavy modules: {', '.join(heavy_modules)}")
+    if seconds > args.budget or heavy_modules:
+        sys.exit(1)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Reading impact model scoring and agreement analysis")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    score_parser = subparsers.add_parser("score", help="score parsed sentences, writing JSON lines")
+    score_parser.add_argument("--model", default=config['impact_model_file'])
+    score_parser.add_argument("--sentences", help="parse archive, or token store with --token-store")
+    score_parser.add_argument("--token-store", action="store_true", help="read sentences from a token store")
+    score_parser.add_argument("--presence", action="store_true", help="only score presence of impact per type")
+    score_parser.add_argument("--max-gap", type=int,
+                              help="maximum number of tokens between the parts of a discontinuous phrase")
+    score_parser.add_argument("--limit", type=int, help="score at most this number of sentences")
+    score_parser.add_argument("--output", help="output file, default is standard output")
+    score_parser.set_defaults(func=run_score)
+    corpus_parser = subparsers.add_parser("score-corpus", help="score parse archives or token stores in shards")
+    corpus_parser.add_argument("sources", nargs="+", help="parse archives and/or token stores")
+    corpus_parser.add_argument("--output-dir", required=True, help="directory for the shard outputs and manifest")
+    corpus_parser.add_argument("--model", default=config['impact_model_file'])
+    corpus_parser.add_argument("--shard-size", type=int, default=10000, help="number of sentences per shard")
+    corpus_parser.add_argument("--processes", type=int, help="number of worker processes, default is all cpus")
+    corpus_parser.add_argument("--presence", action="store_true", help="only score presence of impact per type")
+    corpus_parser.add_argument("--max-gap", type=int,
+                               help="maximum number of tokens between the parts of a discontinuous phrase")
+    corpus_parser.add_argument("--profile", action="store_true",
+                               help="record per rule counts and timings in rule_profile.json and rule_profile.tsv")
+    corpus_parser.set_defaults(func=run_score_corpus)
+    report_parser = subparsers.add_parser("profile-report", help="report the rules of a rule profile")
+    report_parser.add_argument("profile", help="rule_profile.json of a profiled score-corpus run")
+    report_parser.add_argument("--model", default=config['impact_model_file'])
+    report_parser.add_argument("--sort-by", default="seconds", help="report field to sort the rules on")
+    report_parser.add_argument("--top", type=int, default=20, help="number of rules to print")
+    report_parser.add_argument("--output", help="write the report of all rules as a tab separated file")
+    report_parser.set_defaults(func=run_profile_report)
+    aggregate_parser = subparsers.add_parser("aggregate", help="aggregate sentence scores per review and book")
+    aggregate_parser.add_argument("scores", nargs="+", help="score-corpus output directories and/or score output files")
+    aggregate_parser.add_argument("--output", required=True, help="per review table")
+    aggregate_parser.add_argument("--book-output", help="per book table")
+    aggregate_parser.add_argument("--review-books", default=config['review_books_file'],
+                                  help="file with the bookid of each responseid")
+    aggregate_parser.set_defaults(func=run_aggregate)
+    coverage_parser = subparsers.add_parser("coverage", help="compute and merge rule coverage histograms")
+    coverage_parser.add_argument("tables", nargs="+", help="per review tables and/or histogram files (.json)")
+    coverage_parser.add_argument("--output", required=True, help="histogram file")
+    coverage_parser.add_argument("--max-value", type=int, default=config['coverage_max_value'],
+                                 help="count larger numbers of matching rules as this number")
+    coverage_parser.set_defaults(func=run_coverage)
+    generate_parser = subparsers.add_parser("generate", help="generate a synthetic parse archive and judgements")
+    generate_parser.add_argument("num_sentences", type=int)
+    generate_parser.add_argument("--archive", required=True, help="parse archive to write (.tar.gz)")
+    generate_parser.add_argument("--judgements", help="judgements file to write")
+    generate_parser.add_argument("--vocabulary", default=config['alpino_sentences_file'],
+                                 help="parse archive to draw the words and sentence lengths from")
+    generate_parser.add_argument("--model", default=config['impact_model_file'])
+    generate_parser.add_argument("--hit-density", type=float, default=0.3,
+                                 help="average number of impact rules made to match per sentence")
+    generate_parser.add_argument("--annotators", type=int, nargs="+",
+                                 help="numbers of annotators per sentence to choose from, default as in the shipped data")
+    generate_parser.add_argument("--na-rate", type=float, default=0.1, help="fraction of unanswerable annotations")
+    generate_parser.add_argument("--done-fraction", type=float, default=1.0, help="fraction of annotated sentences")
+    generate_parser.add_argument("--corpus-name", default="synthetic")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.set_defaults(func=run_generate)
+    for command, func, help_text in [("ira", run_ira, "interrater agreement distribution"),
+                                     ("mwu", run_mwu, "Mann-Whitney U test of human ratings per model rating"),
+                                     ("agreement", run_agreement, "human model rating agreement table"),
+                                     ("plot", run_plot, "make the plots"),
+                                     ("export", run_export, "export human and model ratings")]:
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument("--null-dist", default="inverse_triangular")
+        command_parser.add_argument("--ira-threshold", type=float, default=0.5)
+        command_parser.set_defaults(func=func)
+        if command == "export":
+            command_parser.add_argument("--format", choices=["xlsx", "tsv", "csv"])
+    check_parser = subparsers.add_parser("startup-check", help="check the startup time of the score subcommand")
+    check_parser.add_argument("--model", default=config['impact_model_file'])
+    check_parser.add_argument("--budget", type=float, default=0.25, help="maximum startup time in seconds")
+    check_parser.add_argument("--repeat", type=int, default=3)
+    check_parser.set_defaults(func=run_startup_check)
+    return parser
+
+
+def main(argv: List[str] = None) -> None:
+    args = make_parser().parse_args(argv)
+    if "null_dist" in args:
+        config['null_dist'] = args.null_dist
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
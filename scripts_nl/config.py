@@ -4,16 +4,46 @@ config = {
     'ratings_file': '../data_nl/impact_judgements-2019-06-27.json',
     # The sentences_file contains 2743 json files, each with an Alpino parsed sentence from the questionnaire data
     'alpino_sentences_file': '../data_nl/reading_impact_questionnaire_sentences.tar.gz',
-    # impact_model.pcl contains the impact rules
-    'impact_model_file': '../data_nl/impact_model.pcl',
+    # columnar token store of the parsed sentences, made once with token_store.py
+    'alpino_token_store_file': '../data_nl/reading_impact_questionnaire_sentences.tokens',
+    # impact_model.bin is the compiled impact model, made from the impact rules in impact_model.pcl with model_artifact.py
+    'impact_model_file': '../data_nl/impact_model.bin',
+    'impact_model_pickle_file': '../data_nl/impact_model.pcl',
+    # maximum number of tokens between the parts of a discontinuous phrase, None for no maximum
+    'discontinuous_max_gap': None,
     # impact scales
     'impact_scales': ['emotional_scale', 'style_scale', 'reflection_scale', 'narrative_scale'],
     'spreadsheet_file': '../data_nl/reading_impact_questionnaire_data.xlsx',
+    # export format of the human and model ratings: xlsx (spreadsheet_file), tsv or csv (files in rating_tables_dir)
+    'rating_export_format': 'xlsx',
+    'rating_tables_dir': '../data_nl/rating_tables/',
+    # bootstrap confidence intervals, resampling sentences (set replicates to 0 to skip)
+    'bootstrap_replicates': 10000,
+    'bootstrap_seed': 20190627,
+    'bootstrap_confidence': 0.95,
+    # number of worker processes for the bootstrap, None runs in the main process
+    'bootstrap_processes': None,
     # directory for data files
     'data_dir': '../data_nl/',
+    # directory for cached results of the analysis stages
+    'stage_cache_dir': '../data_nl/stage_cache/',
+    # run report of the stages of the analysis, as JSON lines appended on each run of do_analysis
+    'telemetry_file': '../data_nl/telemetry/analysis-stages.jsonl',
+    # Prometheus text file with the stage measurements of the last run, None to skip
+    'telemetry_prometheus_file': None,
+    # trace Python allocations per stage for the top allocators, which slows down the analysis
+    'telemetry_trace_memory': False,
+    # directory for benchmark results and the synthetic data sets of the benchmarks
+    'benchmark_dir': '../data_nl/benchmarks/',
     # directory for generated images
     'image_dir': '../images_nl/',
     # aggregated impact per review for a selection of novels
-    'aggr_impact_file': '../data_nl/top_268-review_sentences_100000-impact-per-review.csv'
+    'aggr_impact_file': '../data_nl/top_268-review_sentences_100000-impact-per-review.csv',
+    # histograms of the number of matching rules per review, made from aggr_impact_file for the coverage plot,
+    # with values above coverage_max_value counted as coverage_max_value
+    'coverage_histogram_file': '../data_nl/top_268-review_sentences_100000-impact-coverage-histograms.json',
+    'coverage_max_value': 50,
+    # book of each review, any tab or comma separated file with bookid and responseid columns
+    'review_books_file': '../data_nl/top_268-review_sentences_100000-impact-per-review.csv'
 }
 
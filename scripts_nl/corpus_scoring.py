@@ -0,0 +1,229 @@
+from typing import Dict, Iterator, List
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import time
+
+from alpino_archive import AlpinoArchiveReader
+from impact_scorer import ImpactScorer
+from model_artifact import load_model_file
+from rule_profiler import RuleProfile, write_profile, write_profile_report
+from stage_cache import get_file_hash
+from token_store import STORE_MAGIC, StoredAlpinoSentence, TokenStore
+
+MANIFEST_VERSION = 1
+
+# per process state of the workers, set by init_worker
+worker_state = {}
+
+
+def is_token_store(source_file: str) -> bool:
+    with open(source_file, 'rb') as fh:
+        return fh.read(len(STORE_MAGIC)) == STORE_MAGIC
+
+
+def open_source(source_file: str):
+    """opens a token store or a parse archive"""
+    return TokenStore(source_file) if is_token_store(source_file) else AlpinoArchiveReader(source_file)
+
+
+def get_source_info(source_file: str) -> dict:
+    source_stat = os.stat(source_file)
+    source = open_source(source_file)
+    try:
+        num_sentences = len(source)
+    finally:
+        source.close()
+    return {"size": source_stat.st_size, "mtime": source_stat.st_mtime, "num_sentences": num_sentences}
+
+
+def make_shards(source_files: List[str], source_info: Dict[str, dict], shard_size: int, output_dir: str) -> List[dict]:
+    """splits each source in shards of shard_size consecutive sentences"""
+    shards = []
+    for source_index, source_file in enumerate(source_files):
+        source_name = os.path.basename(source_file).split(".")[0]
+        for start in range(0, source_info[source_file]["num_sentences"], shard_size):
+            shard_id = f"{source_index:03d}-{source_name}-{start // shard_size:05d}"
+            shards.append({
+                "shard_id": shard_id,
+                "source_file": source_file,
+                "start": start,
+                "end": min(start + shard_size, source_info[source_file]["num_sentences"]),
+                "output_dir": output_dir,
+                "output_file": os.path.join("shards", f"{shard_id}.jsonl")
+            })
+    return shards
+
+
+def init_worker(model_file: str, max_count: int = None, max_gap: int = None, profile: bool = False) -> None:
+    impact_model = load_model_file(model_file)
+    if max_gap is not None:
+        impact_model.make_sequence_patterns(max_gap)
+    worker_state["impact_scorer"] = ImpactScorer(impact_model, max_count=max_count)
+    worker_state["profile"] = profile
+    worker_state["sources"] = {}
+
+
+def iter_shard_sentences(shard: dict) -> Iterator:
+    """yields (sentence_id, sentence) pairs of the sentences in a shard, in source order"""
+    if shard["source_file"] not in worker_state["sources"]:
+        worker_state["sources"][shard["source_file"]] = open_source(shard["source_file"])
+    source = worker_state["sources"][shard["source_file"]]
+    if isinstance(source, TokenStore):
+        for sentence_index in range(shard["start"], shard["end"]):
+            sentence = StoredAlpinoSentence(source, sentence_index)
+            yield sentence.sentence_id, sentence
+    else:
+        # consecutive sentences, so a gzipped archive is decompressed forward from the shard start
+        yield from source.iter_sentences(source.sentence_ids[shard["start"]:shard["end"]])
+
+
+def score_shard(shard: dict) -> dict:
+    """
+    Scores the sentences of a shard and writes them as JSON lines of sentence id and impact score.
+    The output is written to a temporary file that replaces the shard file when complete.
+    When profiling, the rule profile of the shard is returned with the shard stats.
+    """
+    start_time = time.time()
+    impact_scorer = worker_state["impact_scorer"]
+    profile = None
+    if worker_state["profile"]:
+        profile = RuleProfile(len(impact_scorer.impact_model.impact_rules))
+        impact_scorer.profile = profile
+    num_sentences = 0
+    output_file = os.path.join(shard["output_dir"], shard["output_file"])
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'wt') as fh:
+        for sentence_id, sentence in iter_shard_sentences(shard):
+            if profile:
+                profile.sentence_id = sentence_id
+            impact_score = impact_scorer.score(sentence)
+            fh.write(json.dumps({"sentence_id": sentence_id, "impact_score": impact_score}) + "\n")
+            num_sentences += 1
+    os.replace(temp_file, output_file)
+    shard_stats = {
+        "shard_id": shard["shard_id"],
+        "output_file": shard["output_file"],
+        "num_sentences": num_sentences,
+        "seconds": time.time() - start_time,
+        "worker": os.getpid()
+    }
+    if profile:
+        shard_stats["rule_profile"] = profile.to_json()
+    return shard_stats
+
+
+def merge_rule_profile(rule_profile: RuleProfile, shard_profile: dict) -> RuleProfile:
+    shard_profile = RuleProfile.from_json(shard_profile)
+    if rule_profile is None:
+        return shard_profile
+    rule_profile.merge(shard_profile)
+    return rule_profile
+
+
+def write_manifest(manifest: dict, manifest_file: str) -> None:
+    with open(manifest_file + ".tmp", 'wt') as fh:
+        json.dump(manifest, fh, indent=2)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def read_manifest(manifest_file: str, settings: dict) -> dict:
+    """reads the manifest of a previous run with the same settings, or starts a new one"""
+    if not os.path.isfile(manifest_file):
+        return dict(settings, manifest_version=MANIFEST_VERSION, shards={})
+    with open(manifest_file, 'rt') as fh:
+        manifest = json.load(fh)
+    if manifest.get("manifest_version") != MANIFEST_VERSION \
+            or any(manifest.get(setting) != value for setting, value in settings.items()):
+        raise ValueError(f"{manifest_file} was made for other sources, model or shard size, "
+                         f"use another output directory to score with these settings")
+    return manifest
+
+
+def score_corpus(source_files: List[str], output_dir: str, model_file: str, shard_size: int = 10000,
+                 num_processes: int = None, max_count: int = None, max_gap: int = None,
+                 profile: bool = False) -> dict:
+    """
+    Scores all sentences of a set of parse archives or token stores across a process pool, in shards of
+    shard_size consecutive sentences. Each completed shard is recorded in a manifest in output_dir, so an
+    interrupted run resumes with the shards that are not done yet. A shard that fails is recorded with its
+    error under failed_shards in the manifest and the other shards are still scored. Returns the manifest.
+    With profile, the rule profiles of the workers are merged and written to rule_profile.json and
+    rule_profile.tsv in output_dir. They cover the shards scored in this run only.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_file = os.path.join(output_dir, "manifest.json")
+    source_info = {source_file: get_source_info(source_file) for source_file in source_files}
+    settings = {
+        "sources": source_info,
+        "model_hash": get_file_hash(model_file),
+        "shard_size": shard_size,
+        "max_count": max_count,
+        "max_gap": max_gap
+    }
+    manifest = read_manifest(manifest_file, settings)
+    shards = make_shards(source_files, source_info, shard_size, output_dir)
+    todo = [shard for shard in shards if shard["shard_id"] not in manifest["shards"]
+            or not os.path.isfile(os.path.join(output_dir, manifest["shards"][shard["shard_id"]]["output_file"]))]
+    print(f"\tscoring {len(todo)} of {len(shards)} shards ({len(shards) - len(todo)} done before)")
+    worker_sentences = defaultdict(int)
+    worker_seconds = defaultdict(float)
+    rule_profile = None
+    # failures of an earlier run are scored again, and recorded again if they fail again
+    failed_shards = manifest["failed_shards"] = {}
+    executor = ProcessPoolExecutor(max_workers=num_processes, initializer=init_worker,
+                                   initargs=(model_file, max_count, max_gap, profile))
+    try:
+        futures = {executor.submit(score_shard, shard): shard for shard in todo}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                shard_stats = future.result()
+            except Exception as error:
+                # record the failure and keep the shards of the other futures
+                failed_shards[shard["shard_id"]] = {
+                    "source_file": shard["source_file"],
+                    "start": shard["start"],
+                    "end": shard["end"],
+                    "error": f"{type(error).__name__}: {error}"
+                }
+                write_manifest(manifest, manifest_file)
+                print(f"\tshard {shard['shard_id']} failed: {type(error).__name__}: {error}")
+                continue
+            if profile:
+                rule_profile = merge_rule_profile(rule_profile, shard_stats.pop("rule_profile"))
+            manifest["shards"][shard_stats["shard_id"]] = shard_stats
+            write_manifest(manifest, manifest_file)
+            worker_sentences[shard_stats["worker"]] += shard_stats["num_sentences"]
+            worker_seconds[shard_stats["worker"]] += shard_stats["seconds"]
+            rate = shard_stats["num_sentences"] / shard_stats["seconds"] if shard_stats["seconds"] else 0
+            print(f"\tshard {shard_stats['shard_id']}: {shard_stats['num_sentences']} sentences "
+                  f"in {shard_stats['seconds']:.1f}s ({rate:.0f} sentences/s, worker {shard_stats['worker']})")
+    except BaseException:
+        # e.g. an interrupt or a broken pool, the shards that did not start yet are not run
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+    write_manifest(manifest, manifest_file)
+    for worker, num_sentences in sorted(worker_sentences.items()):
+        rate = num_sentences / worker_seconds[worker] if worker_seconds[worker] else 0
+        print(f"\tworker {worker}: {num_sentences} sentences in {worker_seconds[worker]:.1f}s ({rate:.0f} sentences/s)")
+    if rule_profile:
+        write_profile(rule_profile, os.path.join(output_dir, "rule_profile.json"))
+        write_profile_report(rule_profile, load_model_file(model_file), os.path.join(output_dir, "rule_profile.tsv"))
+        print(f"\twrote the rule profile of {rule_profile.num_sentences} sentences to {output_dir}")
+    if failed_shards:
+        print(f"\t{len(failed_shards)} shards failed, run again with the same settings to score them")
+    return manifest
+
+
+def iter_corpus_scores(output_dir: str) -> Iterator[dict]:
+    """yields the sentence scores of all completed shards of a corpus scoring run, in shard order"""
+    with open(os.path.join(output_dir, "manifest.json"), 'rt') as fh:
+        manifest = json.load(fh)
+    for shard_id in sorted(manifest["shards"]):
+        with open(os.path.join(output_dir, manifest["shards"][shard_id]["output_file"]), 'rt') as fh:
+            for line in fh:
+                yield json.loads(line)
@@ -0,0 +1,142 @@
+from typing import Iterator, List, Tuple
+import csv
+import json
+import os
+import numpy as np
+
+HISTOGRAM_VERSION = 1
+# columns of the per review impact table that are not counts of matching rules
+ID_COLUMNS = ["bookid", "responseid", "num_sentences"]
+
+
+class CoverageHistograms(object):
+
+    def __init__(self, max_value: int, columns: List[str] = None):
+        """
+        Per column histograms of the number of matching rules per review. Values above max_value
+        are counted in the max_value bin, so the histograms have a fixed size however large the corpus.
+        """
+        self.max_value = max_value
+        self.num_reviews = 0
+        self.counts = {}
+        for column in columns if columns else []:
+            self.add_column(column)
+
+    def add_column(self, column: str) -> None:
+        if column not in self.counts:
+            self.counts[column] = np.zeros(self.max_value + 1, dtype=np.int64)
+
+    def add_chunk(self, header: List[str], rows: List[List[str]]) -> None:
+        """adds a chunk of rows of a per review impact table"""
+        if not rows:
+            return
+        values = np.array(rows, dtype=str)
+        for column_index, column in enumerate(header):
+            if column in ID_COLUMNS:
+                continue
+            self.add_column(column)
+            column_values = np.clip(values[:, column_index].astype(np.int64), 0, self.max_value)
+            self.counts[column] += np.bincount(column_values, minlength=self.max_value + 1)
+        self.num_reviews += len(rows)
+
+    def merge(self, other: "CoverageHistograms") -> None:
+        """adds the counts of another set of histograms, e.g. of another shard of the corpus"""
+        if other.max_value != self.max_value:
+            raise ValueError(f"cannot merge histograms with max value {other.max_value} into max value {self.max_value}")
+        for column, counts in other.counts.items():
+            self.add_column(column)
+            self.counts[column] += counts
+        self.num_reviews += other.num_reviews
+
+    def get_fractions(self, column: str) -> Tuple[List[int], List[float]]:
+        """returns the values that occur in the column and the fraction of reviews with each value"""
+        values = np.flatnonzero(self.counts[column])
+        return values.tolist(), (self.counts[column][values] / self.counts[column].sum()).tolist()
+
+    def to_json(self) -> dict:
+        return {
+            "histogram_version": HISTOGRAM_VERSION,
+            "max_value": self.max_value,
+            "num_reviews": self.num_reviews,
+            "counts": {column: counts.tolist() for column, counts in self.counts.items()}
+        }
+
+    @staticmethod
+    def from_json(histogram_json: dict) -> "CoverageHistograms":
+        if histogram_json.get("histogram_version") != HISTOGRAM_VERSION:
+            raise ValueError(f"unsupported histogram version {histogram_json.get('histogram_version')}")
+        histograms = CoverageHistograms(histogram_json["max_value"])
+        histograms.num_reviews = histogram_json["num_reviews"]
+        for column, counts in histogram_json["counts"].items():
+            histograms.counts[column] = np.array(counts, dtype=np.int64)
+        return histograms
+
+
+def iter_row_chunks(aggr_file: str, chunk_size: int = 100000) -> Iterator[Tuple[List[str], List[List[str]]]]:
+    """yields the header and chunks of at most chunk_size rows of a tab separated per review impact table"""
+    with open(aggr_file, 'rt', newline='') as fh:
+        reader = csv.reader(fh, delimiter="\t")
+        header = next(reader)
+        chunk = []
+        for row in reader:
+            if not row:
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield header, chunk
+                chunk = []
+        if chunk:
+            yield header, chunk
+
+
+def read_coverage_histograms(aggr_file: str, max_value: int, chunk_size: int = 100000) -> CoverageHistograms:
+    """computes the coverage histograms of a per review impact table, reading it in chunks"""
+    histograms = CoverageHistograms(max_value)
+    for header, rows in iter_row_chunks(aggr_file, chunk_size=chunk_size):
+        histograms.add_chunk(header, rows)
+    return histograms
+
+
+def get_file_info(file_name: str) -> dict:
+    file_stat = os.stat(file_name)
+    return {"file": os.path.abspath(file_name), "size": file_stat.st_size, "mtime": file_stat.st_mtime}
+
+
+def write_histogram_file(histograms: CoverageHistograms, histogram_file: str, sources: List[dict] = None) -> None:
+    histogram_json = histograms.to_json()
+    histogram_json["sources"] = sources if sources else []
+    with open(histogram_file, 'wt') as fh:
+        json.dump(histogram_json, fh)
+
+
+def read_histogram_file(histogram_file: str) -> CoverageHistograms:
+    with open(histogram_file, 'rt') as fh:
+        return CoverageHistograms.from_json(json.load(fh))
+
+
+def make_histogram_file(source_files: List[str], histogram_file: str, max_value: int) -> CoverageHistograms:
+    """
+    Computes and merges the coverage histograms of per review impact tables, e.g. of several shards
+    of a corpus, and writes them to a histogram file. Histogram files (.json) can be merged as well.
+    """
+    histograms = CoverageHistograms(max_value)
+    for source_file in source_files:
+        if source_file.endswith(".json"):
+            histograms.merge(read_histogram_file(source_file))
+        else:
+            histograms.merge(read_coverage_histograms(source_file, max_value))
+    write_histogram_file(histograms, histogram_file, sources=[get_file_info(source_file)
+                                                              for source_file in source_files])
+    return histograms
+
+
+def get_coverage_histograms(source_files: List[str], histogram_file: str, max_value: int) -> CoverageHistograms:
+    """reads the histogram file if it was made from the same source files, otherwise makes it first"""
+    if os.path.isfile(histogram_file):
+        with open(histogram_file, 'rt') as fh:
+            histogram_json = json.load(fh)
+        if histogram_json.get("histogram_version") == HISTOGRAM_VERSION \
+                and histogram_json.get("max_value") == max_value \
+                and histogram_json.get("sources") == [get_file_info(source_file) for source_file in source_files]:
+            return CoverageHistograms.from_json(histogram_json)
+    return make_histogram_file(source_files, histogram_file, max_value)
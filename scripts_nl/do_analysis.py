@@ -1,29 +1,17 @@
+from typing import Dict, List
 from collections import Counter, defaultdict
+import os
 import statistics as stats
 
+import bootstrap_analysis
 import impact_model_analysis
 import human_rater_analysis
 import mann_whitney_u_test
 import plot
+from alpino_archive import AlpinoArchiveReader
 from config import config
-
-
-def do_model_agreement_analysis(sentence_ratings: list, ira_threshold: float, config: dict):
-    model_agreement_high = {}
-    model_agreement_low = {}
-    print(f'\n\tImpact scale    \tTotal sentences\tIRA >= {ira_threshold}\tIRA < {ira_threshold}'
-          + '\tIgnored (1 or 0 non-NA ratings)')
-    for impact_scale in config['impact_scales']:
-        sentences_high_ira = human_rater_analysis.get_sentences_high_ira(sentence_ratings, impact_scale,
-                                                                         ira_threshold, config['null_dist'])
-        sentences_low_ira = human_rater_analysis.get_sentences_low_ira(sentence_ratings, impact_scale,
-                                                                       ira_threshold, config['null_dist'])
-        model_agreement_high[impact_scale] = impact_model_analysis.get_model_agreement(sentences_high_ira, impact_scale)
-        model_agreement_low[impact_scale] = impact_model_analysis.get_model_agreement(sentences_low_ira, impact_scale)
-        ignored = len(sentence_ratings) - len(sentences_high_ira) - len(sentences_low_ira)
-        print(f'\t{impact_scale: <20}\t{len(sentence_ratings)}\t\t{len(sentences_high_ira)}\t\t{len(sentences_low_ira)}\t\t{ignored}')
-    impact_model_analysis.write_model_agreement_table(model_agreement_high, model_agreement_low,
-                                                      ira_threshold, config)
+from stage_cache import StageCache
+from stage_telemetry import StageTelemetry
 
 
 def show_rating_distribution(sentence_ratings: list):
@@ -50,37 +38,134 @@ def show_rating_distribution(sentence_ratings: list):
     plot.plot_rating_probability(freq['all'])
 
 
-def do_analysis():
+STAGES = ["ratings", "annotation_distribution", "rating_distribution", "scoring", "export", "ira", "agreement",
+          "mwu", "bootstrap", "boxplot", "rule_coverage"]
+
+
+def get_image_files(*file_names: str) -> List[str]:
+    """paths of plots in the image dir, the outputs of the stages that make them"""
+    return [os.path.join(config['image_dir'], file_name) for file_name in file_names]
+
+
+def score_sentences(sentences_done: list, telemetry: StageTelemetry) -> Dict[str, dict]:
+    print("\nReading alpino parses of sentences")
+    with telemetry.stage("archive_read") as stage_details:
+        with AlpinoArchiveReader(config['alpino_sentences_file']) as sentence_reader:
+            sentence_ids = [sentence["sentence_id"] for sentence in sentences_done]
+            sentence_alpino_data = sentence_reader.read_sentences(sentence_ids)
+        stage_details["num_sentences"] = len(sentence_alpino_data)
+    print("Scoring sentences on reading impact")
+    with telemetry.stage("match_rules", num_sentences=len(sentences_done)):
+        impact_model_analysis.score_impact_sentences(sentences_done, sentence_alpino_data, config)
+    return {sentence["sentence_id"]: sentence["model_impact_score"] for sentence in sentences_done}
+
+
+def get_ira_dist(sentences_done: list, rating_tensor: human_rater_analysis.RatingTensor) -> Dict[str, Counter]:
+    print(f'\nCalculating interrater agreement using the inverse triangular null-distribution')
+    ira_dist = human_rater_analysis.get_ira_dist(sentences_done, config['null_dist'], rating_tensor=rating_tensor)
+    plot.plot_per_sentence_ira_dist(ira_dist)
+    return ira_dist
+
+
+def decode_ira_dist(ira_dist: dict) -> Dict[str, Counter]:
+    return defaultdict(Counter, {impact_scale: Counter(ira_freq) for impact_scale, ira_freq in ira_dist.items()})
+
+
+def do_analysis(force_stages: List[str] = None, use_cache: bool = True, telemetry: StageTelemetry = None):
+    if not telemetry:
+        telemetry = StageTelemetry(enabled=False)
+    cache = StageCache(config['stage_cache_dir'], force_stages=force_stages, enabled=use_cache, telemetry=telemetry)
+    ratings_file_hash = cache.file_hash(config['ratings_file'])
     print("Reading human ratings")
-    sentence_ratings = human_rater_analysis.get_sentence_ratings(config['ratings_file'])
     print("Plotting rating distribution")
-    plot.plot_num_annotations_distribution(sentence_ratings)
+    cache.run("annotation_distribution", inputs={"ratings_file": ratings_file_hash, "image_dir": config['image_dir']},
+              outputs=get_image_files("impact_ratings_distribution.eps"),
+              compute=lambda: plot.plot_num_annotations_distribution(
+                  human_rater_analysis.iter_sentence_ratings(config['ratings_file'])))
     print("\nRemoving sentences with fewer than 3 raters")
-    sentences_done = [sentence for sentence in sentence_ratings if sentence["annotation_status"] == "done"]
+    sentences_done = cache.run("ratings", inputs={"ratings_file": ratings_file_hash}, cached=False,
+                               compute=lambda: human_rater_analysis.get_sentence_ratings(config['ratings_file'],
+                                                                                         annotation_status="done"))
     print('\nAnalyzing null distributions')
-    show_rating_distribution(sentences_done)
-    print("\nReading alpino parses of sentences")
-    sentence_alpino_data = impact_model_analysis.read_tarred_sentences(config['alpino_sentences_file'])
-    print("Scoring sentences on reading impact")
-    impact_model_analysis.score_impact_sentences(sentences_done, sentence_alpino_data, config)
+    cache.run("rating_distribution", upstream=["ratings"], inputs={"image_dir": config['image_dir']},
+              outputs=get_image_files("rating_probability.eps", "rating_probability-null_distributions.eps"),
+              compute=lambda: show_rating_distribution(sentences_done))
+    model_impact_scores = cache.run("scoring", upstream=["ratings"],
+                                    inputs={"alpino_sentences_file": cache.file_hash(config['alpino_sentences_file']),
+                                            "impact_model_file": cache.file_hash(config['impact_model_file']),
+                                            "discontinuous_max_gap": config['discontinuous_max_gap']},
+                                    compute=lambda: score_sentences(sentences_done, telemetry))
+    for sentence in sentences_done:
+        sentence["model_impact_score"] = model_impact_scores[sentence["sentence_id"]]
     print("Writing human and model ratings to spreadsheet")
-    human_rater_analysis.write_rating_spreadsheet(sentences_done, config)
-    print('\nCalculating interrater agreement using the inverse triangular null-distribution')
-    ira_dist = human_rater_analysis.get_ira_dist(sentences_done, 'inverse_triangular')
-    plot.plot_per_sentence_ira_dist(ira_dist)
+    cache.run("export", upstream=["scoring"],
+              inputs={key: config.get(key) for key in ['rating_export_format', 'spreadsheet_file', 'rating_tables_dir']},
+              outputs=human_rater_analysis.get_export_files(config),
+              compute=lambda: human_rater_analysis.export_ratings(sentences_done, config))
+    # the export completes the rating columns, which the analyses below expect, also when it was cached
+    for sentence in sentences_done:
+        human_rater_analysis.complete_columns(sentence, human_rater_analysis.RATING_HEADERS)
+    rating_tensor = human_rater_analysis.RatingTensor(sentences_done, config['impact_scales'])
     config['null_dist'] = 'inverse_triangular'
     ira_threshold = 0.5
+    analysis_inputs = {"null_dist": config['null_dist'], "ira_threshold": ira_threshold,
+                       "impact_scales": config['impact_scales']}
+    cache.run("ira", upstream=["ratings"], inputs=dict(analysis_inputs, image_dir=config['image_dir']),
+              outputs=get_image_files("per_sentence_ira_distribution.eps"),
+              compute=lambda: get_ira_dist(sentences_done, rating_tensor), decode=decode_ira_dist)
     print(f"\nPlotting human model rating agreement for IRA >= {ira_threshold}")
-    do_model_agreement_analysis(sentences_done, ira_threshold, config)
+    cache.run("agreement", upstream=["scoring"], inputs=dict(analysis_inputs, data_dir=config['data_dir']),
+              outputs=[os.path.join(config['data_dir'], f'model_agreement.IRA_treshold-{ira_threshold}.csv')],
+              compute=lambda: impact_model_analysis.do_model_agreement_analysis(sentences_done, ira_threshold, config,
+                                                                                rating_tensor=rating_tensor))
     print(f"\nPerforming Mann-Whitney U test for IRA >= {ira_threshold}")
-    mann_whitney_u_test.do_mann_whitney_u_test(sentences_done, ira_threshold, config)
+    cache.run("mwu", upstream=["scoring"], inputs=analysis_inputs,
+              compute=lambda: mann_whitney_u_test.do_mann_whitney_u_test(sentences_done, ira_threshold, config,
+                                                                         rating_tensor=rating_tensor))
+    if config.get('bootstrap_replicates'):
+        print(f"\nBootstrapping confidence intervals with {config['bootstrap_replicates']} replicates")
+        bootstrap_inputs = {key: config.get(key) for key in ['bootstrap_replicates', 'bootstrap_seed',
+                                                             'bootstrap_confidence']}
+        cache.run("bootstrap", upstream=["scoring"], inputs=dict(analysis_inputs, **bootstrap_inputs),
+                  compute=lambda: bootstrap_analysis.do_bootstrap_analysis(sentences_done, ira_threshold, config,
+                                                                           rating_tensor=rating_tensor),
+                  encode=lambda intervals: None)
     print(f"\nMaking model boxplots for IRA>= {ira_threshold}")
-    plot.do_model_box_plot(sentences_done, ira_threshold, config)
+    cache.run("boxplot", upstream=["scoring"], inputs=dict(analysis_inputs, image_dir=config['image_dir']),
+              outputs=get_image_files(f'model-comparison-boxplot-IRA-{ira_threshold}.eps'),
+              compute=lambda: plot.do_model_box_plot(sentences_done, ira_threshold, config,
+                                                     rating_tensor=rating_tensor))
     print()
     print(f"\nPlotting rule matching coverage over reviews")
-    plot.plot_rule_coverage()
+    cache.run("rule_coverage", inputs={"aggr_impact_file": cache.file_hash(config['aggr_impact_file']),
+                                       "coverage_max_value": config['coverage_max_value'],
+                                       "image_dir": config['image_dir']},
+              outputs=get_image_files("impact_rule_coverage.eps"), compute=plot.plot_rule_coverage)
     print()
 
 
 if __name__ == "__main__":
-    do_analysis()
+    import argparse
+    parser = argparse.ArgumentParser(description="Reading impact agreement analysis")
+    parser.add_argument("--force", action="append", choices=STAGES, default=[],
+                        help="recompute this stage and all stages that depend on it (can be repeated)")
+    parser.add_argument("--no-cache", action="store_true", help="recompute all stages without using the cache")
+    parser.add_argument("--telemetry", default=config['telemetry_file'],
+                        help="JSON lines file the stage measurements of the run are appended to")
+    parser.add_argument("--no-telemetry", action="store_true", help="do not measure the stages")
+    parser.add_argument("--prometheus", default=config['telemetry_prometheus_file'],
+                        help="also write the stage measurements to this Prometheus text file")
+    parser.add_argument("--trace-memory", action="store_true", default=config['telemetry_trace_memory'],
+                        help="record peak Python allocations and top allocators per stage (slow)")
+    args = parser.parse_args()
+    telemetry = StageTelemetry(args.telemetry, prometheus_file=args.prometheus, trace_memory=args.trace_memory,
+                               enabled=not args.no_telemetry)
+    status = "error"
+    try:
+        do_analysis(force_stages=args.force, use_cache=not args.no_cache, telemetry=telemetry)
+        status = "ok"
+    finally:
+        telemetry.close(status)
+    if telemetry.enabled:
+        print("Stage measurements")
+        telemetry.print_summary()
@@ -0,0 +1,195 @@
+from typing import Dict, Iterable, Iterator, List
+import csv
+import json
+import os
+import numpy as np
+
+# impact types of the model and the columns of the per-review table that count them, in table order
+IMPACT_COLUMNS = {
+    "Affect": "Emotional_impact",
+    "Narrative": "Narrative_feeling",
+    "Reflection": "Reflection",
+    "Style": "Aesthetic_feeling",
+}
+IMPACT_TYPES = list(IMPACT_COLUMNS.keys())
+REVIEW_HEADERS = ["bookid", "responseid", "num_sentences"] + list(IMPACT_COLUMNS.values()) + ["All"]
+
+
+def get_review_id(sentence_id: str) -> str:
+    """sentence ids are <review id>-<sentence index within the review>"""
+    return sentence_id.rsplit("-", 1)[0]
+
+
+def read_review_books(review_file: str) -> Dict[str, str]:
+    """reads the book of each review from a tab or comma separated file with bookid and responseid columns"""
+    with open(review_file, 'rt', newline='') as fh:
+        dialect = csv.Sniffer().sniff(fh.readline(), delimiters="\t,")
+        fh.seek(0)
+        return {row["responseid"]: row["bookid"] for row in csv.DictReader(fh, dialect=dialect)}
+
+
+def iter_sentence_scores(score_source: str) -> Iterator[dict]:
+    """yields the sentence scores of a corpus scoring output directory or a JSON lines file of sentence scores"""
+    if os.path.isdir(score_source):
+        from corpus_scoring import iter_corpus_scores
+        yield from iter_corpus_scores(score_source)
+    else:
+        with open(score_source, 'rt') as fh:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class ImpactAggregator(object):
+
+    def __init__(self, review_books: Dict[str, str] = None, batch_size: int = 10000):
+        """
+        Sums sentence impact scores per review. Sentences are added in batches, each batch is turned
+        into a review index and an impact count per sentence and summed per review with bincount.
+        Only the per review sums are kept, so memory grows with the number of reviews, not sentences.
+        """
+        self.review_books = review_books if review_books else {}
+        self.batch_size = batch_size
+        self.review_index = {}
+        self.review_ids = []
+        self.num_sentences = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, len(IMPACT_TYPES)), dtype=np.int64)
+        self.type_index = {impact_type: type_index for type_index, impact_type in enumerate(IMPACT_TYPES)}
+
+    def __len__(self):
+        return len(self.review_ids)
+
+    def grow(self, num_reviews: int) -> None:
+        """makes room for num_reviews reviews, doubling the arrays to keep growing amortized"""
+        if num_reviews <= len(self.num_sentences):
+            return
+        capacity = max(num_reviews, 2 * len(self.num_sentences), 1024)
+        num_sentences = np.zeros(capacity, dtype=np.int64)
+        num_sentences[:len(self.num_sentences)] = self.num_sentences
+        counts = np.zeros((capacity, len(IMPACT_TYPES)), dtype=np.int64)
+        counts[:len(self.counts)] = self.counts
+        self.num_sentences, self.counts = num_sentences, counts
+
+    def add_batch(self, sentence_scores: List[dict]) -> None:
+        sentence_reviews = np.zeros(len(sentence_scores), dtype=np.int64)
+        # impact counts as (sentence, impact type, count) triples, most sentences have no impact
+        score_sentences, score_types, score_counts = [], [], []
+        for sentence_index, sentence_score in enumerate(sentence_scores):
+            review_id = get_review_id(sentence_score["sentence_id"])
+            if review_id not in self.review_index:
+                self.review_index[review_id] = len(self.review_ids)
+                self.review_ids.append(review_id)
+            sentence_reviews[sentence_index] = self.review_index[review_id]
+            for impact_type, count in sentence_score["impact_score"].items():
+                if impact_type in self.type_index:
+                    score_sentences.append(sentence_index)
+                    score_types.append(self.type_index[impact_type])
+                    score_counts.append(count)
+        num_reviews = len(self.review_ids)
+        self.grow(num_reviews)
+        self.num_sentences[:num_reviews] += np.bincount(sentence_reviews, minlength=num_reviews)
+        if score_sentences:
+            cells = sentence_reviews[score_sentences] * len(IMPACT_TYPES) + np.array(score_types)
+            self.counts[:num_reviews] += np.bincount(cells, weights=score_counts,
+                                                     minlength=num_reviews * len(IMPACT_TYPES)) \
+                .reshape(num_reviews, len(IMPACT_TYPES)).astype(np.int64)
+
+    def add(self, sentence_scores: Iterable[dict]) -> None:
+        """adds a stream of sentence scores, as yielded by iter_sentence_scores"""
+        batch = []
+        for sentence_score in sentence_scores:
+            batch.append(sentence_score)
+            if len(batch) == self.batch_size:
+                self.add_batch(batch)
+                batch = []
+        if batch:
+            self.add_batch(batch)
+
+    def get_review_table(self) -> Dict[str, np.ndarray]:
+        """per review impact counts per type and in total, and the counts per sentence"""
+        num_reviews = len(self.review_ids)
+        counts = np.hstack([self.counts[:num_reviews], self.counts[:num_reviews].sum(axis=1, keepdims=True)])
+        num_sentences = self.num_sentences[:num_reviews]
+        return {
+            "bookid": np.array([self.review_books.get(review_id, "") for review_id in self.review_ids], dtype=object),
+            "responseid": np.array(self.review_ids, dtype=object),
+            "num_sentences": num_sentences,
+            "counts": counts,
+            "rates": counts / num_sentences[:, None],
+        }
+
+    def get_book_table(self) -> Dict[str, np.ndarray]:
+        """
+        Per book number of reviews and sentences, impact counts, counts per sentence and the fraction
+        of reviews with at least one match, per impact type and in total. Reviews without a known book
+        are grouped under an empty book id.
+        """
+        review_table = self.get_review_table()
+        book_ids, review_books = np.unique(review_table["bookid"].astype(str), return_inverse=True)
+        num_books = len(book_ids)
+
+        def sum_per_book(values):
+            return np.stack([np.bincount(review_books, weights=column, minlength=num_books)
+                             for column in values.T], axis=1)
+
+        num_reviews = np.bincount(review_books, minlength=num_books)
+        num_sentences = np.bincount(review_books, weights=review_table["num_sentences"], minlength=num_books)
+        counts = sum_per_book(review_table["counts"])
+        return {
+            "bookid": book_ids,
+            "num_reviews": num_reviews,
+            "num_sentences": num_sentences.astype(np.int64),
+            "counts": counts.astype(np.int64),
+            "rates": counts / num_sentences[:, None],
+            "review_fractions": sum_per_book((review_table["counts"] > 0).astype(float)) / num_reviews[:, None],
+        }
+
+
+def write_review_table(aggregator: ImpactAggregator, review_file: str) -> None:
+    """writes the per review impact counts in the layout plot.plot_rule_coverage reads"""
+    review_table = aggregator.get_review_table()
+    with open(review_file, 'wt', newline='') as fh:
+        writer = csv.writer(fh, delimiter="\t")
+        writer.writerow(REVIEW_HEADERS)
+        for review_index in range(len(aggregator)):
+            writer.writerow([review_table["bookid"][review_index], review_table["responseid"][review_index],
+                             review_table["num_sentences"][review_index]]
+                            + review_table["counts"][review_index].tolist())
+
+
+def write_book_table(aggregator: ImpactAggregator, book_file: str) -> None:
+    book_table = aggregator.get_book_table()
+    impact_columns = REVIEW_HEADERS[3:]
+    with open(book_file, 'wt', newline='') as fh:
+        writer = csv.writer(fh, delimiter="\t")
+        writer.writerow(["bookid", "num_reviews", "num_sentences"] + impact_columns
+                        + [f"{column}_per_sentence" for column in impact_columns]
+                        + [f"{column}_review_fraction" for column in impact_columns])
+        for book_index, book_id in enumerate(book_table["bookid"]):
+            writer.writerow([book_id, book_table["num_reviews"][book_index], book_table["num_sentences"][book_index]]
+                            + book_table["counts"][book_index].tolist()
+                            + [f"{rate:.4f}" for rate in book_table["rates"][book_index]]
+                            + [f"{fraction:.4f}" for fraction in book_table["review_fractions"][book_index]])
+
+
+def print_aggregation_summary(aggregator: ImpactAggregator) -> None:
+    review_table = aggregator.get_review_table()
+    num_sentences = review_table["num_sentences"].sum()
+    print(f"\t{len(aggregator)} reviews with {num_sentences} sentences")
+    for column_index, column in enumerate(REVIEW_HEADERS[3:]):
+        counts = review_table["counts"][:, column_index]
+        print(f"\t{column: <20}\tmatches: {counts.sum()}\tper sentence: {counts.sum() / num_sentences:.4f}"
+              f"\treviews with a match: {(counts > 0).mean():.4f}")
+
+
+def aggregate_impact(score_sources: List[str], review_file: str, book_file: str = None,
+                     review_books: Dict[str, str] = None) -> ImpactAggregator:
+    """aggregates the sentence scores of one or more score sources per review and writes the review table"""
+    aggregator = ImpactAggregator(review_books=review_books)
+    for score_source in score_sources:
+        aggregator.add(iter_sentence_scores(score_source))
+    write_review_table(aggregator, review_file)
+    if book_file:
+        write_book_table(aggregator, book_file)
+    print_aggregation_summary(aggregator)
+    return aggregator
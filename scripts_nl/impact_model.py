@@ -1,5 +1,9 @@
 from collections import defaultdict
 import pickle
+import re
+
+from phrase_prefilter import PhrasePrefilter
+from sequence_matcher import make_sequence_pattern
 
 class ImpactModel(object):
 
@@ -8,6 +12,7 @@ class ImpactModel(object):
         self.impact_rules = [make_impact_rule(rule_json) for rule_json in impact_rules_json]
         self.make_rule_index()
         self.index_aspect_terms(aspect_terms_json)
+        self.compile()
 
     def make_rule_index(self):
         """makes an indexes of all impact rules per impact term"""
@@ -15,6 +20,74 @@ class ImpactModel(object):
         for impact_rule in self.impact_rules:
             self.impact_rule_index[impact_rule.impact_term.string].append(impact_rule)
 
+    def compile(self):
+        """pre-compiles rule patterns and builds the indexes used by the matcher"""
+        self.compile_patterns()
+        self.make_sequence_patterns(getattr(self, "discontinuous_max_gap", None))
+        self.make_term_rule_index()
+        self.make_aspect_group_index()
+        self.phrase_prefilter = PhrasePrefilter([(rule_index, impact_rule.pattern)
+                                                 for rule_index, impact_rule in self.phrase_rules])
+        self.compiled = True
+
+    def make_sequence_patterns(self, max_gap=None):
+        """
+        replaces the regular expressions of discontinuous phrases by sequence patterns, which match in linear time.
+        With max_gap at most max_gap tokens may occur between the parts of a discontinuous phrase.
+        """
+        self.discontinuous_max_gap = max_gap
+        for impact_rule in self.impact_rules:
+            impact_rule.compile_sequence_patterns(max_gap)
+
+    def make_term_rule_index(self):
+        """
+        makes an index from sentence lemmas to the (rule index, rule) pairs of the term rules they can match,
+        and a list of all phrase rules
+        """
+        self.term_rule_index = {}
+        self.phrase_rules = []
+        for rule_index, impact_rule in enumerate(self.impact_rules):
+            if impact_rule.impact_term.type == "phrase":
+                self.phrase_rules.append((rule_index, impact_rule))
+                continue
+            ignorecase = bool(impact_rule.ignorecase)
+            if ignorecase not in self.term_rule_index:
+                self.term_rule_index[ignorecase] = TermIndex(ignorecase)
+            self.term_rule_index[ignorecase].add_term(impact_rule.impact_term.string, (rule_index, impact_rule))
+
+    def make_aspect_group_index(self):
+        """makes an index per aspect group, with and without ignoring case, from sentence terms to (term order, aspect term) pairs"""
+        self.aspect_group_term_index = {True: {}, False: {}}
+        for ignorecase, group_index in self.aspect_group_term_index.items():
+            for group in self.aspect_group_index:
+                group_index[group] = TermIndex(ignorecase)
+                for term_order, aspect_term in enumerate(self.aspect_group_index[group]):
+                    group_index[group].add_term(aspect_term, (term_order, aspect_term))
+
+    def compile_patterns(self):
+        """pre-compiles the patterns of all phrase rules, context conditions and wildcard terms"""
+        self.wildcard_patterns = {}
+        for impact_rule in self.impact_rules:
+            impact_rule.compile_patterns()
+            if impact_rule.impact_term.type == "term":
+                self.add_wildcard_pattern(impact_rule.impact_term.string)
+        for aspect_term in self.aspect_term_index:
+            self.add_wildcard_pattern(aspect_term)
+
+    def add_wildcard_pattern(self, term):
+        """compiles a wildcard term as given and in lowercase, which is how the matcher looks it up"""
+        if not is_wildcard_term(term):
+            return None
+        for case_term in [term, term.lower()]:
+            if case_term not in self.wildcard_patterns:
+                self.wildcard_patterns[case_term] = make_wildcard_pattern(case_term)
+
+    def wildcard_pattern(self, term):
+        """returns the compiled pattern of a wildcard term, compiling it if it is not part of the model"""
+        if term not in self.wildcard_patterns:
+            self.wildcard_patterns[term] = make_wildcard_pattern(term)
+        return self.wildcard_patterns[term]
+
     def impact_term_rules(self, impact_term):
         """returns all impact rules for a given impact term"""
         if impact_term not in self.impact_rule_index:
@@ -53,6 +126,69 @@ class ImpactModel(object):
             "aspect_group": group
         }
 
+class TermTrie(object):
+
+    def __init__(self, reverse=False):
+        """character trie of terms, reversed terms are used for suffix lookup"""
+        self.root = {}
+        self.reverse = reverse
+
+    def add(self, term, value):
+        node = self.root
+        for char in reversed(term) if self.reverse else term:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def lookup(self, string):
+        """returns the values of all terms that are a prefix (or for a reversed trie a suffix) of string"""
+        values = []
+        node = self.root
+        for char in reversed(string) if self.reverse else string:
+            if char not in node:
+                break
+            node = node[char]
+            if None in node:
+                values += node[None]
+        return values
+
+class TermIndex(object):
+
+    def __init__(self, ignorecase=True):
+        """
+        Index of terms for looking up which terms match a sentence word or lemma. Exact terms are looked up
+        in a dictionary, wildcard terms in a prefix trie ("term*") or suffix trie ("*term"). Wildcard terms
+        that contain regular expression syntax are kept as patterns that are checked against every lookup.
+        """
+        self.ignorecase = ignorecase
+        self.exact_terms = defaultdict(list)
+        self.prefix_trie = TermTrie()
+        self.suffix_trie = TermTrie(reverse=True)
+        self.pattern_terms = []
+
+    def add_term(self, term, value):
+        """adds a term with a value that is returned when the term matches"""
+        if self.ignorecase:
+            term = term.lower()
+        if not is_wildcard_term(term):
+            self.exact_terms[term].append(value)
+        elif not re.fullmatch(r"\w+", term.strip("*")):
+            self.pattern_terms.append((value, make_wildcard_pattern(term)))
+        elif term[0] == "*":
+            self.suffix_trie.add(term[1:], value)
+        else:
+            self.prefix_trie.add(term[:-1], value)
+
+    def lookup(self, string):
+        """
+        returns the values of all terms that match the string.
+        For an ignorecase index the string should already be lowercased.
+        """
+        values = self.exact_terms.get(string, []) + self.prefix_trie.lookup(string) + self.suffix_trie.lookup(string)
+        for value, pattern in self.pattern_terms:
+            if pattern.search(string):
+                values.append(value)
+        return values
+
 class ImpactTerm(object):
 
     def __init__(self, impact_string, impact_group, string_pos, group_type):
@@ -83,10 +219,69 @@ class ImpactRule(object):
         self.remarks = None if remarks == "" else remarks
         self.impact_type = expand_impact_code(code)
         self.ignorecase = ignorecase
+        self.compile_patterns()
+
+    def compile_patterns(self):
+        """pre-compiles the phrase pattern of the impact term and the pattern of a context condition"""
+        self.pattern = None
+        self.condition_pattern = None
+        if self.impact_term.type == "phrase":
+            self.pattern = make_phrase_pattern(self.impact_term.string, ignorecase=self.ignorecase)
+        if self.condition and self.condition["condition_type"] == "context_term":
+            self.condition_pattern = make_phrase_pattern(self.condition["context_term"],
+                                                         location=self.condition["location"],
+                                                         ignorecase=self.ignorecase)
+
+    def compile_sequence_patterns(self, max_gap=None):
+        """uses sequence patterns for a discontinuous impact phrase and context condition, where they apply"""
+        if self.pattern and "discontinuous" in self.impact_term.group:
+            regex = getattr(self.pattern, "regex", self.pattern)
+            self.pattern = make_sequence_pattern(regex, max_gap) or regex
+        if self.condition_pattern and self.condition.get("phrase_type") == "discontinuous":
+            regex = getattr(self.condition_pattern, "regex", self.condition_pattern)
+            self.condition_pattern = make_sequence_pattern(regex, max_gap) or regex
 
     def __repr__(self):
         return "%s(%r)" % (self.__class__, self.__dict__)
 
+def is_wildcard_term(term: str) -> bool:
+    """
+    Determine if term is a wildcard term, e.g. starts or ends with an asterix ("*").
+    Wildcards on both sides are not allowed, since this is reserved for special terms.
+    E.g. the asterixes in "*zucht*" (*sigh* in Dutch) carry meaning on how to interpret "zucht".
+    """
+    if term[0] == "*" and term[-1] == "*":
+        return False
+    elif term[0] == "*" or term[-1] == "*":
+        return True
+    else:
+        return False
+
+def make_wildcard_pattern(term: str):
+    """
+    Compile a wildcard term into a regular expression for matching a sentence term.
+    A leading asterix matches any sentence term ending with the term ("*boek" matches "kinderboek"),
+    a trailing asterix matches any sentence term starting with the term ("gebeurtenis*" matches "gebeurtenissen").
+    """
+    if term[0] == "*":
+        return re.compile(term[1:] + r"$")
+    else:
+        return re.compile(r"^" + term[:-1])
+
+def make_phrase_pattern(phrase: str, location: str = "neighbourhood", ignorecase: bool = True):
+    """
+    Compile a phrase into a regular expression with word boundaries and location anchors.
+    With ignorecase the phrase is lowercased, as it is matched against the lowercased sentence string.
+    """
+    if ignorecase:
+        phrase = phrase.lower()
+    match_string = r"\b" + phrase + r"\b"
+    if location == "sentence_start":
+        match_string = r"^" + match_string
+    elif location == "sentence_end":
+        match_string = match_string + r"$"
+    return re.compile(match_string)
+
 def parse_phrase_wildcards(phrase):
     return phrase.replace("*", r"\w*")
 
@@ -212,7 +407,10 @@ def make_aspect_term(aspect_term_json):
     return AspectTerm(aspect_term_json["Aspect_term"], aspect_term_json["Aspect_category"])
 
 def load_model(model_file):
-    """Load an impact model from a pickle file."""
+    """Load an impact model from a pickle file and compile its patterns."""
     with open(model_file, 'rb') as fh:
-        return pickle.load(fh)
+        impact_model = pickle.load(fh)
+    # pickled models are restored without calling __init__, so patterns and indexes are made here
+    impact_model.compile()
+    return impact_model
 
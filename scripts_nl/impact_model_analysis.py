@@ -1,13 +1,15 @@
 from typing import Dict, List, Tuple
-from collections import defaultdict
 import os
 import tarfile
 import json
-import pickle
 from collections import Counter
 import csv
 
-from alpino_matcher import AlpinoMatcher
+import numpy as np
+
+from impact_scorer import ImpactScorer
+from impact_model import ImpactModel
+import model_artifact
 import human_rater_analysis
 
 
@@ -40,15 +42,8 @@ def read_tarred_sentences(sentences_file: str) -> dict:
     return sentence_data
 
 
-def score_sentence_impact(sentence: dict, alpino_matcher: AlpinoMatcher) -> Dict[str, int]:
-    alpino_ds = json.loads(sentence["alpino_ds"])
-    matches = alpino_matcher.match_rules(alpino_sentence=alpino_ds)
-    impact_score = defaultdict(int)
-    for match in matches:
-        if match["impact_type"]:
-            impact_score[match["impact_type"]] += 1
-        # print(match)
-    return impact_score
+def score_sentence_impact(sentence: dict, impact_scorer: ImpactScorer) -> Dict[str, int]:
+    return impact_scorer.score(sentence["alpino_ds"])
 
 
 def map_impact(impact_score: dict) -> Dict[str, int]:
@@ -60,44 +55,44 @@ def map_impact(impact_score: dict) -> Dict[str, int]:
     }
 
 
-def load_impact_model(impact_model_file: str) -> dict:
-    with open(impact_model_file, 'rb') as fh:
-        return pickle.load(fh)
+def load_impact_model(impact_model_file: str) -> ImpactModel:
+    """loads a compiled model artifact, or an impact model pickle"""
+    return model_artifact.load_model_file(impact_model_file)
 
 
 def score_impact_sentences(sentence_ratings: List[dict], sentence_alpino_data: dict, config) -> None:
     impact_model = load_impact_model(config['impact_model_file'])
-    alpino_matcher = AlpinoMatcher(impact_model)
+    if config.get('discontinuous_max_gap') is not None:
+        impact_model.make_sequence_patterns(config['discontinuous_max_gap'])
+    impact_scorer = ImpactScorer(impact_model)
     #print("Number of sentences:", len(sentence_ratings))
     for sentence in sentence_ratings:
         sentence_id = sentence["sentence_id"]
         #print(sentence_id)
-        impact_score = score_sentence_impact(sentence_alpino_data[sentence_id], alpino_matcher)
+        impact_score = score_sentence_impact(sentence_alpino_data[sentence_id], impact_scorer)
         sentence["model_impact_score"] = map_impact(impact_score)
         #print(impact_score)
         #print(sentence["model_impact_score"])
         # break
 
 
-def sample_model_scores(sentence_ratings: list, impact_scale: str,
-                        ira_threshold: float, config: dict) -> Tuple[List[float], List[float]]:
+def sample_model_scores(sentence_ratings: list, impact_scale: str, ira_threshold: float, config: dict,
+                        rating_tensor: human_rater_analysis.RatingTensor = None) -> Tuple[List[float], List[float]]:
+    if not rating_tensor:
+        rating_tensor = human_rater_analysis.RatingTensor(sentence_ratings, [impact_scale])
+    # skip sentences with only a single rating (and the rest NAs) or with only NAs,
+    # and sentences where the IRA is below a given threshold
+    selected = rating_tensor.has_agreement(impact_scale) \
+        & (rating_tensor.ira(impact_scale, config['null_dist']) >= ira_threshold)
+    rater_scores = rating_tensor.median(impact_scale)
     sample_0 = []
     sample_1 = []
-    for sentence in sentence_ratings:
-        scores = human_rater_analysis.get_rater_scores(sentence, impact_scale)
-        # skip sentences with only a single rating (and the rest NAs) or with only NAs
-        if len(scores) < 2:
-            continue
-        ira_score = human_rater_analysis.calculate_sentence_interrater_agreement(scores, config['null_dist'])
-        # skip sentences where the IRA is below a given threshold
-        if ira_score < ira_threshold:
-            continue
-        model_score = sentence["model_impact_score"][impact_scale]
-        rater_score = human_rater_analysis.calculate_avg_rater_score(impact_scale, sentence, avg_type="median")
+    for index in np.flatnonzero(selected):
+        model_score = sentence_ratings[index]["model_impact_score"][impact_scale]
         if model_score >= 1:
-            sample_1 += [float(rater_score)]
+            sample_1 += [float(rater_scores[index])]
         else:
-            sample_0 += [float(rater_score)]
+            sample_0 += [float(rater_scores[index])]
     return sample_0, sample_1
 
 
@@ -112,6 +107,28 @@ def get_model_agreement(sentences: list, impact_scale: str) -> Counter:
     return model_agreement
 
 
+def do_model_agreement_analysis(sentence_ratings: list, ira_threshold: float, config: dict,
+                                rating_tensor: human_rater_analysis.RatingTensor = None):
+    if not rating_tensor:
+        rating_tensor = human_rater_analysis.RatingTensor(sentence_ratings, config['impact_scales'])
+    model_agreement_high = {}
+    model_agreement_low = {}
+    print(f'\n\tImpact scale    \tTotal sentences\tIRA >= {ira_threshold}\tIRA < {ira_threshold}'
+          + '\tIgnored (1 or 0 non-NA ratings)')
+    for impact_scale in config['impact_scales']:
+        sentences_high_ira = human_rater_analysis.get_sentences_high_ira(sentence_ratings, impact_scale,
+                                                                         ira_threshold, config['null_dist'],
+                                                                         rating_tensor=rating_tensor)
+        sentences_low_ira = human_rater_analysis.get_sentences_low_ira(sentence_ratings, impact_scale,
+                                                                       ira_threshold, config['null_dist'],
+                                                                       rating_tensor=rating_tensor)
+        model_agreement_high[impact_scale] = get_model_agreement(sentences_high_ira, impact_scale)
+        model_agreement_low[impact_scale] = get_model_agreement(sentences_low_ira, impact_scale)
+        ignored = len(sentence_ratings) - len(sentences_high_ira) - len(sentences_low_ira)
+        print(f'\t{impact_scale: <20}\t{len(sentence_ratings)}\t\t{len(sentences_high_ira)}\t\t{len(sentences_low_ira)}\t\t{ignored}')
+    write_model_agreement_table(model_agreement_high, model_agreement_low, ira_threshold, config)
+
+
 def write_model_agreement_table(agreement_high: Dict[str, Counter], agreement_low: Dict[str, Counter],
                                 ira_threshold: float, config: dict):
     output_file = os.path.join(config['data_dir'], f'model_agreement.IRA_treshold-{ira_threshold}.csv')
@@ -0,0 +1,75 @@
+from typing import Dict, Iterable, Iterator, List, Union
+from collections import defaultdict
+import json
+
+from alpino_matcher import AlpinoMatcher, AlpinoSentence, AlpinoError
+from impact_model import ImpactModel
+from rule_profiler import ProfilingAlpinoMatcher, RuleProfile
+
+
+def make_alpino_sentence(sentence: Union[AlpinoSentence, dict, str, bytes]) -> AlpinoSentence:
+    """
+    Turn a sentence into an AlpinoSentence. Accepts an AlpinoSentence, the JSON representation of
+    Alpino XML output as dict or string, or a parse archive record with an "alpino_ds" field.
+    """
+    if isinstance(sentence, AlpinoSentence):
+        return sentence
+    if isinstance(sentence, (str, bytes)):
+        sentence = json.loads(sentence)
+    if isinstance(sentence, dict) and "alpino_ds" in sentence:
+        return make_alpino_sentence(sentence["alpino_ds"])
+    if isinstance(sentence, dict):
+        return AlpinoSentence(sentence)
+    raise AlpinoError("sentence must be an AlpinoSentence object or a JSON representation of Alpino XML output")
+
+
+class ImpactScorer(object):
+
+    def __init__(self, impact_model: ImpactModel, max_count: int = None, profile: RuleProfile = None):
+        """
+        Scores sentences on reading impact with an impact model. The scorer keeps no state per sentence,
+        each call matches with its own AlpinoMatcher, so a single scorer can be shared between threads.
+        The model is only read during scoring.
+        With max_count the score per impact type is capped at max_count and rule evaluation for an impact type
+        stops once it is reached. Use max_count=1 when only the presence of impact matters.
+        With a profile, per rule counts and timings are recorded in it. All rules are then evaluated whatever
+        max_count is, so the profile covers every rule, and the capped scores are the same. A scorer with a
+        profile should not be shared between threads.
+        """
+        if not impact_model or not isinstance(impact_model, ImpactModel):
+            raise AlpinoError("ImpactScorer must be instantiated with an ImpactModel object")
+        if not getattr(impact_model, "compiled", False):
+            impact_model.compile()
+        self.impact_model = impact_model
+        self.max_count = max_count
+        self.profile = profile
+
+    def make_matcher(self) -> AlpinoMatcher:
+        if self.profile:
+            return ProfilingAlpinoMatcher(self.impact_model, self.profile)
+        return AlpinoMatcher(self.impact_model)
+
+    def match(self, sentence: Union[AlpinoSentence, dict, str, bytes]) -> List[dict]:
+        """returns all impact rule matches of a sentence"""
+        alpino_matcher = self.make_matcher()
+        return alpino_matcher.match_rules(alpino_sentence=make_alpino_sentence(sentence))
+
+    def score(self, sentence: Union[AlpinoSentence, dict, str, bytes]) -> Dict[str, int]:
+        """returns the number of matching impact rules per impact type, capped at max_count if it is set"""
+        if self.max_count and not self.profile:
+            alpino_matcher = AlpinoMatcher(self.impact_model)
+            return alpino_matcher.count_rule_matches(alpino_sentence=make_alpino_sentence(sentence),
+                                                     max_count=self.max_count)
+        impact_score = defaultdict(int)
+        for match in self.match(sentence):
+            if match["impact_type"]:
+                impact_score[match["impact_type"]] += 1
+        if self.max_count:
+            for impact_type in impact_score:
+                impact_score[impact_type] = min(impact_score[impact_type], self.max_count)
+        return impact_score
+
+    def score_many(self, sentences: Iterable[Union[AlpinoSentence, dict, str, bytes]]) -> Iterator[Dict[str, int]]:
+        """lazily scores a sequence of sentences, yielding the impact score of each in order"""
+        for sentence in sentences:
+            yield self.score(sentence)
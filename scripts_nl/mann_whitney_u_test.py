@@ -1,91 +1,116 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from collections import defaultdict
+import numpy as np
 import scipy.stats as stats
 
 import human_rater_analysis
 import impact_model_analysis
 
 
-def make_mwu_test_samples(sentence_ratings: list, ira_threshold: float, config: dict) -> Dict[str, List[dict]]:
-    impact_scales = ["emotional_scale", "style_scale", "reflection_scale", "narrative_scale", "emotional_valence"]
+def make_mwu_test_samples(sentence_ratings: list, ira_threshold: float, config: dict,
+                          rating_tensor: human_rater_analysis.RatingTensor = None) -> Dict[str, List[dict]]:
+    if not rating_tensor:
+        rating_tensor = human_rater_analysis.RatingTensor(sentence_ratings, config['impact_scales'])
     samples = defaultdict(list)
-    for sentence in sentence_ratings:
-        for impact_scale in impact_scales:
-            scores = human_rater_analysis.get_rater_scores(sentence, impact_scale)
-            # skip sentences with only a single rating (and the rest NAs) or with only NAs
-            if len(scores) < 2:
-                continue
-            ira_score = human_rater_analysis.calculate_sentence_interrater_agreement(scores, config)
-            # skip sentences where the IRA is below a given threshold
-            if ira_score < ira_threshold:
-                continue
-            model_score = sentence["model_impact_score"][impact_scale]
+    for impact_scale in config['impact_scales']:
+        # skip sentences with only a single rating (and the rest NAs) or with only NAs,
+        # and sentences where the IRA is below a given threshold
+        selected = rating_tensor.has_agreement(impact_scale) \
+            & (rating_tensor.ira(impact_scale, config['null_dist']) >= ira_threshold)
+        rater_scores = rating_tensor.median(impact_scale)
+        for index in np.flatnonzero(selected):
+            model_score = sentence_ratings[index]["model_impact_score"][impact_scale]
             if model_score > 1:
                 model_score = 1
-            rater_score = human_rater_analysis.calculate_avg_rater_score(impact_scale, sentence, avg_type="median")
-            samples[impact_scale] += [{"impact_model": model_score, "human_rater": float(rater_score)}]
+            samples[impact_scale] += [{"impact_model": model_score, "human_rater": float(rater_scores[index])}]
     return samples
 
 
-def rank_samples(sample_model_0, sample_model_1):
-    sample_0 = [{"model": 0, "score": score} for score in sample_model_0]
-    sample_1 = [{"model": 1, "score": score} for score in sample_model_1]
-    samples = sample_0 + sample_1
-    sorted_samples = sorted(samples, key=lambda x: x["score"], reverse=True)
-    for item_index, item in enumerate(sorted_samples):
-        item_rank = item_index + 1
-        item["rank"] = item_rank
-    avg_rank = get_avg_rank_samples(samples)
-    for item in sorted_samples:
-        item["avg_rank"] = avg_rank[item["score"]]
-    return sorted_samples
+def get_mid_ranks(scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rank scores from high to low, tied scores all get the average of the ranks they span.
+    Returns the rank of each score and the size of each group of tied scores.
+    """
+    # rank on the negated scores so the highest score gets rank 1
+    _values, inverse, tie_sizes = np.unique(-scores, return_inverse=True, return_counts=True)
+    mid_ranks = np.cumsum(tie_sizes) - (tie_sizes - 1) / 2
+    return mid_ranks[inverse], tie_sizes
 
 
-def get_avg_rank_samples(samples):
-    rater_values = set([item["score"] for item in samples])
-    avg_rank = {}
-    for rater_value in rater_values:
-        sum_rank = sum([item["rank"] for item in samples if item["score"] == rater_value])
-        num_rank = len([item["rank"] for item in samples if item["score"] == rater_value])
-        avg_rank[rater_value] = sum_rank / num_rank
-    return avg_rank
+def rank_samples(sample_model_0: List[float], sample_model_1: List[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """returns the mid-ranks of the pooled samples, the sample (model) of each rank and the tie group sizes"""
+    scores = np.concatenate([np.asarray(sample_model_0, dtype=float), np.asarray(sample_model_1, dtype=float)])
+    models = np.concatenate([np.zeros(len(sample_model_0), dtype=int), np.ones(len(sample_model_1), dtype=int)])
+    mid_ranks, tie_sizes = get_mid_ranks(scores)
+    return mid_ranks, models, tie_sizes
 
 
-def test_samples(sample_model_0: List[float], sample_model_1: List[float]):
-    ranked_samples = rank_samples(sample_model_0, sample_model_1)
-    R_model_0 = sum([item["avg_rank"] for item in ranked_samples if item["model"] == 0])
-    R_model_1 = sum([item["avg_rank"] for item in ranked_samples if item["model"] == 1])
-    N_model_0 = len([item for item in ranked_samples if item["model"] == 0])
-    N_model_1 = len([item for item in ranked_samples if item["model"] == 1])
+def test_samples(sample_model_0: List[float], sample_model_1: List[float], use_continuity: bool = True) -> dict:
+    """
+    Mann-Whitney U test of the human ratings of sentences without (model 0) and with (model 1) impact
+    according to the model. Ranks run from the highest to the lowest rating, so U of model 0 counts the
+    pairs where the model 1 sentence is rated higher. The two-sided p-value uses the normal approximation
+    with tie correction, the effect size is the rank-biserial correlation, positive when model 1
+    sentences are rated higher.
+    """
+    mid_ranks, models, tie_sizes = rank_samples(sample_model_0, sample_model_1)
+    N_model_0, N_model_1 = len(sample_model_0), len(sample_model_1)
+    N = N_model_0 + N_model_1
+    R_model_1 = float(mid_ranks[models == 1].sum())
+    R_model_0 = float(mid_ranks.sum()) - R_model_1
     U_model_0 = R_model_0 - N_model_0 * (N_model_0 + 1) / 2
     U_model_1 = R_model_1 - N_model_1 * (N_model_1 + 1) / 2
-    test_0 = {
-        "model": 0,
-        "N": N_model_0,
-        "R": R_model_0,
-        "U": U_model_0
+    num_pairs = N_model_0 * N_model_1
+    test = {
+        "model_0": {"model": 0, "N": N_model_0, "R": R_model_0, "U": U_model_0},
+        "model_1": {"model": 1, "N": N_model_1, "R": R_model_1, "U": U_model_1},
+        "U": min(U_model_0, U_model_1),
+        "z": float("nan"),
+        "p": float("nan"),
+        "effect_size": (U_model_0 - U_model_1) / num_pairs if num_pairs else float("nan")
     }
-    test_1 = {
-        "model": 1,
-        "N": N_model_1,
-        "R": R_model_1,
-        "U": U_model_1
-    }
-    return test_0, test_1
+    if num_pairs == 0 or N < 2:
+        return test
+    tie_term = float((tie_sizes.astype(float) ** 3 - tie_sizes).sum()) / (N * (N - 1))
+    sigma = np.sqrt(num_pairs / 12 * ((N + 1) - tie_term))
+    if sigma == 0:
+        return test
+    mu = num_pairs / 2
+    diff = max(U_model_0, U_model_1) - mu
+    if use_continuity:
+        diff -= 0.5
+    test["z"] = float(diff / sigma)
+    test["p"] = float(min(1.0, 2 * stats.norm.sf(test["z"])))
+    return test
+
+
+def test_scales(scale_samples: Dict[str, Tuple[List[float], List[float]]],
+                use_continuity: bool = True) -> Dict[str, dict]:
+    """returns the Mann-Whitney U test result for the (model 0, model 1) samples of each impact scale"""
+    return {impact_scale: test_samples(sample_model_0, sample_model_1, use_continuity=use_continuity)
+            for impact_scale, (sample_model_0, sample_model_1) in scale_samples.items()}
 
 
-def do_mann_whitney_u_test(sentence_ratings: list, ira_threshold: float, config):
+def do_mann_whitney_u_test(sentence_ratings: list, ira_threshold: float, config,
+                           rating_tensor: human_rater_analysis.RatingTensor = None):
     impact_scales = ["emotional_scale", "style_scale", "reflection_scale", "narrative_scale"]
+    if not rating_tensor:
+        rating_tensor = human_rater_analysis.RatingTensor(sentence_ratings, impact_scales)
+    scale_samples = {}
+    for impact_scale in impact_scales:
+        scale_samples[impact_scale] = impact_model_analysis.sample_model_scores(sentence_ratings, impact_scale,
+                                                                                ira_threshold, config,
+                                                                                rating_tensor=rating_tensor)
+    scale_tests = test_scales(scale_samples)
     for impact_scale in impact_scales:
         print(f'\n\t{impact_scale}')
-        sample_model_0, sample_model_1 = impact_model_analysis.sample_model_scores(sentence_ratings,
-                                                                                   impact_scale,
-                                                                                   ira_threshold, config)
-        test_0, test_1 = test_samples(sample_model_0, sample_model_1)
+        sample_model_0, sample_model_1 = scale_samples[impact_scale]
+        test = scale_tests[impact_scale]
+        test_0, test_1 = test["model_0"], test["model_1"]
         print("\t\tR model X = 0:", test_0["R"], "\tR model X >= 1:", test_1["R"])
         print("\t\tN model X = 0:", test_0["N"], "\tN model X >= 1:", test_1["N"])
         print("\t\tU model X = 0:", test_0["U"], "\tU model X >= 1:", test_1["U"])
+        print("\t\tz:", test["z"], "\tp:", test["p"], "\trank-biserial r:", test["effect_size"])
+        # cross-check with the scipy implementation
         u_statistic, pVal = stats.mannwhitneyu(sample_model_0, sample_model_1)
         print("\t\tU:", u_statistic, "\tp:", pVal)
-
-
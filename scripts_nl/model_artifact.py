@@ -0,0 +1,236 @@
+from typing import Dict, List
+from collections import defaultdict
+import hashlib
+import json
+import mmap
+import re
+
+from impact_model import ImpactModel, ImpactRule, ImpactTerm, expand_impact_code, load_model
+from phrase_prefilter import PhrasePrefilter
+from section_file import StringTable, make_uint_array, read_section_file, uint_array_bytes, uint_array_view
+from section_file import write_section_file
+
+# A model artifact is a section file (see section_file.write_section_file) with these sections.
+# All tables are unsigned 32 bit integer arrays of string ids, flags or offsets, NO_VALUE stands for None.
+#   string_offsets, string_data     interned strings, as in a token store
+#   term_*                          string, group, pos and type of the impact terms of the model
+#   rule_*                          impact term fields, code, condition (as JSON), filter, remarks, ignorecase
+#                                   and the phrase and context condition pattern sources of each impact rule
+#   aspect_group_terms, aspect_group_names    (group, term) pairs in aspect group index order
+#   aspect_term_groups, aspect_term_names     (term, group) pairs in aspect term index order
+#   wildcard_terms, wildcard_patterns          wildcard terms and their pattern sources
+#   prefilter_rules, prefilter_literal_offsets, prefilter_literals
+#                                   required literals of each phrase rule for the phrase prefilter
+# The term rule and aspect group indexes are rebuilt from the tables, which takes well under a millisecond.
+MODEL_MAGIC = b"IMPMODL1"
+MODEL_SCHEMA_VERSION = 1
+NO_VALUE = 0xFFFFFFFF
+
+TERM_FIELDS = ["string", "group", "pos", "type"]
+RULE_FIELDS = ["term_string", "term_group", "term_pos", "term_type", "code", "condition", "filter", "remarks",
+               "ignorecase", "pattern", "condition_pattern"]
+
+
+class ModelArtifactError(Exception):
+    pass
+
+
+def get_content_hash(sections: Dict[str, bytes]) -> str:
+    """sha256 of the names and content of all sections, in order"""
+    content_hash = hashlib.sha256()
+    for section, data in sections.items():
+        content_hash.update(section.encode("utf-8"))
+        content_hash.update(len(data).to_bytes(8, "little"))
+        content_hash.update(data)
+    return content_hash.hexdigest()
+
+
+def make_rule_values(impact_rule: ImpactRule) -> Dict[str, object]:
+    return {
+        "term_string": impact_rule.impact_term.string,
+        "term_group": impact_rule.impact_term.group,
+        "term_pos": impact_rule.impact_term.pos,
+        "term_type": impact_rule.impact_term.type,
+        "code": impact_rule.code,
+        "condition": json.dumps(impact_rule.condition) if impact_rule.condition else None,
+        "filter": int(impact_rule.filter),
+        "remarks": impact_rule.remarks,
+        "ignorecase": None if impact_rule.ignorecase is None else int(impact_rule.ignorecase),
+        "pattern": impact_rule.pattern.pattern if impact_rule.pattern else None,
+        "condition_pattern": impact_rule.condition_pattern.pattern if impact_rule.condition_pattern else None,
+    }
+
+
+def write_model_artifact(impact_model: ImpactModel, artifact_file: str) -> str:
+    """
+    Write a compiled impact model to a versioned artifact file. The model can be made from the rule,
+    term and aspect JSON or loaded from a pickle. Returns the content hash of the artifact.
+    """
+    if not getattr(impact_model, "compiled", False):
+        impact_model.compile()
+    string_table = StringTable()
+
+    def string_id(string):
+        return NO_VALUE if string is None else string_table.intern(string)
+
+    columns = defaultdict(make_uint_array)
+    for impact_term in impact_model.impact_terms:
+        for field in TERM_FIELDS:
+            columns[f"term_{field}"].append(string_id(getattr(impact_term, field)))
+    for impact_rule in impact_model.impact_rules:
+        for field, value in make_rule_values(impact_rule).items():
+            if field in ["filter", "ignorecase"]:
+                columns[f"rule_{field}"].append(NO_VALUE if value is None else value)
+            else:
+                columns[f"rule_{field}"].append(string_id(value))
+    for group, terms in impact_model.aspect_group_index.items():
+        for term in terms:
+            columns["aspect_group_names"].append(string_id(group))
+            columns["aspect_group_terms"].append(string_id(term))
+    for term, groups in impact_model.aspect_term_index.items():
+        for group in groups:
+            columns["aspect_term_names"].append(string_id(term))
+            columns["aspect_term_groups"].append(string_id(group))
+    for term, pattern in impact_model.wildcard_patterns.items():
+        columns["wildcard_terms"].append(string_id(term))
+        columns["wildcard_patterns"].append(string_id(pattern.pattern))
+    columns["prefilter_literal_offsets"].append(0)
+    for rule_index, literals in impact_model.phrase_prefilter.pattern_literals.items():
+        columns["prefilter_rules"].append(rule_index)
+        for literal in sorted(literals) if literals else []:
+            columns["prefilter_literals"].append(string_id(literal))
+        columns["prefilter_literal_offsets"].append(len(columns["prefilter_literals"]))
+    string_data = bytearray()
+    for string in string_table.strings:
+        columns["string_offsets"].append(len(string_data))
+        string_data += string.encode("utf-8")
+    columns["string_offsets"].append(len(string_data))
+    sections = {section: uint_array_bytes(columns[section]) for section in sorted(columns)}
+    sections["string_data"] = bytes(string_data)
+    header = {
+        "schema_version": MODEL_SCHEMA_VERSION,
+        "content_hash": get_content_hash(sections),
+        "num_terms": len(impact_model.impact_terms),
+        "num_rules": len(impact_model.impact_rules),
+        "num_strings": len(string_table.strings)
+    }
+    write_section_file(artifact_file, MODEL_MAGIC, header, sections)
+    return header["content_hash"]
+
+
+def compile_model(impact_terms_json: List[dict], impact_rules_json: List[dict], aspect_terms_json: List[dict],
+                  artifact_file: str) -> str:
+    """compile the impact term, rule and aspect JSON into a model artifact, returns the content hash"""
+    return write_model_artifact(ImpactModel(impact_terms_json, impact_rules_json, aspect_terms_json), artifact_file)
+
+
+def is_model_artifact(model_file: str) -> bool:
+    with open(model_file, 'rb') as fh:
+        return fh.read(len(MODEL_MAGIC)) == MODEL_MAGIC
+
+
+def load_model_file(model_file: str) -> ImpactModel:
+    """loads a compiled model artifact, or an impact model pickle"""
+    if is_model_artifact(model_file):
+        return read_model_artifact(model_file)
+    return load_model(model_file)
+
+
+def make_impact_rule(rule_values: Dict[str, object]) -> ImpactRule:
+    impact_term = ImpactTerm(rule_values["term_string"], rule_values["term_group"],
+                             rule_values["term_pos"], rule_values["term_type"])
+    # the condition is stored parsed and the patterns compiled, so the rule is restored
+    # without calling __init__, as unpickling does
+    impact_rule = ImpactRule.__new__(ImpactRule)
+    impact_rule.impact_term = impact_term
+    impact_rule.code = rule_values["code"]
+    impact_rule.condition = json.loads(rule_values["condition"]) if rule_values["condition"] else None
+    impact_rule.filter = bool(rule_values["filter"])
+    impact_rule.remarks = rule_values["remarks"]
+    impact_rule.impact_type = expand_impact_code(rule_values["code"])
+    impact_rule.ignorecase = None if rule_values["ignorecase"] is None else bool(rule_values["ignorecase"])
+    impact_rule.pattern = re.compile(rule_values["pattern"]) if rule_values["pattern"] is not None else None
+    impact_rule.condition_pattern = re.compile(rule_values["condition_pattern"]) \
+        if rule_values["condition_pattern"] is not None else None
+    return impact_rule
+
+
+def read_model_artifact(artifact_file: str, verify_hash: bool = True) -> ImpactModel:
+    """
+    Load a compiled impact model from a memory-mapped artifact file, after checking the schema
+    version and (optionally) the content hash. No pickle or rule parsing is involved.
+    """
+    with open(artifact_file, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header, section_views = read_section_file(mm, MODEL_MAGIC, artifact_file)
+        try:
+            if header["schema_version"] != MODEL_SCHEMA_VERSION:
+                raise ModelArtifactError(f"unsupported model schema version {header['schema_version']}, "
+                                         f"expected {MODEL_SCHEMA_VERSION}")
+            if verify_hash and get_content_hash(section_views) != header["content_hash"]:
+                raise ModelArtifactError(f"content hash of {artifact_file} does not match its header")
+            columns = {section: uint_array_view(section_view).tolist()
+                       for section, section_view in section_views.items() if section != "string_data"}
+            string_data = bytes(section_views["string_data"])
+        finally:
+            # the map can only be closed when no views of it are left
+            for section_view in section_views.values():
+                section_view.release()
+    offsets = columns["string_offsets"]
+    strings = [str(string_data[offsets[string_id]:offsets[string_id + 1]], "utf-8")
+               for string_id in range(header["num_strings"])]
+    impact_model = make_model(columns, strings, header)
+    impact_model.content_hash = header["content_hash"]
+    return impact_model
+
+
+def make_model(columns: Dict[str, List[int]], strings: List[str], header: dict) -> ImpactModel:
+
+    def string_value(string_id):
+        return None if string_id == NO_VALUE else strings[string_id]
+
+    # the model is restored without calling __init__, which parses the rule JSON
+    impact_model = ImpactModel.__new__(ImpactModel)
+    impact_model.impact_terms = [ImpactTerm(*[string_value(columns[f"term_{field}"][term_index])
+                                              for field in TERM_FIELDS])
+                                 for term_index in range(header["num_terms"])]
+    impact_model.impact_rules = []
+    for rule_index in range(header["num_rules"]):
+        rule_values = {}
+        for field in RULE_FIELDS:
+            value = columns[f"rule_{field}"][rule_index]
+            if field in ["filter", "ignorecase"]:
+                rule_values[field] = None if value == NO_VALUE else value
+            else:
+                rule_values[field] = string_value(value)
+        impact_model.impact_rules.append(make_impact_rule(rule_values))
+    impact_model.make_rule_index()
+    impact_model.aspect_group_index = defaultdict(dict)
+    for group_id, term_id in zip(columns["aspect_group_names"], columns["aspect_group_terms"]):
+        impact_model.aspect_group_index[strings[group_id]][strings[term_id]] = 1
+    impact_model.aspect_term_index = defaultdict(dict)
+    for term_id, group_id in zip(columns["aspect_term_names"], columns["aspect_term_groups"]):
+        impact_model.aspect_term_index[strings[term_id]][strings[group_id]] = 1
+    impact_model.wildcard_patterns = {strings[term_id]: re.compile(strings[pattern_id])
+                                      for term_id, pattern_id in zip(columns["wildcard_terms"],
+                                                                     columns["wildcard_patterns"])}
+    impact_model.make_sequence_patterns()
+    impact_model.make_term_rule_index()
+    impact_model.make_aspect_group_index()
+    literal_offsets = columns["prefilter_literal_offsets"]
+    pattern_literals = {}
+    for position, rule_index in enumerate(columns["prefilter_rules"]):
+        literal_ids = columns["prefilter_literals"][literal_offsets[position]:literal_offsets[position + 1]]
+        pattern_literals[rule_index] = set(strings[literal_id] for literal_id in literal_ids) or None
+    impact_model.phrase_prefilter = PhrasePrefilter([(rule_index, impact_rule.pattern)
+                                                     for rule_index, impact_rule in impact_model.phrase_rules],
+                                                    pattern_literals=pattern_literals)
+    impact_model.compiled = True
+    return impact_model
+
+
+if __name__ == "__main__":
+    from config import config
+    # one-time conversion of the pickled model, which is the only form of the rules in this repository
+    pickled_model = load_model(config['impact_model_pickle_file'])
+    content_hash = write_model_artifact(pickled_model, config['impact_model_file'])
+    print(f"\twrote model artifact {config['impact_model_file']} with content hash {content_hash}")
@@ -0,0 +1,104 @@
+from typing import Dict, List, Optional, Set, Tuple
+from collections import defaultdict
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+REPEAT_OPS = [sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT]
+if hasattr(sre_parse, "POSSESSIVE_REPEAT"):
+    REPEAT_OPS.append(sre_parse.POSSESSIVE_REPEAT)
+
+
+def required_literals(subpattern) -> Optional[Set[str]]:
+    """
+    Return a set of literal strings of which at least one occurs in every match of a parsed
+    regular expression, or None if no such set can be derived.
+    E.g. (komt|komen).+(over) gives {"over"} and (moet|moeten).+lezen gives {"lezen"}.
+    """
+    candidates = []
+    run = ""
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            run += chr(av)
+            continue
+        if run:
+            candidates.append({run})
+            run = ""
+        literals = None
+        if op is sre_parse.SUBPATTERN:
+            _group, add_flags, _del_flags, group_pattern = av
+            if not add_flags & re.IGNORECASE:
+                literals = required_literals(group_pattern)
+        elif op is sre_parse.BRANCH:
+            alternatives = [required_literals(alternative) for alternative in av[1]]
+            if all(alternatives):
+                literals = set().union(*alternatives)
+        elif op in REPEAT_OPS and av[0] >= 1:
+            literals = required_literals(av[2])
+        if literals:
+            candidates.append(literals)
+    if run:
+        candidates.append({run})
+    if not candidates:
+        return None
+    # prefer the most selective set: long literals and few alternatives
+    return max(candidates, key=lambda literals: (min(len(literal) for literal in literals), -len(literals)))
+
+
+def get_pattern_literals(pattern: str) -> Optional[Set[str]]:
+    """parse a regular expression and return the literals of which at least one is required for a match"""
+    parsed = sre_parse.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    return required_literals(parsed)
+
+
+class PhrasePrefilter(object):
+
+    def __init__(self, phrase_patterns: List[Tuple[int, re.Pattern]],
+                 pattern_literals: Dict[int, Optional[Set[str]]] = None):
+        """
+        Scans a sentence once for the required literals of all phrase patterns, so that the full
+        pattern only needs to be run for rules of which a literal occurs in the sentence.
+        Patterns without required literals are always reported.
+        The literals per rule index can be given when they were derived before, e.g. in a compiled model.
+        """
+        self.literal_rules = defaultdict(list)
+        self.unfiltered_rules = []
+        self.pattern_literals = {}
+        for rule_index, pattern in phrase_patterns:
+            if pattern_literals is not None:
+                literals = pattern_literals[rule_index]
+            else:
+                literals = get_pattern_literals(pattern.pattern)
+            self.pattern_literals[rule_index] = literals
+            if not literals:
+                self.unfiltered_rules.append(rule_index)
+                continue
+            for literal in literals:
+                self.literal_rules[literal].append(rule_index)
+        # At each position the alternation reports only the longest literal starting there,
+        # all other literals starting at that position are prefixes of it.
+        literals = sorted(self.literal_rules, key=lambda literal: (-len(literal), literal))
+        self.literal_prefixes = {literal: [prefix for prefix in literals if literal.startswith(prefix)]
+                                 for literal in literals}
+        self.literal_pattern = None
+        if literals:
+            alternation = "|".join(re.escape(literal) for literal in literals)
+            self.literal_pattern = re.compile(r"(?=(" + alternation + r"))")
+
+    def scan(self, text: str) -> Dict[int, List[int]]:
+        """returns for each rule that may match the text the offsets of its literal hits"""
+        rule_offsets = {rule_index: [] for rule_index in self.unfiltered_rules}
+        if not self.literal_pattern:
+            return rule_offsets
+        for match in self.literal_pattern.finditer(text):
+            for literal in self.literal_prefixes[match.group(1)]:
+                for rule_index in self.literal_rules[literal]:
+                    if rule_index not in rule_offsets:
+                        rule_offsets[rule_index] = []
+                    rule_offsets[rule_index].append(match.start())
+        return rule_offsets
@@ -1,15 +1,15 @@
-from typing import Dict
+from typing import Dict, Iterable
 from collections import Counter
 import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
 import os
 
 import impact_model_analysis
 from config import config
+from coverage_histogram import CoverageHistograms, get_coverage_histograms
 
 
-def plot_num_annotations_distribution(sentence_ratings: list) -> None:
+def plot_num_annotations_distribution(sentence_ratings: Iterable[dict]) -> None:
     annotator_freq = Counter()
     for sentence in sentence_ratings:
         if sentence["annotation_status"] == "todo":
@@ -90,19 +90,20 @@ def setBoxColors(bp, color1, color2):
     plt.setp(bp['medians'][1], color=color2)
 
 
-def get_data_for_boxplot(sentence_ratings: list, ira_threshold: float, config: dict):
+def get_data_for_boxplot(sentence_ratings: list, ira_threshold: float, config: dict, rating_tensor=None):
     data_to_plot = {}
     impact_scales = ["emotional_scale", "style_scale", "reflection_scale", "narrative_scale"]
     for impact_scale in impact_scales:
         sample_model_0, sample_model_1 = impact_model_analysis.sample_model_scores(sentence_ratings,
                                                                                    impact_scale,
-                                                                                   ira_threshold, config)
+                                                                                   ira_threshold, config,
+                                                                                   rating_tensor=rating_tensor)
         data_to_plot[impact_scale] = [sample_model_0, sample_model_1]
     return data_to_plot
 
 
-def do_model_box_plot(sentences_done: list, ira_threshold: float, config: dict):
-    data_to_plot = get_data_for_boxplot(sentences_done, ira_threshold, config)
+def do_model_box_plot(sentences_done: list, ira_threshold: float, config: dict, rating_tensor=None):
+    data_to_plot = get_data_for_boxplot(sentences_done, ira_threshold, config, rating_tensor=rating_tensor)
     plt.style.use('grayscale')
     ax = plt.axes()
     scales = ["emotional_scale", "narrative_scale", "style_scale", "reflection_scale"]
@@ -232,15 +233,14 @@ def plot_per_sentence_ira_dist(ira_dist: Dict[str, Counter]) -> None:
     plt.close()
 
 
-def plot_rule_coverage():
+def plot_rule_coverage(histograms: CoverageHistograms = None):
     impact_columns = ['Emotional_impact', 'Aesthetic_feeling', 'Reflection', 'Narrative_feeling', 'All']
-    df = pd.read_csv(config['aggr_impact_file'], sep='\t')
+    if not histograms:
+        histograms = get_coverage_histograms([config['aggr_impact_file']], config['coverage_histogram_file'],
+                                             config['coverage_max_value'])
     linestyles = ['-', '--', '-.', ':']
     for ci, column in enumerate(impact_columns):
-        sorted_counts = sorted([(value, count) for value, count in df[column].value_counts().iteritems()])
-        values, counts = zip(*sorted_counts)
-        count_probs = [count / sum(counts) for count in counts]
-        x_values, y_values = values, count_probs
+        x_values, y_values = histograms.get_fractions(column)
         if ci < 4:
             linestyle = linestyles[ci]
             color = '#111111'
@@ -0,0 +1,227 @@
+from typing import Dict, List
+import csv
+import heapq
+import json
+import os
+import time
+
+from alpino_matcher import AlpinoMatcher
+from impact_model import ImpactModel
+
+PROFILE_VERSION = 1
+COUNT_FIELDS = ["evaluations", "hits", "condition_pass", "condition_fail", "seconds"]
+REPORT_HEADERS = ["rule_index", "impact_term", "impact_term_type", "pos", "impact_type", "condition", "filter",
+                  "evaluations", "hits", "condition_pass", "condition_fail", "seconds", "microseconds_per_evaluation"]
+# number of characters of the sentence string kept with a sample of a slow evaluation
+SAMPLE_STRING_LENGTH = 200
+
+
+class RuleProfile(object):
+
+    def __init__(self, num_rules: int, max_samples: int = 20):
+        """
+        Counts per impact rule, by the index of the rule in the impact model: the number of evaluations, hits
+        and condition passes and fails, and the cumulative seconds of evaluation. An evaluation is a rule
+        matched against a sentence, or with the rule index, a term rule matched against a candidate word.
+        The max_samples slowest (rule, sentence) evaluations are kept as samples.
+        """
+        self.num_rules = num_rules
+        self.max_samples = max_samples
+        self.counts = {field: [0] * num_rules for field in COUNT_FIELDS}
+        self.num_sentences = 0
+        self.sentence_seconds = 0.0
+        # min-heap of (seconds, rule index, sentence id, sentence string), so the fastest sample is replaced first
+        self.samples = []
+        # id of the sentence that is being matched, set by the caller to label the samples
+        self.sentence_id = None
+        # index of each rule object, made once per profile rather than once per matcher
+        self.rule_indexes = None
+
+    def get_rule_indexes(self, impact_model: ImpactModel) -> Dict[int, int]:
+        if self.rule_indexes is None:
+            if len(impact_model.impact_rules) != self.num_rules:
+                raise ValueError(f"the profile has {self.num_rules} rules, the impact model has "
+                                 f"{len(impact_model.impact_rules)}")
+            self.rule_indexes = {id(impact_rule): rule_index
+                                 for rule_index, impact_rule in enumerate(impact_model.impact_rules)}
+        return self.rule_indexes
+
+    def add_sample(self, seconds: float, rule_index: int, sentence_id: str, sentence_string: str) -> None:
+        sample = (seconds, rule_index, sentence_id, sentence_string[:SAMPLE_STRING_LENGTH])
+        if len(self.samples) < self.max_samples:
+            heapq.heappush(self.samples, sample)
+        elif seconds > self.samples[0][0]:
+            heapq.heapreplace(self.samples, sample)
+
+    def merge(self, other: "RuleProfile") -> None:
+        """adds the counts and samples of another profile of the same impact model, e.g. of another worker"""
+        if other.num_rules != self.num_rules:
+            raise ValueError(f"cannot merge profiles of {other.num_rules} and {self.num_rules} rules")
+        for field in COUNT_FIELDS:
+            self.counts[field] = [count + other_count for count, other_count
+                                  in zip(self.counts[field], other.counts[field])]
+        self.num_sentences += other.num_sentences
+        self.sentence_seconds += other.sentence_seconds
+        self.samples = heapq.nlargest(self.max_samples, self.samples + other.samples)
+        heapq.heapify(self.samples)
+
+    def get_slowest_samples(self) -> List[tuple]:
+        return sorted(self.samples, reverse=True)
+
+    def to_json(self) -> dict:
+        return {
+            "profile_version": PROFILE_VERSION,
+            "num_rules": self.num_rules,
+            "max_samples": self.max_samples,
+            "num_sentences": self.num_sentences,
+            "sentence_seconds": self.sentence_seconds,
+            "counts": self.counts,
+            "samples": [list(sample) for sample in self.get_slowest_samples()]
+        }
+
+    @classmethod
+    def from_json(cls, profile_json: dict) -> "RuleProfile":
+        if profile_json.get("profile_version") != PROFILE_VERSION:
+            raise ValueError(f"unsupported rule profile version {profile_json.get('profile_version')}")
+        profile = cls(profile_json["num_rules"], max_samples=profile_json["max_samples"])
+        profile.num_sentences = profile_json["num_sentences"]
+        profile.sentence_seconds = profile_json["sentence_seconds"]
+        profile.counts = {field: list(profile_json["counts"][field]) for field in COUNT_FIELDS}
+        profile.samples = [tuple(sample) for sample in profile_json["samples"]]
+        heapq.heapify(profile.samples)
+        return profile
+
+
+class ProfilingAlpinoMatcher(AlpinoMatcher):
+
+    def __init__(self, impact_model: ImpactModel, profile: RuleProfile, **kwargs):
+        """
+        AlpinoMatcher that records per rule counts and timings in a RuleProfile. The counting is done in
+        this subclass only, so AlpinoMatcher itself does no profiling work at all. Samples of slow evaluations
+        are labelled with the sentence_id of the profile, or else of the sentence if it has one.
+        """
+        super().__init__(impact_model, **kwargs)
+        self.profile = profile
+        self.rule_indexes = profile.get_rule_indexes(impact_model)
+        self.timing = False
+
+    def match_rules(self, alpino_sentence=None):
+        start = time.perf_counter()
+        matches = super().match_rules(alpino_sentence)
+        self.profile.sentence_seconds += time.perf_counter() - start
+        self.profile.num_sentences += 1
+        return matches
+
+    def timed_evaluation(self, impact_rule, match_func, *args):
+        """calls a matching function for an impact rule as a single evaluation, unless already inside one"""
+        if self.timing:
+            return match_func(*args)
+        self.timing = True
+        start = time.perf_counter()
+        try:
+            result = match_func(*args)
+        finally:
+            self.timing = False
+        seconds = time.perf_counter() - start
+        rule_index = self.rule_indexes[id(impact_rule)]
+        counts = self.profile.counts
+        counts["evaluations"][rule_index] += 1
+        counts["seconds"][rule_index] += seconds
+        if result:
+            counts["hits"][rule_index] += len(result) if isinstance(result, list) else 1
+        if len(self.profile.samples) < self.profile.max_samples or seconds > self.profile.samples[0][0]:
+            sentence_id = self.profile.sentence_id or getattr(self.alpino_sentence, "sentence_id", None)
+            self.profile.add_sample(seconds, rule_index, sentence_id, self.alpino_sentence.sentence_string)
+        return result
+
+    def match_impact_phrase(self, impact_rule):
+        return self.timed_evaluation(impact_rule, super().match_impact_phrase, impact_rule)
+
+    def match_impact_term(self, impact_rule):
+        return self.timed_evaluation(impact_rule, super().match_impact_term, impact_rule)
+
+    def match_impact_term_node(self, impact_rule, impact_index, impact_node):
+        return self.timed_evaluation(impact_rule, super().match_impact_term_node, impact_rule, impact_index,
+                                     impact_node)
+
+    def count_condition(self, impact_rule, match: bool) -> bool:
+        if impact_rule.condition:
+            field = "condition_pass" if match else "condition_fail"
+            self.profile.counts[field][self.rule_indexes[id(impact_rule)]] += 1
+        return match
+
+    def match_condition(self, impact_rule, impact_match):
+        return self.count_condition(impact_rule, super().match_condition(impact_rule, impact_match))
+
+    def check_condition(self, impact_rule) -> bool:
+        return self.count_condition(impact_rule, super().check_condition(impact_rule))
+
+
+def get_rule_rows(profile: RuleProfile, impact_model: ImpactModel) -> List[Dict[str, object]]:
+    rule_rows = []
+    for rule_index, impact_rule in enumerate(impact_model.impact_rules):
+        evaluations = profile.counts["evaluations"][rule_index]
+        seconds = profile.counts["seconds"][rule_index]
+        condition = impact_rule.condition
+        rule_rows.append({
+            "rule_index": rule_index,
+            "impact_term": impact_rule.impact_term.string,
+            "impact_term_type": impact_rule.impact_term.type,
+            "pos": impact_rule.impact_term.pos,
+            "impact_type": impact_rule.impact_type,
+            "condition": condition.get("aspect_group", condition.get("context_term")) if condition else None,
+            "filter": impact_rule.filter,
+            "evaluations": evaluations,
+            "hits": profile.counts["hits"][rule_index],
+            "condition_pass": profile.counts["condition_pass"][rule_index],
+            "condition_fail": profile.counts["condition_fail"][rule_index],
+            "seconds": seconds,
+            "microseconds_per_evaluation": seconds / evaluations * 1e6 if evaluations else 0.0
+        })
+    return rule_rows
+
+
+def sort_rule_rows(rule_rows: List[dict], sort_by: str = "seconds") -> List[dict]:
+    if sort_by not in REPORT_HEADERS:
+        raise ValueError(f"cannot sort on {sort_by}, use one of {', '.join(REPORT_HEADERS)}")
+    return sorted(rule_rows, key=lambda rule_row: (rule_row[sort_by] is not None, rule_row[sort_by]), reverse=True)
+
+
+def write_profile(profile: RuleProfile, profile_file: str) -> None:
+    with open(profile_file + ".tmp", 'wt') as fh:
+        json.dump(profile.to_json(), fh)
+    os.replace(profile_file + ".tmp", profile_file)
+
+
+def read_profile(profile_file: str) -> RuleProfile:
+    with open(profile_file, 'rt') as fh:
+        return RuleProfile.from_json(json.load(fh))
+
+
+def write_profile_report(profile: RuleProfile, impact_model: ImpactModel, report_file: str,
+                         sort_by: str = "seconds") -> None:
+    """writes the per rule counts as a tab separated table, sorted on sort_by in descending order"""
+    with open(report_file, 'wt') as fh:
+        csv_writer = csv.DictWriter(fh, fieldnames=REPORT_HEADERS, delimiter='\t')
+        csv_writer.writeheader()
+        for rule_row in sort_rule_rows(get_rule_rows(profile, impact_model), sort_by):
+            csv_writer.writerow(rule_row)
+
+
+def print_profile_report(profile: RuleProfile, impact_model: ImpactModel, sort_by: str = "seconds",
+                         top: int = 20) -> None:
+    rule_seconds = sum(profile.counts["seconds"])
+    print(f"\t{profile.num_sentences} sentences matched in {profile.sentence_seconds:.2f}s, "
+          f"of which {rule_seconds:.2f}s in rule evaluations")
+    print(f"\ttop {top} rules by {sort_by}")
+    print("\t" + "\t".join(["rule", "impact_term", "type", "impact_type", "evals", "hits", "cond_pass",
+                            "cond_fail", "seconds", "us/eval"]))
+    for rule_row in sort_rule_rows(get_rule_rows(profile, impact_model), sort_by)[:top]:
+        print(f"\t{rule_row['rule_index']}\t{rule_row['impact_term']}\t{rule_row['impact_term_type']}"
+              f"\t{rule_row['impact_type']}\t{rule_row['evaluations']}\t{rule_row['hits']}"
+              f"\t{rule_row['condition_pass']}\t{rule_row['condition_fail']}\t{rule_row['seconds']:.4f}"
+              f"\t{rule_row['microseconds_per_evaluation']:.1f}")
+    print("\tslowest evaluations")
+    for seconds, rule_index, sentence_id, sentence_string in profile.get_slowest_samples():
+        impact_term = impact_model.impact_rules[rule_index].impact_term.string
+        print(f"\t{seconds * 1e6:.0f}us\trule {rule_index} ({impact_term})\tsentence {sentence_id}\t{sentence_string}")
@@ -0,0 +1,38 @@
+import datetime
+import os
+import platform
+import subprocess
+import sys
+
+ENVIRONMENT_PACKAGES = ["numpy", "scipy", "pandas", "matplotlib", "openpyxl"]
+
+
+def get_git_commit() -> str:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment() -> dict:
+    """metadata to tell whether two runs are comparable"""
+    from importlib import metadata
+    package_versions = {}
+    for package in ENVIRONMENT_PACKAGES:
+        try:
+            package_versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            package_versions[package] = None
+    return {
+        "python": sys.version,
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "packages": package_versions,
+        "git_commit": get_git_commit(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
@@ -0,0 +1,83 @@
+from typing import Dict, Iterable, Tuple
+from array import array
+import json
+import mmap
+import struct
+import sys
+
+# A section file consists of the magic bytes, the length of a JSON header and the header, followed by
+# the sections listed in the header, each 4 byte aligned. Token stores and model artifacts are section files.
+
+
+class StringTable(object):
+
+    def __init__(self):
+        """interns strings, mapping each distinct string to an integer id"""
+        self.string_ids = {}
+        self.strings = []
+
+    def intern(self, string: str) -> int:
+        if string not in self.string_ids:
+            self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.string_ids[string]
+
+
+def make_uint_array(values: Iterable[int] = ()) -> array:
+    return array("I", values)
+
+
+def write_section_file(file_name: str, magic: bytes, header: dict, sections: Dict[str, bytes]) -> None:
+    """
+    Write a file of the magic bytes, the length of a JSON header and the header, followed by the
+    sections. The offset and length of each section are added to the header. Sections are 4 byte aligned.
+    """
+    header["sections"] = {}
+    # sections start after the header, the header length depends on the offsets so lay them out relative first
+    offset = 0
+    for section, data in sections.items():
+        header["sections"][section] = [offset, len(data)]
+        offset += len(data) + (-len(data) % 4)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = len(magic) + 4 + len(header_bytes)
+    padding = -data_start % 4
+    with open(file_name, 'wb') as fh:
+        fh.write(magic)
+        fh.write(struct.pack("<I", len(header_bytes) + padding))
+        fh.write(header_bytes + b" " * padding)
+        for section, data in sections.items():
+            fh.write(data)
+            fh.write(b"\0" * (-len(data) % 4))
+
+
+def read_section_file(mm: mmap.mmap, magic: bytes, file_name: str) -> Tuple[dict, Dict[str, memoryview]]:
+    """returns the header and a byte view per section of a memory-mapped section file"""
+    if mm[:len(magic)] != magic:
+        raise ValueError(f"{file_name} is not a {magic.decode('ascii')} file")
+    header_length, = struct.unpack_from("<I", mm, len(magic))
+    header_start = len(magic) + 4
+    header = json.loads(bytes(mm[header_start:header_start + header_length]))
+    data_start = header_start + header_length
+    view = memoryview(mm)
+    section_views = {section: view[data_start + offset:data_start + offset + length]
+                     for section, (offset, length) in header["sections"].items()}
+    return header, section_views
+
+
+def uint_array_bytes(values: array) -> bytes:
+    return values.tobytes() if sys.byteorder == "little" else byteswapped(values)
+
+
+def uint_array_view(section_view: memoryview) -> memoryview:
+    """view of a section as unsigned 32 bit integers, copied only on big endian machines"""
+    if sys.byteorder != "little":
+        swapped = array("I", section_view.tobytes())
+        swapped.byteswap()
+        section_view = memoryview(swapped)
+    return section_view.cast("I")
+
+
+def byteswapped(values: array) -> bytes:
+    values = array(values.typecode, values)
+    values.byteswap()
+    return values.tobytes()
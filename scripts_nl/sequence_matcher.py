@@ -0,0 +1,271 @@
+from typing import Dict, Iterator, List, Optional
+from collections import defaultdict
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from phrase_prefilter import REPEAT_OPS
+
+# segments that expand to more literals than this are left to the regular expression
+MAX_SEGMENT_LITERALS = 1000
+TOKEN_PATTERN = re.compile(r"\S+")
+
+
+def is_gap(op, av) -> bool:
+    """tells whether a parsed item is the .+ that parse_discontinuous_phrase puts between the parts of a phrase"""
+    return op in REPEAT_OPS and av[0] == 1 and av[1] == sre_parse.MAXREPEAT \
+        and len(av[2]) == 1 and av[2][0][0] is sre_parse.ANY
+
+
+def expand_literals(subpattern) -> Optional[List[str]]:
+    """
+    Returns all strings a parsed regular expression matches, in the order in which the regular expression
+    tries them, or None if it matches more than a small finite set of literals.
+    E.g. (voor (me|mij)) gives ["voor me", "voor mij"].
+    """
+    literals = [""]
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            item_literals = [chr(av)]
+        elif op is sre_parse.SUBPATTERN and not av[1]:
+            item_literals = expand_literals(av[3])
+        elif op is sre_parse.BRANCH:
+            alternatives = [expand_literals(alternative) for alternative in av[1]]
+            if not all(alternatives):
+                return None
+            item_literals = [literal for alternative in alternatives for literal in alternative]
+        else:
+            return None
+        if not item_literals or len(literals) * len(item_literals) > MAX_SEGMENT_LITERALS:
+            return None
+        literals = [literal + item_literal for literal in literals for item_literal in item_literals]
+    return literals
+
+
+def split_discontinuous_pattern(pattern_source: str) -> Optional[List[List[str]]]:
+    r"""
+    Splits the pattern of a discontinuous phrase, \bx1.+x2.+x3\b as made by make_phrase_pattern, in the
+    literals of its parts, or returns None for patterns of another form, or with parts that are not a
+    small set of literals.
+    """
+    parsed = sre_parse.parse(pattern_source)
+    if parsed.state.flags & (re.IGNORECASE | re.MULTILINE | re.DOTALL):
+        return None
+    items = list(parsed)
+    at_boundary = (sre_parse.AT, sre_parse.AT_BOUNDARY)
+    if len(items) < 2 or items[0] != at_boundary or items[-1] != at_boundary:
+        return None
+    segments, segment_items = [], []
+    for op, av in items[1:-1]:
+        if is_gap(op, av):
+            segments.append(segment_items)
+            segment_items = []
+        else:
+            segment_items.append((op, av))
+    segments.append(segment_items)
+    if len(segments) < 2:
+        return None
+    segment_literals = []
+    for segment_items in segments:
+        literals = expand_literals(segment_items) if segment_items else None
+        if not literals or "" in literals:
+            return None
+        segment_literals.append(literals)
+    return segment_literals
+
+
+def is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def is_word_boundary(string: str, offset: int) -> bool:
+    """the \b assertion of the re module for str patterns"""
+    before = offset > 0 and is_word_char(string[offset - 1])
+    after = offset < len(string) and is_word_char(string[offset])
+    return before != after
+
+
+class SequenceMatch(object):
+
+    def __init__(self, string: str, start: int, end: int):
+        """match of a SequencePattern, with the part of the re.Match interface that the matcher uses"""
+        self.string = string
+        self._start = start
+        self._end = end
+
+    def start(self) -> int:
+        return self._start
+
+    def end(self) -> int:
+        return self._end
+
+    def span(self) -> tuple:
+        return self._start, self._end
+
+    def group(self, group: int = 0) -> str:
+        if group != 0:
+            raise IndexError("no such group")
+        return self.string[self._start:self._end]
+
+
+class SequencePattern(object):
+
+    def __init__(self, regex: re.Pattern, segment_literals: List[List[str]], max_gap: int = None):
+        r"""
+        Matches a discontinuous phrase \bx1.+x2 ... .+xn\b as a sequence of parts, in time linear in the
+        length of the sentence, where the regular expression can backtrack over all combinations of the
+        positions of the parts. A single scan finds where the literals of the parts occur. A backward pass
+        then marks the occurrences from which the rest of the phrase can follow. The match starts at the
+        leftmost occurrence of the first part and ends at the rightmost occurrence of the last part,
+        which is the match of the greedy regular expression.
+        With max_gap, at most max_gap tokens (the whitespace separated words of the sentence) may lie in
+        between two consecutive parts. Without it, matches are the same as those of the regular expression.
+        It has the search and finditer methods and the pattern attribute of re.Pattern, so it can be used
+        in place of the regular expression, which is kept as the regex attribute.
+        """
+        self.regex = regex
+        self.pattern = regex.pattern
+        self.segment_literals = segment_literals
+        self.max_gap = max_gap
+        self.num_segments = len(segment_literals)
+        # (segment index, priority) of each literal, priority is the order in which the regex tries the literals
+        self.literal_segments = defaultdict(list)
+        for segment_index, literals in enumerate(segment_literals):
+            for priority, literal in enumerate(literals):
+                self.literal_segments[literal].append((segment_index, priority))
+        # as in PhrasePrefilter, the scan reports the longest literal at each position, and all literals
+        # starting at that position are prefixes of it
+        literals = sorted(self.literal_segments, key=lambda literal: (-len(literal), literal))
+        self.literal_prefixes = {literal: [prefix for prefix in literals if literal.startswith(prefix)]
+                                 for literal in literals}
+        alternation = "|".join(re.escape(literal) for literal in literals)
+        self.literal_pattern = re.compile(r"(?=(" + alternation + r"))")
+
+    def __repr__(self):
+        return f"SequencePattern({self.pattern!r}, max_gap={self.max_gap})"
+
+    def find_occurrences(self, string: str) -> List[Dict[int, list]]:
+        """returns per part the (end, priority) pairs of its literals per start offset"""
+        occurrences = [defaultdict(list) for _ in range(self.num_segments)]
+        for literal_match in self.literal_pattern.finditer(string):
+            start = literal_match.start()
+            for literal in self.literal_prefixes[literal_match.group(1)]:
+                for segment_index, priority in self.literal_segments[literal]:
+                    occurrences[segment_index][start].append((start + len(literal), priority))
+        return occurrences
+
+    def search(self, string: str, pos: int = 0) -> Optional[SequenceMatch]:
+        if pos or "\n" in string:
+            # the . of the regex does not match newlines, sentences have none
+            return self.regex.search(string, pos)
+        occurrences = self.find_occurrences(string)
+        if not all(occurrences):
+            return None
+        # the first part starts at a word boundary, and only its earliest end matters for what can follow
+        first_ends = {start: min(end for end, _priority in ends) for start, ends in occurrences[0].items()
+                      if is_word_boundary(string, start)}
+        middle_ends = [{start: min(end for end, _priority in ends) for start, ends in segment_occurrences.items()}
+                       for segment_occurrences in occurrences[1:-1]]
+        # the last part ends at a word boundary, with the first literal in the order of the regex
+        last_ends = {}
+        for start, ends in occurrences[-1].items():
+            boundary_ends = [(priority, end) for end, priority in ends if is_word_boundary(string, end)]
+            if boundary_ends:
+                last_ends[start] = min(boundary_ends)[1]
+        segment_ends = [first_ends] + middle_ends + [last_ends]
+        if not all(segment_ends):
+            return None
+        if self.max_gap is None:
+            return self.match_sequence(string, segment_ends)
+        return self.match_gapped_sequence(string, segment_ends)
+
+    def match_sequence(self, string: str, segment_ends: List[Dict[int, int]]) -> Optional[SequenceMatch]:
+        # an occurrence can be continued if the rest of the phrase can follow its end, which only depends
+        # on the last start of the next part from which the rest of the phrase can follow
+        last_start = max(segment_ends[-1])
+        for ends in reversed(segment_ends[1:-1]):
+            last_start = max((start for start, end in ends.items() if end < last_start), default=None)
+            if last_start is None:
+                return None
+        match_start = min((start for start, end in segment_ends[0].items() if end < last_start), default=None)
+        if match_start is None:
+            return None
+        # the greedy .+ takes the last start of the last part that can follow
+        last_part_start = max(segment_ends[-1])
+        return SequenceMatch(string, match_start, segment_ends[-1][last_part_start])
+
+    def match_gapped_sequence(self, string: str, segment_ends: List[Dict[int, int]]) -> Optional[SequenceMatch]:
+        length = len(string)
+        token_spans = [token_match.span() for token_match in TOKEN_PATTERN.finditer(string)]
+        # next_token[offset] is the index of the first token starting at or after offset
+        next_token = [len(token_spans)] * (length + 1)
+        token_index = len(token_spans)
+        for offset in range(length, -1, -1):
+            while token_index > 0 and token_spans[token_index - 1][0] >= offset:
+                token_index -= 1
+            next_token[offset] = token_index
+
+        def last_offset_in_gap(end: int) -> int:
+            """the last offset at which the next part can start, with at most max_gap tokens in between"""
+            limit_token = next_token[end] + self.max_gap
+            return token_spans[limit_token][1] - 1 if limit_token < len(token_spans) else length
+
+        # backward pass: the occurrences the rest of the phrase can follow, as the nearest such start of
+        # the next part at or after each offset (next_start) and at or before each offset (previous_start)
+        feasible = [None] * len(segment_ends)
+        feasible[-1] = segment_ends[-1]
+        next_start = self.make_next_starts(feasible[-1], length)
+        previous_starts = [None] * len(segment_ends)
+        previous_starts[-1] = self.make_previous_starts(feasible[-1], length)
+        for segment_index in range(len(segment_ends) - 2, -1, -1):
+            feasible[segment_index] = {start: end for start, end in segment_ends[segment_index].items()
+                                       if next_start[end + 1] is not None
+                                       and next_start[end + 1] <= last_offset_in_gap(end)}
+            if not feasible[segment_index]:
+                return None
+            next_start = self.make_next_starts(feasible[segment_index], length)
+            previous_starts[segment_index] = self.make_previous_starts(feasible[segment_index], length)
+        # forward pass: the leftmost start, then per part the last start within the gap, as the greedy .+ does
+        match_start = min(feasible[0])
+        end = feasible[0][match_start]
+        for segment_index in range(1, len(segment_ends)):
+            start = previous_starts[segment_index][last_offset_in_gap(end)]
+            end = feasible[segment_index][start]
+        return SequenceMatch(string, match_start, end)
+
+    @staticmethod
+    def make_next_starts(starts: Dict[int, int], length: int) -> List[Optional[int]]:
+        next_starts = [None] * (length + 2)
+        for offset in range(length, -1, -1):
+            next_starts[offset] = offset if offset in starts else next_starts[offset + 1]
+        return next_starts
+
+    @staticmethod
+    def make_previous_starts(starts: Dict[int, int], length: int) -> List[Optional[int]]:
+        previous_starts = [None] * (length + 1)
+        previous = None
+        for offset in range(length + 1):
+            if offset in starts:
+                previous = offset
+            previous_starts[offset] = previous
+        return previous_starts
+
+    def finditer(self, string: str) -> Iterator[SequenceMatch]:
+        """the greedy .+ makes a match end at the last occurrence of the last part, so there is at most one"""
+        if "\n" in string:
+            yield from self.regex.finditer(string)
+            return
+        match = self.search(string)
+        if match:
+            yield match
+
+
+def make_sequence_pattern(regex: re.Pattern, max_gap: int = None) -> Optional[SequencePattern]:
+    """returns the sequence pattern of a discontinuous phrase regex, or None if it has another form"""
+    segment_literals = split_discontinuous_pattern(regex.pattern)
+    if not segment_literals:
+        return None
+    return SequencePattern(regex, segment_literals, max_gap=max_gap)
@@ -0,0 +1,132 @@
+from typing import Callable, Iterable, List
+from contextlib import nullcontext, redirect_stdout
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+
+CACHE_VERSION = 1
+
+
+def get_file_hash(file_name: str) -> str:
+    """sha256 of the content of a file"""
+    file_hash = hashlib.sha256()
+    with open(file_name, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_code_version(code_dir: str = None) -> str:
+    """sha256 of the Python sources of the analysis, so any code change invalidates the cached stages"""
+    if not code_dir:
+        code_dir = os.path.dirname(os.path.abspath(__file__))
+    code_hash = hashlib.sha256()
+    for source_file in sorted(glob.glob(os.path.join(code_dir, "*.py"))):
+        code_hash.update(os.path.basename(source_file).encode("utf-8"))
+        code_hash.update(get_file_hash(source_file).encode("ascii"))
+    return code_hash.hexdigest()
+
+
+class Tee(io.StringIO):
+
+    def __init__(self, stream):
+        """collects everything written to it, while passing it on to the stream"""
+        super().__init__()
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+        return super().write(text)
+
+
+class StageCache(object):
+
+    def __init__(self, cache_dir: str, code_version: str = None, force_stages: Iterable[str] = None,
+                 enabled: bool = True, telemetry=None):
+        """
+        Caches the results of the stages of the analysis on disk. The cache key of a stage is a hash of its
+        inputs (file hashes and settings), the keys of the stages it depends on and the code version, so a
+        change upstream invalidates all stages downstream. Printed output of a stage is stored with its
+        result and printed again when the cached result is used.
+        Forced stages, and all stages downstream of them, are always recomputed.
+        With a StageTelemetry, each stage is measured, and its record tells whether the cached result was used.
+        """
+        self.cache_dir = cache_dir
+        self.code_version = code_version if code_version else get_code_version()
+        self.force_stages = set(force_stages) if force_stages else set()
+        self.enabled = enabled
+        self.stage_keys = {}
+        self.stage_upstream = {}
+        self.file_hashes = {}
+        self.telemetry = telemetry
+
+    def file_hash(self, file_name: str) -> str:
+        if file_name not in self.file_hashes:
+            self.file_hashes[file_name] = get_file_hash(file_name)
+        return self.file_hashes[file_name]
+
+    def is_forced(self, stage: str) -> bool:
+        return stage in self.force_stages or any(self.is_forced(upstream) for upstream in self.stage_upstream[stage])
+
+    def make_key(self, stage: str, inputs: dict, upstream: List[str]) -> str:
+        key_data = {
+            "cache_version": CACHE_VERSION,
+            "stage": stage,
+            "inputs": inputs,
+            "upstream": {upstream_stage: self.stage_keys[upstream_stage] for upstream_stage in upstream},
+            "code_version": self.code_version
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def cache_file(self, stage: str, key: str) -> str:
+        return os.path.join(self.cache_dir, stage, f"{key}.json")
+
+    def run(self, stage: str, compute: Callable, inputs: dict = None, upstream: List[str] = None,
+            encode: Callable = None, decode: Callable = None, cached: bool = True, outputs: List[str] = None):
+        """
+        Returns the result of compute() for the stage, from the cache if the stage ran before with the
+        same inputs, upstream stages and code. The result is stored as JSON, encode and decode convert
+        it to and from a JSON serializable form. Stages that are not cached still get a key, for the
+        stages that depend on them.
+        outputs are the files the stage writes, such as plots. The stage is run again if any of them is
+        missing, even if its result is cached.
+        """
+        upstream = list(upstream) if upstream else []
+        self.stage_upstream[stage] = upstream
+        key = self.make_key(stage, inputs if inputs else {}, upstream)
+        self.stage_keys[stage] = key
+        with self.telemetry.stage(stage) if self.telemetry else nullcontext({}) as stage_details:
+            return self.run_stage(stage, key, compute, inputs, encode, decode, cached, outputs, stage_details)
+
+    def run_stage(self, stage: str, key: str, compute: Callable, inputs: dict, encode: Callable, decode: Callable,
+                  cached: bool, outputs: List[str], stage_details: dict):
+        stage_details["cached"] = False
+        if not cached or not self.enabled:
+            return compute()
+        cache_file = self.cache_file(stage, key)
+        outputs_exist = all(os.path.isfile(output_file) for output_file in outputs) if outputs else True
+        if os.path.isfile(cache_file) and outputs_exist and not self.is_forced(stage):
+            with open(cache_file, 'rt') as fh:
+                cache_entry = json.load(fh)
+            sys.stdout.write(cache_entry["stdout"])
+            stage_details["cached"] = True
+            return decode(cache_entry["result"]) if decode else cache_entry["result"]
+        output = Tee(sys.stdout)
+        with redirect_stdout(output):
+            result = compute()
+        cache_entry = {
+            "stage": stage,
+            "key": key,
+            "inputs": inputs,
+            "stdout": output.getvalue(),
+            "result": encode(result) if encode else result
+        }
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # write to a temporary file first, so an interrupted run leaves no partial cache entry
+        with open(cache_file + ".tmp", 'wt') as fh:
+            json.dump(cache_entry, fh)
+        os.replace(cache_file + ".tmp", cache_file)
+        return result
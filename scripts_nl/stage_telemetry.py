@@ -0,0 +1,245 @@
+from typing import Dict, List
+from contextlib import contextmanager
+import datetime
+import json
+import os
+import re
+import resource
+import sys
+import time
+import tracemalloc
+
+from run_environment import get_environment
+
+TELEMETRY_VERSION = 1
+PROMETHEUS_METRICS = [
+    ("wall_seconds", "Wall clock seconds of an analysis stage"),
+    ("cpu_seconds", "CPU seconds of an analysis stage, in the main process"),
+    ("child_cpu_seconds", "CPU seconds of an analysis stage, in worker processes that finished"),
+    ("peak_rss_bytes", "Peak resident set size during an analysis stage"),
+    ("traced_peak_bytes", "Peak memory allocated by Python during an analysis stage, with memory tracing"),
+]
+
+
+def read_proc_status(field: str) -> int:
+    """returns a memory field of /proc/self/status in bytes, or None where there is no /proc"""
+    try:
+        with open("/proc/self/status", 'rt') as fh:
+            match = re.search(rf"^{field}:\s+(\d+) kB", fh.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return int(match.group(1)) * 1024 if match else None
+
+
+def reset_peak_rss() -> bool:
+    """resets the peak resident set size of the process, which is only possible on Linux"""
+    try:
+        with open("/proc/self/clear_refs", 'wt') as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_max_rss() -> int:
+    """peak resident set size of the process since it started, in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def get_child_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_top_allocators(start_snapshot: tracemalloc.Snapshot, end_snapshot: tracemalloc.Snapshot,
+                       top: int) -> List[dict]:
+    """returns the source lines that allocated most of the memory still in use at the end of a stage"""
+    # leave out the memory of the snapshots themselves
+    own_traces = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    start_snapshot, end_snapshot = start_snapshot.filter_traces(own_traces), end_snapshot.filter_traces(own_traces)
+    top_allocators = []
+    for stat in end_snapshot.compare_to(start_snapshot, "lineno")[:top]:
+        frame = stat.traceback[0]
+        top_allocators.append({
+            "file": frame.filename,
+            "line": frame.lineno,
+            "size_diff_bytes": stat.size_diff,
+            "count_diff": stat.count_diff
+        })
+    return top_allocators
+
+
+class StageTelemetry(object):
+
+    def __init__(self, report_file: str = None, prometheus_file: str = None, trace_memory: bool = False,
+                 top_allocators: int = 10, enabled: bool = True):
+        """
+        Measures the stages of the analysis: wall time, CPU time, peak resident set size and, with trace_memory,
+        the peak of Python allocations and the top_allocators source lines that allocated the most memory that
+        a stage kept. Memory tracing slows the analysis down considerably, so it is off by default.
+        Each stage is appended as a JSON line to report_file when it completes, after a line describing the
+        run, so an interrupted run keeps the stages that completed. Stages can be nested, e.g. to split
+        reading and scoring within the scoring stage. On close, the stages are written to prometheus_file in
+        the Prometheus text format, if it is given.
+        Peak RSS is reset at the start of each stage on Linux. Elsewhere it is the peak of the process so far.
+        """
+        self.report_file = report_file
+        self.prometheus_file = prometheus_file
+        self.trace_memory = trace_memory
+        self.top_allocators = top_allocators
+        self.enabled = enabled
+        self.run_id = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+        self.records = []
+        # the frames of the stages that are running, with the peaks reached before a nested stage reset them
+        self.frames = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.closed = False
+        if not enabled:
+            return
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if report_file:
+            self.write_record({
+                "type": "run",
+                "telemetry_version": TELEMETRY_VERSION,
+                "run_id": self.run_id,
+                "argv": sys.argv,
+                "trace_memory": trace_memory,
+                "environment": get_environment()
+            })
+
+    def write_record(self, record: dict) -> None:
+        if not self.report_file:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.report_file)), exist_ok=True)
+        with open(self.report_file, 'at') as fh:
+            fh.write(json.dumps(record) + "\n")
+
+    def read_peaks(self) -> Dict[str, int]:
+        return {
+            "peak_rss_bytes": read_proc_status("VmHWM") or get_max_rss(),
+            "traced_peak_bytes": tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        }
+
+    def reset_peaks(self) -> bool:
+        """keeps the peaks of the running stages before resetting them for a new stage"""
+        if self.frames:
+            parent_peaks = self.frames[-1]["peaks"]
+            for field, peak in self.read_peaks().items():
+                if peak is not None:
+                    parent_peaks[field] = max(parent_peaks.get(field) or 0, peak)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        return reset_peak_rss()
+
+    @contextmanager
+    def stage(self, name: str, **details):
+        """measures the code run inside the with block as a stage, details are added to its record"""
+        if not self.enabled:
+            yield {}
+            return
+        frame = {"peaks": {}, "details": dict(details)}
+        frame["rss_reset"] = self.reset_peaks()
+        parent = self.frames[-1]["name"] if self.frames else None
+        frame["name"] = f"{parent}.{name}" if parent else name
+        self.frames.append(frame)
+        start_snapshot = tracemalloc.take_snapshot() if self.trace_memory and self.top_allocators else None
+        started = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        start_wall, start_cpu, start_child_cpu = time.perf_counter(), time.process_time(), get_child_cpu_seconds()
+        status = "ok"
+        try:
+            # the caller can add details to the record while the stage runs
+            yield frame["details"]
+        except BaseException as error:
+            status = f"error: {type(error).__name__}"
+            raise
+        finally:
+            wall_seconds = time.perf_counter() - start_wall
+            cpu_seconds = time.process_time() - start_cpu
+            child_cpu_seconds = get_child_cpu_seconds() - start_child_cpu
+            self.frames.pop()
+            peaks = self.read_peaks()
+            for field, peak in frame["peaks"].items():
+                peaks[field] = max(peaks[field] or 0, peak)
+            record = dict({
+                "type": "stage",
+                "run_id": self.run_id,
+                "stage": frame["name"],
+                "parent": parent,
+                "status": status,
+                "started": started,
+                "wall_seconds": wall_seconds,
+                "cpu_seconds": cpu_seconds,
+                "child_cpu_seconds": child_cpu_seconds,
+                "rss_bytes": read_proc_status("VmRSS"),
+                "peak_rss_bytes": peaks["peak_rss_bytes"],
+                "peak_rss_scope": "stage" if frame["rss_reset"] else "process",
+                "traced_peak_bytes": peaks["traced_peak_bytes"],
+            }, **frame["details"])
+            if start_snapshot:
+                record["top_allocators"] = get_top_allocators(start_snapshot, tracemalloc.take_snapshot(),
+                                                              self.top_allocators)
+            self.records.append(record)
+            self.write_record(record)
+
+    def close(self, status: str = "ok") -> None:
+        if not self.enabled or self.closed:
+            return
+        self.closed = True
+        self.write_record({
+            "type": "run_end",
+            "run_id": self.run_id,
+            "status": status,
+            "wall_seconds": time.perf_counter() - self.start_wall,
+            "cpu_seconds": time.process_time() - self.start_cpu,
+            # resetting the peak for each stage also resets the peak of the process, so take the peak of the stages
+            "peak_rss_bytes": max([get_max_rss()] + [record["peak_rss_bytes"] or 0 for record in self.records])
+        })
+        if self.prometheus_file:
+            write_prometheus_file(self.records, self.prometheus_file, self.run_id)
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def print_summary(self) -> None:
+        print("\tstage\twall (s)\tcpu (s)\tpeak rss (MB)")
+        for record in self.records:
+            cached = " (cached)" if record.get("cached") else ""
+            peak_rss = record["peak_rss_bytes"] / 2**20 if record["peak_rss_bytes"] else 0
+            print(f"\t{record['stage']: <28}\t{record['wall_seconds']:.3f}\t"
+                  f"{record['cpu_seconds'] + record['child_cpu_seconds']:.3f}\t{peak_rss:.1f}{cached}")
+
+
+def format_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def write_prometheus_file(records: List[dict], prometheus_file: str, run_id: str) -> None:
+    """
+    Writes the stage measurements as gauges in the Prometheus text format, e.g. for the textfile collector
+    of the node exporter. The file is replaced as a whole, so it holds the last run. The run id is written
+    as a comment rather than a label, so that the series of a stage continue over runs.
+    """
+    lines = [f"# run_id {run_id}"]
+    for metric, description in PROMETHEUS_METRICS:
+        metric_name = f"reading_impact_stage_{metric}"
+        lines.append(f"# HELP {metric_name} {description}")
+        lines.append(f"# TYPE {metric_name} gauge")
+        for record in records:
+            if record.get(metric) is None:
+                continue
+            labels = {"stage": record["stage"], "status": record["status"],
+                      "cached": str(bool(record.get("cached"))).lower()}
+            label_string = ",".join(f'{label}="{format_label_value(value)}"' for label, value in labels.items())
+            lines.append(f"{metric_name}{{{label_string}}} {record[metric]}")
+    os.makedirs(os.path.dirname(os.path.abspath(prometheus_file)), exist_ok=True)
+    with open(prometheus_file + ".tmp", 'wt') as fh:
+        fh.write("\n".join(lines) + "\n")
+    os.replace(prometheus_file + ".tmp", prometheus_file)
+
+
+def read_report(report_file: str) -> List[dict]:
+    with open(report_file, 'rt') as fh:
+        return [json.loads(line) for line in fh if line.strip()]
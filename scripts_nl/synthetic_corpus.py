@@ -0,0 +1,339 @@
+from typing import Dict, Iterator, List, Tuple
+from collections import Counter, defaultdict
+import datetime
+import io
+import json
+import os
+import random
+import tarfile
+import numpy as np
+
+from alpino_archive import AlpinoArchiveReader
+from impact_model import ImpactModel, ImpactRule, is_wildcard_term
+from impact_scorer import make_alpino_sentence
+
+# word node attributes that are set by the position of the word in the synthetic sentence
+POSITION_ATTRIBUTES = ["@begin", "@end", "@id"]
+# human rating scale of each impact type
+IMPACT_TYPE_SCALES = {
+    "Affect": "emotional_scale",
+    "Style": "style_scale",
+    "Reflection": "reflection_scale",
+    "Narrative": "narrative_scale",
+}
+RATING_SCALES = ["emotional_scale", "style_scale", "reflection_scale", "narrative_scale"]
+EMOTIONAL_VALENCES = ["positive", "negative", "both"]
+# number of annotators of the done sentences in the shipped judgements
+ANNOTATOR_COUNTS = {1: 7, 2: 7, 3: 303, 4: 44, 5: 1}
+
+
+class Vocabulary(object):
+
+    def __init__(self, word_nodes: List[dict], counts: List[int], sentence_lengths: List[int]):
+        """
+        Word nodes (without position attributes) with their frequencies and the sentence lengths of a
+        parse archive, to draw synthetic sentences from.
+        """
+        self.word_nodes = word_nodes
+        self.probabilities = np.array(counts, dtype=float) / sum(counts)
+        self.sentence_lengths = np.array(sentence_lengths)
+        self.word_index = {}
+        self.lemma_index = {}
+        pos_postags = defaultdict(Counter)
+        # word nodes are in descending frequency, so the first node of a word or lemma is the most frequent one
+        for node_index, word_node in enumerate(word_nodes):
+            self.word_index.setdefault(word_node["@word"].lower(), node_index)
+            self.lemma_index.setdefault((word_node["@lemma"], word_node["@pos"]), node_index)
+            if "@postag" in word_node:
+                pos_postags[word_node["@pos"]][word_node["@postag"]] += counts[node_index]
+        self.pos_postags = {pos: postags.most_common(1)[0][0] for pos, postags in pos_postags.items()}
+        self.end_node = word_nodes[self.word_index["."]] if "." in self.word_index else None
+
+    @staticmethod
+    def from_archive(sentences_file: str) -> "Vocabulary":
+        node_counts = Counter()
+        node_attributes = {}
+        sentence_lengths = []
+        with AlpinoArchiveReader(sentences_file) as archive:
+            for sentence_id, sentence in archive.iter_sentences():
+                word_nodes = make_alpino_sentence(sentence).word_nodes
+                sentence_lengths.append(len(word_nodes))
+                for word_node in word_nodes:
+                    attributes = {key: value for key, value in word_node.items() if key not in POSITION_ATTRIBUTES}
+                    node_key = json.dumps(attributes, sort_keys=True)
+                    node_counts[node_key] += 1
+                    node_attributes[node_key] = attributes
+        node_keys, counts = zip(*node_counts.most_common())
+        return Vocabulary([node_attributes[node_key] for node_key in node_keys], list(counts), sentence_lengths)
+
+    def make_word_node(self, word: str, lemma: str = None, pos: str = None) -> dict:
+        """
+        Makes the attributes of a word node for a word that is inserted to make a rule match, from the
+        most frequent node with the same lemma and pos or the same word, or else from the word alone.
+        """
+        if lemma is not None and (lemma, pos) in self.lemma_index:
+            word_node = dict(self.word_nodes[self.lemma_index[(lemma, pos)]])
+        elif lemma is None and word.lower() in self.word_index:
+            return dict(self.word_nodes[self.word_index[word.lower()]])
+        else:
+            pos = pos if pos else "noun"
+            word_node = {"@lemma": lemma if lemma is not None else word, "@pos": pos, "@rel": "--"}
+            if pos in self.pos_postags:
+                word_node["@postag"] = self.pos_postags[pos]
+        word_node["@word"] = word
+        word_node["@root"] = word_node["@lemma"]
+        word_node["@sense"] = word_node["@lemma"]
+        return word_node
+
+
+def realize_pattern(pattern_source: str, rng: np.random.Generator, filler_words: List[str]) -> str:
+    """
+    Returns a string that a phrase, condition or wildcard pattern of the impact model matches. Handles
+    what the model patterns use: literals, groups with alternatives (one is chosen at random), .+ gaps
+    (filled with a random word), \\w* and repeated characters, and anchors.
+    """
+
+    def realize_sequence(position: int) -> Tuple[List[str], int]:
+        alternatives, current = [], []
+        while position < len(pattern_source):
+            char = pattern_source[position]
+            if char == "(":
+                group_text, position = realize_sequence(position + 1)
+                current.append(group_text)
+            elif char == ")":
+                alternatives.append("".join(current))
+                return alternatives[rng.integers(len(alternatives))], position + 1
+            elif char == "|":
+                alternatives.append("".join(current))
+                current = []
+                position += 1
+            elif pattern_source.startswith(".+", position):
+                current.append(f" {filler_words[rng.integers(len(filler_words))]} ")
+                position += 2
+            elif pattern_source.startswith("\\w*", position):
+                position += 3
+            elif pattern_source.startswith("\\w+", position):
+                current.append("e")
+                position += 3
+            elif char == "\\":
+                # \b needs no text, other escapes stand for the escaped character
+                if pattern_source[position + 1] != "b":
+                    current.append(pattern_source[position + 1])
+                position += 2
+            elif char in "^$*?":
+                # a starred character is realized once, anchors need no text
+                position += 1
+            else:
+                current.append(char)
+                position += 1
+        alternatives.append("".join(current))
+        return alternatives[rng.integers(len(alternatives))], position
+
+    return " ".join(realize_sequence(0)[0].split())
+
+
+class SyntheticCorpusGenerator(object):
+
+    def __init__(self, vocabulary: Vocabulary, impact_model: ImpactModel, hit_density: float = 0.3,
+                 sentences_per_review: float = 20.0, annotator_counts: Dict[int, float] = None,
+                 num_annotators: int = 100, na_rate: float = 0.1, missing_scale_rate: float = 0.005,
+                 done_fraction: float = 1.0, rating_noise: float = 1.0, seed: int = 0):
+        """
+        Generates sentences in the alpino_ds layout of the parse archives, and judgements of them in the
+        layout of the judgements file. Sentence words are drawn from the vocabulary of a real archive.
+        Per sentence, a Poisson number of impact rules (hit_density on average) is made to match, by
+        inserting a realization of the rule term or phrase and of its aspect or context condition.
+        Human ratings are higher on the scale of each impact type that was inserted. Annotations are
+        unanswerable with probability na_rate and miss a single scale with probability missing_scale_rate.
+        """
+        self.vocabulary = vocabulary
+        self.impact_model = impact_model
+        self.hit_density = hit_density
+        self.sentences_per_review = sentences_per_review
+        annotator_counts = annotator_counts if annotator_counts else ANNOTATOR_COUNTS
+        self.annotator_counts = list(annotator_counts.keys())
+        self.annotator_count_weights = list(annotator_counts.values())
+        self.annotators = [f"syn{annotator_index:04d}" for annotator_index in range(num_annotators)]
+        self.na_rate = na_rate
+        self.missing_scale_rate = missing_scale_rate
+        self.done_fraction = done_fraction
+        self.rating_noise = rating_noise
+        # separate streams, so that the sentences are the same whatever the judgement settings. Judgements
+        # take many single draws, which are cheaper from the random module than from numpy
+        sentence_seed, judgement_seed = np.random.SeedSequence(seed).spawn(2)
+        self.sentence_rng = np.random.default_rng(sentence_seed)
+        self.judgement_random = random.Random(int(judgement_seed.generate_state(1)[0]))
+        # rules that can be made to match: a rule with a filter matches when its condition does not hold
+        self.hit_rules = [impact_rule for impact_rule in impact_model.impact_rules
+                          if impact_rule.impact_type and not impact_rule.filter]
+        self.filler_words = [word_node["@word"] for word_node in vocabulary.word_nodes[:1000]
+                             if word_node["@pos"] not in ["punct", "name"]]
+        self.created = datetime.datetime(2019, 2, 1, tzinfo=datetime.timezone.utc)
+
+    def realize_term(self, term: str) -> str:
+        if is_wildcard_term(term):
+            return realize_pattern(self.impact_model.wildcard_pattern(term).pattern, self.sentence_rng,
+                                   self.filler_words)
+        return term
+
+    def make_phrase_nodes(self, phrase: str) -> List[dict]:
+        return [self.vocabulary.make_word_node(word) for word in phrase.split()]
+
+    def realize_rule(self, impact_rule: ImpactRule) -> Tuple[List[dict], bool]:
+        """returns the word nodes that make the rule match, and whether they must start the sentence"""
+        if impact_rule.impact_term.type == "phrase":
+            word_nodes = self.make_phrase_nodes(realize_pattern(impact_rule.pattern.pattern, self.sentence_rng,
+                                                                self.filler_words))
+        else:
+            lemma = self.realize_term(impact_rule.impact_term.string)
+            word_nodes = [self.vocabulary.make_word_node(lemma, lemma=lemma, pos=impact_rule.impact_term.pos)]
+        at_start = False
+        condition = impact_rule.condition
+        if condition and condition["condition_type"] == "aspect_term":
+            aspect_terms = list(self.impact_model.aspect_group_index.get(condition["aspect_group"], {}))
+            if aspect_terms:
+                aspect_term = self.realize_term(aspect_terms[self.sentence_rng.integers(len(aspect_terms))])
+                word_nodes.append(self.vocabulary.make_word_node(aspect_term, lemma=aspect_term, pos="noun"))
+        elif condition and condition["condition_type"] == "context_term":
+            context_nodes = self.make_phrase_nodes(realize_pattern(impact_rule.condition_pattern.pattern,
+                                                                   self.sentence_rng, self.filler_words))
+            # a context term anchored at the start of the sentence goes before the rule term
+            at_start = impact_rule.condition_pattern.pattern.startswith("^")
+            word_nodes = context_nodes + word_nodes if at_start else word_nodes + context_nodes
+        return word_nodes, at_start
+
+    def make_alpino_ds(self, word_nodes: List[dict]) -> dict:
+        leaves = []
+        for word_index, word_node in enumerate(word_nodes):
+            leaf = {"@begin": word_index, "@end": word_index + 1, "@id": word_index + 2}
+            leaf.update(word_node)
+            leaves.append(leaf)
+        sentence_string = " ".join(word_node["@word"] for word_node in word_nodes)
+        return {
+            "@version": 1.6,
+            "parser": {"@cats": 1.0, "@skips": 0.0},
+            "node": {"@begin": 0, "@cat": "top", "@end": len(leaves), "@id": 0, "@rel": "top",
+                     "node": [{"@begin": 0, "@cat": "du", "@end": len(leaves), "@id": 1, "@rel": "--",
+                               "node": leaves}]},
+            "sentence": {"@sentid": "1", "#text": sentence_string},
+            "comments": {"comment": f"Q#1|{sentence_string}|1|1|0.0"}
+        }
+
+    def make_sentence(self, num_words: int, word_draws: np.ndarray) -> Tuple[dict, List[str]]:
+        """returns the alpino_ds of a sentence and the impact types of the rules inserted in it"""
+        word_nodes = [self.vocabulary.word_nodes[node_index] for node_index in word_draws[:num_words]]
+        if self.vocabulary.end_node:
+            word_nodes.append(self.vocabulary.end_node)
+        impact_types = []
+        for _ in range(self.sentence_rng.poisson(self.hit_density)):
+            impact_rule = self.hit_rules[self.sentence_rng.integers(len(self.hit_rules))]
+            rule_nodes, at_start = self.realize_rule(impact_rule)
+            insert_index = 0 if at_start else int(self.sentence_rng.integers(len(word_nodes)))
+            word_nodes[insert_index:insert_index] = rule_nodes
+            impact_types.append(impact_rule.impact_type)
+        return self.make_alpino_ds(word_nodes), impact_types
+
+    def iter_sentences(self, num_sentences: int, batch_size: int = 1000) -> Iterator[Tuple[str, dict, List[str]]]:
+        """
+        Yields (sentence id, alpino_ds, inserted impact types) for num_sentences sentences. Sentence ids are
+        <review id>-<sentence index>, with a geometric number of sentences per review. Words are drawn for
+        a batch of sentences at a time.
+        """
+        review_id, sentence_index, review_length = 0, 0, 0
+        for batch_start in range(0, num_sentences, batch_size):
+            batch_lengths = self.sentence_rng.choice(self.vocabulary.sentence_lengths,
+                                                     size=min(batch_size, num_sentences - batch_start))
+            # the sentence end is added separately
+            batch_lengths = np.maximum(batch_lengths - 1, 1)
+            word_draws = self.sentence_rng.choice(len(self.vocabulary.word_nodes), size=batch_lengths.sum(),
+                                                  p=self.vocabulary.probabilities)
+            offsets = np.concatenate([[0], np.cumsum(batch_lengths)])
+            for num_words, offset in zip(batch_lengths, offsets[:-1]):
+                if sentence_index == review_length:
+                    review_id += 1
+                    sentence_index = 0
+                    review_length = self.sentence_rng.geometric(1 / self.sentences_per_review)
+                sentence_index += 1
+                alpino_ds, impact_types = self.make_sentence(num_words, word_draws[offset:])
+                yield f"{review_id}-{sentence_index}", alpino_ds, impact_types
+
+    def make_annotations(self, sentence_id: str, impact_types: List[str]) -> List[dict]:
+        num_annotators = min(self.judgement_random.choices(self.annotator_counts, self.annotator_count_weights)[0],
+                             len(self.annotators))
+        impact_scales = set(IMPACT_TYPE_SCALES[impact_type] for impact_type in impact_types)
+        annotations = []
+        for annotator in self.judgement_random.sample(self.annotators, num_annotators):
+            self.created += datetime.timedelta(seconds=self.judgement_random.randint(5, 120))
+            annotation = {"sentence_id": sentence_id, "annotator": annotator, "created": self.created.isoformat()}
+            unanswerable = self.judgement_random.random() < self.na_rate
+            if not unanswerable:
+                missing_scale = self.judgement_random.choice(RATING_SCALES) \
+                    if self.judgement_random.random() < self.missing_scale_rate else None
+                for rating_scale in RATING_SCALES:
+                    center = 3.0 if rating_scale in impact_scales else 0.5
+                    rating = min(max(round(self.judgement_random.gauss(center, self.rating_noise)), 0), 4)
+                    if rating_scale != missing_scale:
+                        annotation[rating_scale] = str(rating)
+                if annotation.get("emotional_scale", "0") == "0":
+                    annotation["emotional_valence"] = "na"
+                else:
+                    annotation["emotional_valence"] = self.judgement_random.choice(EMOTIONAL_VALENCES)
+            annotation["unanswerable"] = unanswerable
+            annotations.append(annotation)
+        return annotations
+
+    def make_judgement(self, sentence_id: str, text: str, impact_types: List[str], index_name: str) -> dict:
+        """makes a judgement record of a sentence, in the layout of the judgements file"""
+        annotations = []
+        annotation_status = "todo"
+        if self.judgement_random.random() < self.done_fraction:
+            annotation_status = "done"
+            annotations = self.make_annotations(sentence_id, impact_types)
+        return {
+            "_source": {"text": text, "sentence_id": sentence_id, "annotations": annotations,
+                        "annotation_status": annotation_status},
+            "_type": "impact_judgement",
+            "_id": sentence_id,
+            "_score": 1.0,
+            "_index": index_name
+        }
+
+
+def write_synthetic_corpus(generator: SyntheticCorpusGenerator, num_sentences: int, archive_file: str,
+                           judgements_file: str = None, corpus_name: str = "synthetic",
+                           compresslevel: int = 6) -> Counter:
+    """
+    Streams num_sentences generated sentences to a parse archive in the layout of the shipped archive
+    and, if judgements_file is given, their judgements to a JSON array file in the layout of the judgements
+    file. Neither is held in memory. Returns the number of inserted rule realizations per impact type.
+    The archive is compressed at gzip level 6 by default, which is much faster than the default level 9.
+    """
+    member_dir = f"{corpus_name}_sentences"
+    impact_type_freq = Counter()
+    judgements_fh = open(judgements_file, 'wt') if judgements_file else None
+    try:
+        if judgements_fh:
+            judgements_fh.write("[")
+        with tarfile.open(archive_file, 'w:gz', compresslevel=compresslevel) as tar:
+            directory = tarfile.TarInfo(member_dir)
+            directory.type = tarfile.DIRTYPE
+            directory.mode = 0o755
+            tar.addfile(directory)
+            for position, (sentence_id, alpino_ds, impact_types) in enumerate(generator.iter_sentences(num_sentences)):
+                content = json.dumps({"alpino_ds": json.dumps(alpino_ds), "sentence_id": sentence_id}).encode("utf-8")
+                member = tarfile.TarInfo(os.path.join(member_dir, f"{corpus_name}.sentence-{sentence_id}.alpino_parsed.json"))
+                member.size = len(content)
+                tar.addfile(member, fileobj=io.BytesIO(content))
+                # tarfile keeps the header of every member it adds, which is not needed for writing
+                tar.members.clear()
+                impact_type_freq.update(impact_types)
+                if judgements_fh:
+                    judgement = generator.make_judgement(sentence_id, alpino_ds["sentence"]["#text"], impact_types,
+                                                         corpus_name)
+                    judgements_fh.write(("," if position else "") + json.dumps(judgement))
+        if judgements_fh:
+            judgements_fh.write("]")
+    finally:
+        if judgements_fh:
+            judgements_fh.close()
+    return impact_type_freq
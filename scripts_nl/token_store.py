@@ -0,0 +1,162 @@
+from typing import Iterable, Iterator
+import json
+import mmap
+
+from alpino_archive import AlpinoArchiveReader
+from alpino_matcher import AlpinoSentence
+from section_file import StringTable, make_uint_array, read_section_file, uint_array_bytes, uint_array_view
+from section_file import write_section_file
+
+# A token store file consists of the magic bytes, the length of a JSON header and the header,
+# followed by the sections listed in the header. All integer arrays are unsigned 32 bit little endian.
+#   string_offsets  start offset of each interned string in string_data, plus the end offset
+#   string_data     UTF-8 encoded interned strings
+#   sentence_ids    string id of the sentence id of each sentence
+#   sentence_texts  string id of the sentence string of each sentence
+#   token_offsets   index of the first token of each sentence, plus the total number of tokens
+#   token_words     string id of the (cleaned) word of each token
+#   token_lemmas    string id of the (cleaned) lemma of each token
+#   token_pos       string id of the part of speech of each token
+STORE_MAGIC = b"ALPTOKS1"
+STORE_VERSION = 1
+ARRAY_SECTIONS = ["string_offsets", "sentence_ids", "sentence_texts", "token_offsets",
+                  "token_words", "token_lemmas", "token_pos"]
+
+
+def write_token_store(alpino_sentences: Iterable, store_file: str) -> int:
+    """
+    Write (sentence_id, AlpinoSentence) pairs to a columnar token store file.
+    Only the sentence string and the word, lemma and pos of each word node are kept.
+    Returns the number of sentences written.
+    """
+    string_table = StringTable()
+    columns = {section: make_uint_array() for section in ARRAY_SECTIONS}
+    columns["token_offsets"].append(0)
+    for sentence_id, alpino_sentence in alpino_sentences:
+        columns["sentence_ids"].append(string_table.intern(sentence_id))
+        columns["sentence_texts"].append(string_table.intern(str(alpino_sentence.sentence_string)))
+        for word_node in alpino_sentence.word_nodes:
+            columns["token_words"].append(string_table.intern(word_node["@word"]))
+            columns["token_lemmas"].append(string_table.intern(word_node["@lemma"]))
+            columns["token_pos"].append(string_table.intern(word_node["@pos"]))
+        columns["token_offsets"].append(len(columns["token_words"]))
+    string_data = bytearray()
+    for string in string_table.strings:
+        columns["string_offsets"].append(len(string_data))
+        string_data += string.encode("utf-8")
+    columns["string_offsets"].append(len(string_data))
+    sections = {section: uint_array_bytes(columns[section]) for section in ARRAY_SECTIONS}
+    sections["string_data"] = bytes(string_data)
+    header = {
+        "store_version": STORE_VERSION,
+        "num_sentences": len(columns["sentence_ids"]),
+        "num_tokens": len(columns["token_words"]),
+        "num_strings": len(string_table.strings),
+    }
+    write_section_file(store_file, STORE_MAGIC, header, sections)
+    return header["num_sentences"]
+
+
+def convert_archive(archive_file: str, store_file: str, sentence_ids: Iterable[str] = None) -> int:
+    """one-time conversion of all or the given sentences of an Alpino parse archive to a token store"""
+    with AlpinoArchiveReader(archive_file) as sentence_reader:
+        alpino_sentences = ((sentence_id, AlpinoSentence(json.loads(sentence["alpino_ds"])))
+                            for sentence_id, sentence in sentence_reader.iter_sentences(sentence_ids))
+        return write_token_store(alpino_sentences, store_file)
+
+
+class TokenStore(object):
+
+    def __init__(self, store_file: str):
+        """
+        Read-only access to a token store file. The file is memory-mapped and the integer arrays are
+        read in place, strings are decoded from the mapped string data when they are first used.
+        """
+        self.store_file = store_file
+        self.fh = open(store_file, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header, section_views = read_section_file(self.mm, STORE_MAGIC, store_file)
+        if self.header["store_version"] != STORE_VERSION:
+            raise ValueError(f"unsupported token store version {self.header['store_version']}")
+        for section, section_view in section_views.items():
+            if section in ARRAY_SECTIONS:
+                section_view = uint_array_view(section_view)
+            setattr(self, section, section_view)
+        self.strings = [None] * self.header["num_strings"]
+        self.sentence_index = None
+
+    def __len__(self) -> int:
+        return self.header["num_sentences"]
+
+    def get_string(self, string_id: int) -> str:
+        string = self.strings[string_id]
+        if string is None:
+            start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+            string = str(self.string_data[start:end], "utf-8")
+            self.strings[string_id] = string
+        return string
+
+    def get_sentence_id(self, sentence_index: int) -> str:
+        return self.get_string(self.sentence_ids[sentence_index])
+
+    def index_of(self, sentence_id: str) -> int:
+        if self.sentence_index is None:
+            self.sentence_index = {self.get_sentence_id(index): index for index in range(len(self))}
+        return self.sentence_index[sentence_id]
+
+    def get(self, sentence_id: str) -> "StoredAlpinoSentence":
+        return StoredAlpinoSentence(self, self.index_of(sentence_id))
+
+    def __getitem__(self, sentence_id: str) -> "StoredAlpinoSentence":
+        return self.get(sentence_id)
+
+    def __iter__(self) -> Iterator["StoredAlpinoSentence"]:
+        for sentence_index in range(len(self)):
+            yield StoredAlpinoSentence(self, sentence_index)
+
+    def close(self) -> None:
+        for section in self.header["sections"]:
+            getattr(self, section).release()
+        self.mm.close()
+        self.fh.close()
+
+
+class StoredTokenNode(object):
+
+    __slots__ = ["store", "token_index"]
+
+    def __init__(self, store: TokenStore, token_index: int):
+        """word node backed by a token store, readable like the @word, @lemma and @pos fields of an Alpino node"""
+        self.store = store
+        self.token_index = token_index
+
+    def __getitem__(self, field: str) -> str:
+        if field == "@word":
+            return self.store.get_string(self.store.token_words[self.token_index])
+        elif field == "@lemma":
+            return self.store.get_string(self.store.token_lemmas[self.token_index])
+        elif field == "@pos":
+            return self.store.get_string(self.store.token_pos[self.token_index])
+        raise KeyError(field)
+
+    def __contains__(self, field: str) -> bool:
+        return field in ["@word", "@lemma", "@pos"]
+
+
+class StoredAlpinoSentence(AlpinoSentence):
+
+    def __init__(self, store: TokenStore, sentence_index: int):
+        """AlpinoSentence read from a token store. It has no parse tree (alpino_ds is None)."""
+        self.store = store
+        self.sentence_index = sentence_index
+        self.sentence_id = store.get_sentence_id(sentence_index)
+        self.sentence_string = store.get_string(store.sentence_texts[sentence_index])
+        self.alpino_ds = None
+        first_token, end_token = store.token_offsets[sentence_index], store.token_offsets[sentence_index + 1]
+        self.word_nodes = [StoredTokenNode(store, token_index) for token_index in range(first_token, end_token)]
+
+
+if __name__ == "__main__":
+    from config import config
+    num_sentences = convert_archive(config['alpino_sentences_file'], config['alpino_token_store_file'])
+    print(f"\twrote {num_sentences} sentences to token store {config['alpino_token_store_file']}")